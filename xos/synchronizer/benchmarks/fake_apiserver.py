@@ -0,0 +1,481 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    fake_apiserver.py
+
+    An in-memory stand-in for the Kubernetes API server, served over HTTP on localhost, for benchmarking the
+    synchronizer with the real kubernetes client. It implements enough of the API for the sync and pull steps:
+    discovery, get, list (with limit and continue), watch, create, replace, merge and strategic merge patch, and
+    delete, for the resource kinds in RESOURCES. Every request is counted by verb and resource.
+
+    It is not a validating server. Objects are stored as the JSON they were sent as, with metadata filled in.
+"""
+
+import collections
+import copy
+import json
+import threading
+import time
+import uuid
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qs
+
+# (apiVersion, plural) -> (kind, namespaced)
+RESOURCES = {("v1", "namespaces"): ("Namespace", False),
+             ("v1", "pods"): ("Pod", True),
+             ("v1", "configmaps"): ("ConfigMap", True),
+             ("v1", "secrets"): ("Secret", True),
+             ("v1", "serviceaccounts"): ("ServiceAccount", True),
+             ("v1", "services"): ("Service", True),
+             ("apps/v1", "deployments"): ("Deployment", True),
+             ("apps/v1", "replicasets"): ("ReplicaSet", True),
+             ("apps/v1", "statefulsets"): ("StatefulSet", True),
+             ("apps/v1", "daemonsets"): ("DaemonSet", True),
+             ("batch/v1", "jobs"): ("Job", True)}
+
+VERSION = {"major": "1", "minor": "14", "gitVersion": "v1.14.0", "gitCommit": "fake", "gitTreeState": "clean",
+           "buildDate": "2019-03-25T15:45:25Z", "goVersion": "go1.12.1", "compiler": "gc", "platform": "linux/amd64"}
+
+
+class ApiError(Exception):
+    def __init__(self, code, reason, message):
+        super(ApiError, self).__init__(message)
+        self.code = code
+        self.reason = reason
+        self.message = message
+
+    def status(self):
+        return {"kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Failure",
+                "message": self.message, "reason": self.reason, "code": self.code}
+
+
+def merge_patch(obj, patch, strategic=False):
+    """ Apply a JSON merge patch to obj, in place. If strategic is True, lists of objects with a name, such as
+        containers and volumes, are merged by name rather than replaced, as a strategic merge patch would.
+    """
+    for (k, v) in patch.items():
+        if v is None:
+            obj.pop(k, None)
+        elif isinstance(v, dict) and isinstance(obj.get(k), dict):
+            merge_patch(obj[k], v, strategic)
+        elif strategic and isinstance(v, list) and isinstance(obj.get(k), list) and \
+                all(isinstance(item, dict) and ("name" in item) for item in v + obj[k]):
+            existing = collections.OrderedDict((item["name"], item) for item in obj[k])
+            for item in v:
+                if item["name"] in existing:
+                    merge_patch(existing[item["name"]], item, strategic)
+                else:
+                    existing[item["name"]] = copy.deepcopy(item)
+            obj[k] = list(existing.values())
+        else:
+            obj[k] = copy.deepcopy(v)
+    return obj
+
+
+class FakeApiServer(object):
+    """
+        FakeApiServer
+
+        Holds the objects, keyed by (apiVersion, plural) and then by (namespace, name), and a log of every change,
+        which watches are served from. seed() and remove() change objects without going through HTTP, so that a
+        benchmark can set up the cluster, or simulate changes made by other clients, without the requests being
+        counted.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.lock = threading.Condition()
+        self.objects = collections.defaultdict(dict)
+        self.events = []  # (resourceVersion, apiVersion, plural, type, object)
+        self.resource_version = 1
+        self.requests = collections.Counter()  # (verb, resource) -> count
+        self.stopped = False
+
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self))
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.httpd.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake_apiserver")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests = collections.Counter()
+
+    def request_counts(self):
+        with self.lock:
+            return dict(self.requests)
+
+    # Object storage
+
+    def self_link(self, api_version, plural, namespace, name):
+        if "/" in api_version:
+            path = "/apis/%s" % api_version
+        else:
+            path = "/api/%s" % api_version
+        if namespace:
+            path += "/namespaces/%s" % namespace
+        return "%s/%s/%s" % (path, plural, name)
+
+    def record(self, api_version, plural, event_type, obj):
+        """ Give obj a new resourceVersion and append the change to the event log. Called with the lock held. """
+        self.resource_version += 1
+        obj["metadata"]["resourceVersion"] = str(self.resource_version)
+        self.events.append((self.resource_version, api_version, plural, event_type, copy.deepcopy(obj)))
+        self.lock.notify_all()
+
+    def store(self, api_version, plural, namespace, obj, event_type):
+        """ Fill in the server-set fields of obj and store it. Called with the lock held. """
+        (kind, namespaced) = RESOURCES[(api_version, plural)]
+        metadata = obj.setdefault("metadata", {})
+        name = metadata["name"]
+        obj["kind"] = kind
+        obj["apiVersion"] = api_version
+        if namespaced:
+            metadata["namespace"] = namespace
+        metadata["selfLink"] = self.self_link(api_version, plural, namespace, name)
+        metadata.setdefault("uid", str(uuid.uuid4()))
+        metadata.setdefault("creationTimestamp", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+        if kind == "Pod":
+            obj.setdefault("status", {"phase": "Running", "podIP": "10.0.%d.%d" % ((self.resource_version >> 8) & 255,
+                                                                                  self.resource_version & 255)})
+        elif kind == "Namespace":
+            obj.setdefault("status", {"phase": "Active"})
+        self.objects[(api_version, plural)][(namespace, name)] = obj
+        self.record(api_version, plural, event_type, obj)
+        return obj
+
+    def seed(self, api_version, plural, obj):
+        """ Create or replace an object directly, for example to simulate a controller creating pods. """
+        with self.lock:
+            namespace = obj.get("metadata", {}).get("namespace")
+            existing = self.objects[(api_version, plural)].get((namespace, obj["metadata"]["name"]))
+            return copy.deepcopy(self.store(api_version, plural, namespace, copy.deepcopy(obj),
+                                            "MODIFIED" if existing else "ADDED"))
+
+    def remove(self, api_version, plural, namespace, name):
+        """ Delete an object directly. Returns False if it did not exist. """
+        with self.lock:
+            return self.delete_locked(api_version, plural, namespace, name) is not None
+
+    def delete_locked(self, api_version, plural, namespace, name):
+        obj = self.objects[(api_version, plural)].pop((namespace, name), None)
+        if obj is None:
+            return None
+        self.record(api_version, plural, "DELETED", obj)
+        if plural == "namespaces":
+            # Deleting a namespace deletes everything in it
+            for (key, objects) in self.objects.items():
+                for (ns, n) in [k for k in objects.keys() if k[0] == name]:
+                    self.delete_locked(key[0], key[1], ns, n)
+        return obj
+
+    def list_objects(self, api_version, plural, namespace=None):
+        with self.lock:
+            return [copy.deepcopy(obj) for (key, obj) in sorted(self.objects[(api_version, plural)].items())
+                    if (namespace is None) or (key[0] == namespace)]
+
+    def count(self, api_version, plural):
+        with self.lock:
+            return len(self.objects[(api_version, plural)])
+
+    # Request handling
+
+    def parse_path(self, path):
+        """ Return (api_version, plural, namespace, name, subresource). plural is None for discovery. """
+        parts = [p for p in path.split("/") if p]
+        if parts[:1] == ["api"] and len(parts) >= 2:
+            api_version = parts[1]
+            rest = parts[2:]
+        elif parts[:1] == ["apis"] and len(parts) >= 3:
+            api_version = "%s/%s" % (parts[1], parts[2])
+            rest = parts[3:]
+        else:
+            raise ApiError(404, "NotFound", "the server could not find the requested resource")
+
+        namespace = None
+        if (len(rest) >= 3) and (rest[0] == "namespaces"):
+            namespace = rest[1]
+            rest = rest[2:]
+        if not rest:
+            return (api_version, None, None, None, None)
+
+        plural = rest[0]
+        if (api_version, plural) not in RESOURCES:
+            raise ApiError(404, "NotFound", "the server could not find the requested resource")
+        name = rest[1] if len(rest) > 1 else None
+        subresource = rest[2] if len(rest) > 2 else None
+        return (api_version, plural, namespace, name, subresource)
+
+    def discovery(self, api_version):
+        resources = [{"name": plural, "kind": kind, "namespaced": namespaced, "verbs": []}
+                     for ((v, plural), (kind, namespaced)) in RESOURCES.items() if v == api_version]
+        if not resources:
+            raise ApiError(404, "NotFound", "the server could not find the requested resource")
+        return {"kind": "APIResourceList", "groupVersion": api_version, "resources": resources}
+
+    def check_namespace(self, namespace):
+        if (None, namespace) not in self.objects[("v1", "namespaces")]:
+            raise ApiError(404, "NotFound", "namespaces \"%s\" not found" % namespace)
+
+    def get(self, api_version, plural, namespace, name):
+        with self.lock:
+            obj = self.objects[(api_version, plural)].get((namespace, name))
+            if obj is None:
+                raise ApiError(404, "NotFound", "%s \"%s\" not found" % (plural, name))
+            return copy.deepcopy(obj)
+
+    def list(self, api_version, plural, namespace, limit=None, continue_token=None):
+        (kind, namespaced) = RESOURCES[(api_version, plural)]
+        with self.lock:
+            keys = sorted(k for k in self.objects[(api_version, plural)].keys()
+                          if (namespace is None) or (k[0] == namespace))
+            start = int(continue_token or 0)
+            end = len(keys)
+            if limit:
+                end = min(end, start + limit)
+            items = []
+            for key in keys[start:end]:
+                item = copy.deepcopy(self.objects[(api_version, plural)][key])
+                # Items in a list do not carry their kind
+                item.pop("kind", None)
+                item.pop("apiVersion", None)
+                items.append(item)
+            metadata = {"resourceVersion": str(self.resource_version)}
+            if end < len(keys):
+                metadata["continue"] = str(end)
+            return {"kind": kind + "List", "apiVersion": api_version, "metadata": metadata, "items": items}
+
+    def create(self, api_version, plural, namespace, body):
+        with self.lock:
+            name = (body.get("metadata") or {}).get("name")
+            if not name:
+                raise ApiError(422, "Invalid", "metadata.name is required")
+            if RESOURCES[(api_version, plural)][1]:
+                self.check_namespace(namespace)
+            if (namespace, name) in self.objects[(api_version, plural)]:
+                raise ApiError(409, "AlreadyExists", "%s \"%s\" already exists" % (plural, name))
+            body["metadata"].pop("resourceVersion", None)
+            return copy.deepcopy(self.store(api_version, plural, namespace, body, "ADDED"))
+
+    def replace(self, api_version, plural, namespace, name, body):
+        with self.lock:
+            existing = self.objects[(api_version, plural)].get((namespace, name))
+            if existing is None:
+                raise ApiError(404, "NotFound", "%s \"%s\" not found" % (plural, name))
+            body.setdefault("metadata", {})["uid"] = existing["metadata"]["uid"]
+            body["metadata"]["creationTimestamp"] = existing["metadata"]["creationTimestamp"]
+            if "status" in existing:
+                body.setdefault("status", existing["status"])
+            return copy.deepcopy(self.store(api_version, plural, namespace, body, "MODIFIED"))
+
+    def patch(self, api_version, plural, namespace, name, body, content_type):
+        with self.lock:
+            existing = self.objects[(api_version, plural)].get((namespace, name))
+            if content_type == "application/apply-patch+yaml":
+                # JSON is valid YAML, and the synchronizer sends JSON
+                if existing is None:
+                    body.setdefault("metadata", {})["name"] = name
+                    return copy.deepcopy(self.store(api_version, plural, namespace, body, "ADDED"))
+                strategic = True
+            elif content_type == "application/strategic-merge-patch+json":
+                strategic = True
+            elif content_type == "application/merge-patch+json":
+                strategic = False
+            else:
+                raise ApiError(415, "UnsupportedMediaType", "the body of the request was in an unknown format")
+            if existing is None:
+                raise ApiError(404, "NotFound", "%s \"%s\" not found" % (plural, name))
+            obj = merge_patch(copy.deepcopy(existing), body, strategic)
+            obj["metadata"]["name"] = name
+            obj["metadata"]["uid"] = existing["metadata"]["uid"]
+            return copy.deepcopy(self.store(api_version, plural, namespace, obj, "MODIFIED"))
+
+    def delete(self, api_version, plural, namespace, name):
+        with self.lock:
+            obj = self.delete_locked(api_version, plural, namespace, name)
+            if obj is None:
+                raise ApiError(404, "NotFound", "%s \"%s\" not found" % (plural, name))
+            return {"kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Success",
+                    "details": {"name": name, "kind": plural, "uid": obj["metadata"]["uid"]}}
+
+    def watch_events(self, api_version, plural, namespace, resource_version, timeout):
+        """ Yield the watch events that follow resource_version, waiting up to timeout seconds for more. A watch
+            without a resource_version starts with an ADDED event for every current object.
+        """
+        def matches(v, p, obj):
+            return ((v, p) == (api_version, plural)) and \
+                ((namespace is None) or (obj["metadata"].get("namespace") == namespace))
+
+        deadline = time.time() + timeout
+        with self.lock:
+            if not resource_version:
+                pending = [{"type": "ADDED", "object": obj}
+                           for obj in self.list_objects(api_version, plural, namespace)]
+                position = len(self.events)
+            elif self.events and (resource_version < self.events[0][0] - 1):
+                pending = [{"type": "ERROR", "object": ApiError(410, "Expired", "too old resource version").status()}]
+                position = None
+            else:
+                # Events are in resourceVersion order, so search back for the first one after resource_version
+                pending = []
+                position = len(self.events)
+                while (position > 0) and (self.events[position - 1][0] > resource_version):
+                    position -= 1
+
+        while True:
+            for event in pending:
+                yield event
+            if position is None:
+                return
+
+            with self.lock:
+                pending = []
+                while True:
+                    while position < len(self.events):
+                        (rv, v, p, event_type, obj) = self.events[position]
+                        position += 1
+                        if matches(v, p, obj):
+                            pending.append({"type": event_type, "object": obj})
+                    remaining = deadline - time.time()
+                    if pending or self.stopped or (remaining <= 0):
+                        break
+                    self.lock.wait(min(remaining, 0.5))
+                if not pending:
+                    return
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_handler(server):
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, code, obj):
+            data = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return None
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+
+        def count(self, verb, plural, subresource=None):
+            resource = plural or "discovery"
+            if subresource:
+                resource = "%s/%s" % (plural, subresource)
+            with server.lock:
+                server.requests[(verb, resource)] += 1
+
+        def stream_watch(self, api_version, plural, namespace, query):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            resource_version = int(query.get("resourceVersion") or 0)
+            timeout = int(query.get("timeoutSeconds") or 60)
+            for event in server.watch_events(api_version, plural, namespace, resource_version, timeout):
+                data = (json.dumps(event) + "\n").encode("utf-8")
+                self.wfile.write(("%x\r\n" % len(data)).encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            self.close_connection = True
+
+        def handle_request(self, method):
+            url = urlparse(self.path)
+            query = dict((k, v[-1]) for (k, v) in parse_qs(url.query).items())
+            try:
+                if url.path.rstrip("/") == "/version":
+                    self.count("GET", "version")
+                    return self.send_json(200, VERSION)
+
+                (api_version, plural, namespace, name, subresource) = server.parse_path(url.path)
+                if plural is None:
+                    self.count(method, None)
+                    return self.send_json(200, server.discovery(api_version))
+                if subresource:
+                    self.count(method, plural, subresource)
+                    raise ApiError(404, "NotFound", "subresource %s is not supported" % subresource)
+
+                if method == "GET" and name:
+                    self.count("GET", plural)
+                    return self.send_json(200, server.get(api_version, plural, namespace, name))
+                if method == "GET" and query.get("watch") in ["true", "True", "1"]:
+                    self.count("WATCH", plural)
+                    return self.stream_watch(api_version, plural, namespace, query)
+                if method == "GET":
+                    self.count("LIST", plural)
+                    limit = int(query["limit"]) if query.get("limit") else None
+                    return self.send_json(200, server.list(api_version, plural, namespace, limit,
+                                                           query.get("continue")))
+
+                self.count(method, plural)
+                if method == "POST":
+                    return self.send_json(201, server.create(api_version, plural, namespace, self.read_body()))
+                if method == "PUT":
+                    return self.send_json(200, server.replace(api_version, plural, namespace, name,
+                                                              self.read_body()))
+                if method == "PATCH":
+                    content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+                    return self.send_json(200, server.patch(api_version, plural, namespace, name,
+                                                            self.read_body(), content_type))
+                if method == "DELETE":
+                    self.read_body()
+                    return self.send_json(200, server.delete(api_version, plural, namespace, name))
+                raise ApiError(405, "MethodNotAllowed", "method %s is not supported" % method)
+            except ApiError as e:
+                self.send_json(e.code, e.status())
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def do_PUT(self):
+            self.handle_request("PUT")
+
+        def do_PATCH(self):
+            self.handle_request("PATCH")
+
+        def do_DELETE(self):
+            self.handle_request("DELETE")
+
+    return Handler
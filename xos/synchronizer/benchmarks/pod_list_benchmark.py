@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    pod_list_benchmark.py
+
+    Compare the two ways of turning a pod list response into PodSnapshots:
+
+        client - deserialize into kubernetes client objects, then extract snapshots (the old pull step path)
+        raw    - parse the JSON directly into snapshots (parse_pod_list)
+
+    Each measurement runs in a fresh process, so that peak memory can be read from getrusage.
+
+    Usage: python pod_list_benchmark.py [count ...]
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+DEFAULT_COUNTS = [1000, 10000, 50000]
+
+
+def make_pod(i):
+    """ Return a pod in API server JSON form, with roughly the fields a real pod carries. """
+    namespace = "namespace-%d" % (i % 20)
+    name = "app-%d-5d8f7c9b4-%05d" % (i % 200, i)
+    return {"metadata": {"name": name,
+                         "namespace": namespace,
+                         "selfLink": "/api/v1/namespaces/%s/pods/%s" % (namespace, name),
+                         "uid": "00000000-0000-0000-0000-%012d" % i,
+                         "resourceVersion": str(1000 + i),
+                         "creationTimestamp": "2019-03-07T14:49:00Z",
+                         "labels": {"app": "app-%d" % (i % 200), "pod-template-hash": "5d8f7c9b4"},
+                         "annotations": {"kubernetes.io/psp": "privileged"},
+                         "ownerReferences": [{"apiVersion": "apps/v1",
+                                              "kind": "ReplicaSet",
+                                              "name": "app-%d-5d8f7c9b4" % (i % 200),
+                                              "uid": "11111111-0000-0000-0000-%012d" % (i % 200),
+                                              "controller": True,
+                                              "blockOwnerDeletion": True}]},
+            "spec": {"serviceAccount": "default",
+                     "serviceAccountName": "default",
+                     "nodeName": "node-%d" % (i % 50),
+                     "restartPolicy": "Always",
+                     "containers": [{"name": "main",
+                                     "image": "registry.example.com/app:1.%d" % (i % 10),
+                                     "ports": [{"containerPort": 8080, "protocol": "TCP"}],
+                                     "env": [{"name": "ENV_%d" % j, "value": "value-%d" % j} for j in range(5)],
+                                     "resources": {"limits": {"cpu": "500m", "memory": "256Mi"}},
+                                     "volumeMounts": [{
+                                         "name": "default-token",
+                                         "readOnly": True,
+                                         "mountPath": "/var/run/secrets/kubernetes.io/serviceaccount"}]}],
+                     "volumes": [{"name": "default-token",
+                                  "secret": {"secretName": "default-token", "defaultMode": 420}}]},
+            "status": {"phase": "Running",
+                       "podIP": "10.%d.%d.%d" % ((i >> 16) & 255, (i >> 8) & 255, i & 255),
+                       "hostIP": "192.168.0.%d" % (i % 50),
+                       "startTime": "2019-03-07T14:49:00Z",
+                       "conditions": [{"type": t, "status": "True", "lastTransitionTime": "2019-03-07T14:49:00Z"}
+                                      for t in ["Initialized", "Ready", "ContainersReady", "PodScheduled"]],
+                       "containerStatuses": [{"name": "main", "ready": True, "restartCount": 0,
+                                              "image": "registry.example.com/app:1.%d" % (i % 10),
+                                              "imageID": "docker-pullable://registry.example.com/app@sha256:0",
+                                              "state": {"running": {"startedAt": "2019-03-07T14:49:00Z"}}}]}}
+
+
+def make_pod_list(count):
+    return json.dumps({"kind": "PodList",
+                       "apiVersion": "v1",
+                       "metadata": {"resourceVersion": "99999"},
+                       "items": [make_pod(i) for i in range(count)]})
+
+
+class RawResponse(object):
+    """ Stands in for the urllib3 response that the kubernetes client deserializes """
+
+    def __init__(self, data):
+        self.data = data
+
+
+def parse_client(data):
+    from kubernetes import client as kubernetes_client
+    from pod_snapshot import PodSnapshot
+    pod_list = kubernetes_client.ApiClient().deserialize(RawResponse(data), "V1PodList")
+    return [PodSnapshot.from_k8s(item) for item in pod_list.items]
+
+
+def parse_raw(data):
+    from pod_snapshot import parse_pod_list
+    return parse_pod_list(data)[0]
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_one(path, count):
+    """ Measure one path in this process, and print the result as JSON """
+    parse = {"client": parse_client, "raw": parse_raw}[path]
+
+    # Import everything before taking the baseline, so that the memory used by the modules is not counted as part
+    # of the parse. The names are not used here.
+    from kubernetes import client as kubernetes_client  # noqa: F401 imported to load the module before measuring
+    import pod_snapshot  # noqa: F401 imported to load the module before measuring
+
+    data = make_pod_list(count)
+    baseline = peak_rss_kb()
+
+    start = time.time()
+    pods = parse(data)
+    elapsed = time.time() - start
+
+    assert len(pods) == count
+    print(json.dumps({"path": path, "count": count, "seconds": elapsed, "peak_kb": peak_rss_kb() - baseline}))
+
+
+def main(counts):
+    print("%8s %8s %10s %12s" % ("pods", "path", "seconds", "peak MB"))
+    for count in counts:
+        for path in ["client", "raw"]:
+            output = subprocess.check_output([sys.executable, os.path.realpath(__file__), "--run", path, str(count)])
+            result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+            print("%8d %8s %10.3f %12.1f" % (count, path, result["seconds"], result["peak_kb"] / 1024.0))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--run":
+        run_one(sys.argv[2], int(sys.argv[3]))
+    else:
+        main([int(arg) for arg in sys.argv[1:]] or DEFAULT_COUNTS)
@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    sync_benchmark.py
+
+    Run the real sync steps and KubernetesServiceInstancePullStep against a fake Kubernetes API server
+    (fake_apiserver.py) and the mock model accessor used by the unit tests, and report wall time, Kubernetes API
+    requests, XOS queries and writes, and peak memory.
+
+    XOS is seeded with a KubernetesService and, in each of --namespaces trust domains, a principal, a slice,
+    --configmaps ConfigMaps, --secrets Secrets and --xos-pods KubernetesServiceInstances that mount the first of
+    each. The cluster is seeded with --controllers Deployments per namespace, each with a ReplicaSet of --pods pods,
+    in namespaces of their own, as if created outside of XOS.
+
+    Scenarios:
+
+        cold_start   - the first sync cycle and the first pull cycle, with nothing synced and empty caches
+        steady_state - after a cold start, a cycle in which nothing changed, then a cycle in which every XOS object
+                       is requeued
+        churn        - after a cold start, a cycle in which --churn of the external pods were replaced by pods with
+                       new names, and --churn of the XOS pods were given a new image
+
+    The sync engine is emulated the way the synchronizer runs it: for each step, fetch_pending() is called on one
+    instance of the step, and sync_record() or delete_record() on a new instance for every pending object. Each
+    scenario runs in a fresh process, so that peak memory can be read from getrusage.
+
+    The mock model accessor is built by the unit test framework, so this needs the same environment as the unit
+    tests.
+
+    Usage: python sync_benchmark.py [--scenario NAME] [--namespaces N] [--pods N] ... (see --help)
+"""
+
+import argparse
+import collections
+import functools
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+benchmark_dir = os.path.dirname(os.path.realpath(__file__))
+synchronizer_dir = os.path.join(benchmark_dir, "..")
+test_path = os.path.join(synchronizer_dir, "tests")
+
+sys.path.append(synchronizer_dir)
+sys.path.append(os.path.join(synchronizer_dir, "steps"))
+sys.path.append(os.path.join(synchronizer_dir, "pull_steps"))
+sys.path.append(test_path)
+
+SCENARIOS = ["cold_start", "steady_state", "churn"]
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ModelStore(object):
+    """
+        ModelStore
+
+        The XOS objects seen by the mock model accessor. The objects manager of every model is pointed at the
+        store, and save() and delete() of every model write to it. Reads of a manager (all, filter, first, get, ...)
+        are counted as queries, and saves and deletes as writes, by model.
+
+        Objects that are new, or that are saved with always_update_timestamp, are pending and returned by
+        fetch_pending() until mark_synced() is called, as the XOS core would. Deleted objects are pending deletion
+        until purge() is called.
+    """
+
+    def __init__(self, model_classes, object_list_class):
+        self.model_classes = model_classes
+        self.object_list_class = object_list_class
+        self.lock = threading.RLock()
+        self.objects = collections.defaultdict(list)
+        self.deleted = collections.defaultdict(list)
+        self.dirty = set()
+        self.next_id = 1
+        self.queries = collections.Counter()
+        self.writes = collections.Counter()
+
+    def install(self):
+        store = self
+
+        def save(obj, *args, **kwargs):
+            store.save(obj, *args, **kwargs)
+
+        def delete(obj, *args, **kwargs):
+            store.delete(obj)
+
+        for (name, model) in self.model_classes.items():
+            model.objects.get_items = functools.partial(self.get_items, name)
+            deleted_objects = self.object_list_class([])
+            deleted_objects.get_items = functools.partial(self.get_deleted_items, name)
+            model.deleted_objects = deleted_objects
+            model.save = save
+            model.delete = delete
+
+    def model_name(self, obj):
+        return obj.__class__.__name__
+
+    def get_items(self, name):
+        with self.lock:
+            self.queries[name] += 1
+            return list(self.objects[name])
+
+    def get_deleted_items(self, name):
+        with self.lock:
+            self.queries[name] += 1
+            return list(self.deleted[name])
+
+    def add(self, obj, pending=True):
+        """ Add a seed object, without counting a write """
+        with self.lock:
+            if not obj.id:
+                obj.id = self.next_id
+                self.next_id += 1
+            self.objects[self.model_name(obj)].append(obj)
+            if pending:
+                self.dirty.add(obj)
+            else:
+                obj.enacted = obj.updated = time.time()
+        return obj
+
+    def save(self, obj, update_fields=None, always_update_timestamp=False, **kwargs):
+        with self.lock:
+            self.writes[self.model_name(obj)] += 1
+            if not obj.id:
+                self.add(obj)
+            elif always_update_timestamp:
+                obj.updated = time.time()
+                self.dirty.add(obj)
+
+    def delete(self, obj):
+        with self.lock:
+            self.writes[self.model_name(obj)] += 1
+            name = self.model_name(obj)
+            if obj in self.objects[name]:
+                self.objects[name].remove(obj)
+                self.deleted[name].append(obj)
+            self.dirty.discard(obj)
+
+    def touch(self, obj):
+        """ Requeue obj, as if it had been changed in XOS """
+        with self.lock:
+            obj.updated = time.time()
+            self.dirty.add(obj)
+
+    def fetch_pending(self, model_classes, deletion):
+        names = [m.__name__ for m in model_classes]
+        with self.lock:
+            if deletion:
+                return [obj for name in names for obj in self.deleted[name]]
+            return [obj for name in names for obj in self.objects[name] if obj in self.dirty]
+
+    def mark_synced(self, obj):
+        with self.lock:
+            obj.enacted = time.time()
+            self.dirty.discard(obj)
+
+    def purge(self, obj):
+        with self.lock:
+            name = self.model_name(obj)
+            if obj in self.deleted[name]:
+                self.deleted[name].remove(obj)
+
+    def count(self, name):
+        with self.lock:
+            return len(self.objects[name])
+
+    def reset_counts(self):
+        with self.lock:
+            self.queries = collections.Counter()
+            self.writes = collections.Counter()
+
+
+class BenchmarkModelAccessor(object):
+    """ The model_accessor passed to the sync steps. Only fetch_pending is used by SyncStep. """
+
+    def __init__(self, store):
+        self.store = store
+
+    def fetch_pending(self, model_classes, deletion=False):
+        return self.store.fetch_pending(model_classes, deletion)
+
+
+class FakeKafkaProducer(object):
+    """ Delivers every event as soon as it is flushed """
+
+    def __init__(self):
+        self.callbacks = []
+        self.produced = 0
+
+    def produce(self, topic, value, key, callback=None):
+        self.produced += 1
+        if callback:
+            self.callbacks.append(callback)
+
+    def poll(self, timeout):
+        self.flush(timeout)
+
+    def flush(self, timeout=None):
+        callbacks = self.callbacks
+        self.callbacks = []
+        for callback in callbacks:
+            callback(None, None)
+
+
+class Benchmark(object):
+    """
+        Benchmark
+
+        Sets up the fake API server, the model store and the synchronizer's steps, and runs sync and pull cycles,
+        measuring each one.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.models = {}
+        self.phases = []
+        self.errors = collections.Counter()
+        self.external_pods = []  # (namespace, replicaset, name) of the pods seeded as if created outside of XOS
+
+    # Setup
+
+    def setup(self):
+        from unit_test_common import setup_sync_unit_test
+        unittest_setup = setup_sync_unit_test(test_path, self.models, [("kubernetes-service", "kubernetes.xproto")])
+
+        from mock_modelaccessor import MockObjectList
+        self.store = ModelStore(unittest_setup["model_accessor"].all_model_classes, MockObjectList)
+        self.store.install()
+        self.model_accessor = BenchmarkModelAccessor(self.store)
+
+        from fake_apiserver import FakeApiServer
+        self.server = FakeApiServer().start()
+
+        from kubernetes import client as kubernetes_client
+        import kubernetes_clients
+        configuration = kubernetes_client.Configuration()
+        configuration.host = self.server.url
+        if self.args.api_qps is not None:
+            kubernetes_clients.api_qps = self.args.api_qps
+        kubernetes_clients.api_client = kubernetes_clients.build_api_client(configuration)
+
+        from event_publisher import publisher
+        self.kafka_producer = FakeKafkaProducer()
+        publisher.get_producer = lambda: self.kafka_producer
+        self.publisher = publisher
+
+        from sync_trustdomain import SyncTrustDomain
+        from sync_principal import SyncPrincipal
+        from sync_configmap import SyncKubernetesConfigMap
+        from sync_secret import SyncKubernetesSecret
+        from sync_kubernetesserviceinstance import SyncKubernetesServiceInstance
+        from pull_pods import KubernetesServiceInstancePullStep
+
+        # In dependency order
+        self.sync_steps = [SyncTrustDomain, SyncPrincipal, SyncKubernetesConfigMap, SyncKubernetesSecret,
+                           SyncKubernetesServiceInstance]
+        self.pull_step = KubernetesServiceInstancePullStep
+
+        for step_class in self.sync_steps:
+            step_class.create_first = self.args.create_first
+            step_class.parallel_workers = self.args.parallel_workers
+            if hasattr(step_class, "cascade_namespace_delete"):
+                step_class.cascade_namespace_delete = self.args.cascade_namespace_delete
+        self.pull_step.watch_pods = self.args.watch_pods
+        self.pull_step.bulk_list_controllers = self.args.bulk_list_controllers
+
+        self.seed_xos()
+        self.seed_cluster()
+
+    def seed_xos(self):
+        m = self.models
+        add = self.store.add
+
+        self.service = add(m["KubernetesService"](name="kubernetes"), pending=False)
+        self.site = add(m["Site"](name="mysite", login_base="mysite"), pending=False)
+        self.image = add(m["Image"](name="xos/benchmark", tag="1.0", kind="container", xos_managed=True),
+                         pending=False)
+
+        self.xos_pods = []
+        for i in range(self.args.namespaces):
+            trust_domain = add(m["TrustDomain"](name="xos-%d" % i, owner=self.service, owner_id=self.service.id,
+                                                xos_managed=True))
+            principal = add(m["Principal"](name="xos-sa", trust_domain=trust_domain,
+                                           trust_domain_id=trust_domain.id, xos_managed=True))
+            slice = add(m["Slice"](name="xos-%d-slice" % i, site=self.site, site_id=self.site.id,
+                                   trust_domain=trust_domain, trust_domain_id=trust_domain.id,
+                                   principal=principal, principal_id=principal.id, xos_managed=True),
+                        pending=False)
+
+            config_maps = []
+            for j in range(self.args.configmaps):
+                config_maps.append(add(m["KubernetesConfigMap"](name="config-%d" % j,
+                                                               trust_domain=trust_domain,
+                                                               trust_domain_id=trust_domain.id,
+                                                               data=json.dumps({"key-%d" % k: "value-%d" % k
+                                                                                for k in range(5)}))))
+            secrets = []
+            for j in range(self.args.secrets):
+                secrets.append(add(m["KubernetesSecret"](name="secret-%d" % j,
+                                                         trust_domain=trust_domain,
+                                                         trust_domain_id=trust_domain.id,
+                                                         data=json.dumps({"password": "c2VjcmV0"}))))
+
+            for j in range(self.args.xos_pods):
+                pod = add(m["KubernetesServiceInstance"](name="xos-%d-pod-%d" % (i, j), owner=self.service,
+                                                         owner_id=self.service.id, slice=slice, slice_id=slice.id,
+                                                         image=self.image, image_id=self.image.id,
+                                                         xos_managed=True, need_event=False))
+                if config_maps:
+                    add(m["KubernetesConfigVolumeMount"](config=config_maps[0], config_id=config_maps[0].id,
+                                                         service_instance=pod, service_instance_id=pod.id,
+                                                         mount_path="/etc/config", sub_path=None),
+                        pending=False)
+                if secrets:
+                    add(m["KubernetesSecretVolumeMount"](secret=secrets[0], secret_id=secrets[0].id,
+                                                         service_instance=pod, service_instance_id=pod.id,
+                                                         mount_path="/etc/secret", sub_path=None),
+                        pending=False)
+                self.xos_pods.append(pod)
+
+    def seed_cluster(self):
+        for i in range(self.args.namespaces):
+            namespace = "external-%d" % i
+            self.server.seed("v1", "namespaces", {"metadata": {"name": namespace}})
+            self.server.seed("v1", "serviceaccounts", {"metadata": {"name": "default", "namespace": namespace}})
+            for j in range(self.args.controllers):
+                deployment = self.server.seed("apps/v1", "deployments",
+                                              {"metadata": {"name": "app-%d" % j, "namespace": namespace,
+                                                            "labels": {"app": "app-%d" % j}},
+                                               "spec": {"replicas": self.args.pods,
+                                                        "selector": {"matchLabels": {"app": "app-%d" % j}},
+                                                        "template": {"metadata": {"labels": {"app": "app-%d" % j}},
+                                                                     "spec": {"containers": []}}}})
+                replica_set = self.seed_replica_set(namespace, deployment, "app-%d-0" % j)
+                for k in range(self.args.pods):
+                    self.seed_pod(namespace, replica_set, "%s-%05d" % (replica_set["metadata"]["name"], k))
+
+    def owner_reference(self, owner):
+        return {"apiVersion": owner["apiVersion"], "kind": owner["kind"], "name": owner["metadata"]["name"],
+                "uid": owner["metadata"]["uid"], "controller": True, "blockOwnerDeletion": True}
+
+    def seed_replica_set(self, namespace, deployment, name):
+        return self.server.seed("apps/v1", "replicasets",
+                                {"metadata": {"name": name, "namespace": namespace,
+                                              "ownerReferences": [self.owner_reference(deployment)]},
+                                 "spec": deployment["spec"]})
+
+    def seed_pod(self, namespace, replica_set, name, image="registry.example.com/app:1.0"):
+        self.server.seed("v1", "pods",
+                         {"metadata": {"name": name, "namespace": namespace,
+                                       "labels": {"app": replica_set["metadata"]["name"]},
+                                       "ownerReferences": [self.owner_reference(replica_set)]},
+                          "spec": {"serviceAccount": "default", "serviceAccountName": "default",
+                                   "containers": [{"name": "main", "image": image}]}})
+        self.external_pods.append((namespace, replica_set, name))
+
+    def wait_for_informers(self, timeout=60):
+        import informer
+        deadline = time.time() + timeout
+        for i in list(informer.informers.values()):
+            while not i.has_synced():
+                if time.time() > deadline:
+                    raise Exception("Informer %s did not sync" % i.name)
+                time.sleep(0.05)
+
+    # Cycles
+
+    def run_sync_cycle(self):
+        """ Run every sync step over its pending objects, then every step over its pending deletions """
+        for deletion in [False, True]:
+            steps = self.sync_steps if not deletion else list(reversed(self.sync_steps))
+            for step_class in steps:
+                pending = step_class(model_accessor=self.model_accessor).fetch_pending(deletion)
+                for o in pending:
+                    step = step_class(model_accessor=self.model_accessor)
+                    try:
+                        if deletion:
+                            step.delete_record(o)
+                            self.store.purge(o)
+                        else:
+                            step.sync_record(o)
+                            self.store.mark_synced(o)
+                    except Exception as e:
+                        self.errors["%s: %s" % (step_class.__name__, e)] += 1
+
+    def run_pull_cycle(self):
+        try:
+            self.pull_step(model_accessor=self.model_accessor).pull_records()
+        except Exception as e:
+            self.errors["%s: %s" % (self.pull_step.__name__, e)] += 1
+        self.publisher.drain()
+
+    def measure(self, name, func):
+        self.server.reset_counts()
+        self.store.reset_counts()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        requests = self.server.request_counts()
+        self.phases.append({"phase": name,
+                            "seconds": elapsed,
+                            "api_requests": sum(requests.values()),
+                            "api_requests_by_kind": sorted(["%s %s" % k, v] for (k, v) in requests.items()),
+                            "xos_queries": sum(self.store.queries.values()),
+                            "xos_writes": sum(self.store.writes.values())})
+
+    def cycle(self):
+        self.run_sync_cycle()
+        self.run_pull_cycle()
+
+    # Scenarios
+
+    def cold_start(self):
+        self.measure("sync", self.run_sync_cycle)
+        self.measure("pull", self.run_pull_cycle)
+
+    def warm_up(self):
+        self.cycle()
+        # The pull step's new objects and their Kafka events
+        self.cycle()
+        self.wait_for_informers()
+        self.errors.clear()
+
+    def steady_state(self):
+        self.warm_up()
+        self.measure("idle cycle", self.cycle)
+        for name in ["TrustDomain", "Principal", "KubernetesConfigMap", "KubernetesSecret",
+                     "KubernetesServiceInstance"]:
+            for obj in list(self.store.objects[name]):
+                self.store.touch(obj)
+        self.measure("resync all", self.run_sync_cycle)
+
+    def churn(self):
+        self.warm_up()
+
+        count = int(len(self.external_pods) * self.args.churn)
+        replaced = self.external_pods[:count]
+        self.external_pods = self.external_pods[count:]
+        for (namespace, replica_set, name) in replaced:
+            self.server.remove("v1", "pods", namespace, name)
+            self.seed_pod(namespace, replica_set, name + "-r")
+
+        new_image = self.store.add(self.models["Image"](name="xos/benchmark", tag="2.0", kind="container",
+                                                       xos_managed=True), pending=False)
+        for pod in self.xos_pods[:int(len(self.xos_pods) * self.args.churn)]:
+            pod.image = new_image
+            pod.image_id = new_image.id
+            self.store.touch(pod)
+
+        self.measure("pull", self.run_pull_cycle)
+        self.measure("sync", self.run_sync_cycle)
+
+    def run(self, scenario):
+        self.setup()
+        setup_rss = peak_rss_kb()
+        if self.args.trace_dir:
+            import tracing
+            tracing.trace_file = os.path.join(self.args.trace_dir, "%s.json" % scenario)
+            tracing.profile_dir = self.args.trace_dir
+        getattr(self, scenario)()
+        self.server.stop()
+        return {"scenario": scenario,
+                "phases": self.phases,
+                "errors": sorted([k, v] for (k, v) in self.errors.items()),
+                "xos_objects": dict((name, self.store.count(name)) for name in
+                                    ["TrustDomain", "Principal", "Slice", "KubernetesServiceInstance"]),
+                "cluster_pods": self.server.count("v1", "pods"),
+                "setup_peak_kb": setup_rss,
+                "peak_kb": peak_rss_kb()}
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the sync and pull steps against a fake API server")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="scenario to run; may be repeated (default: all)")
+    parser.add_argument("--namespaces", type=int, default=10, help="XOS trust domains, and external namespaces")
+    parser.add_argument("--controllers", type=int, default=10, help="external Deployments per namespace")
+    parser.add_argument("--pods", type=int, default=5, help="pods per external Deployment")
+    parser.add_argument("--xos-pods", type=int, default=5, help="KubernetesServiceInstances per trust domain")
+    parser.add_argument("--configmaps", type=int, default=5, help="KubernetesConfigMaps per trust domain")
+    parser.add_argument("--secrets", type=int, default=5, help="KubernetesSecrets per trust domain")
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of pods changed by the churn scenario")
+    parser.add_argument("--create-first", action="store_true", help="set create_first on the sync steps")
+    parser.add_argument("--parallel-workers", type=int, default=0, help="set parallel_workers on the sync steps")
+    parser.add_argument("--cascade-namespace-delete", action="store_true",
+                        help="set cascade_namespace_delete on the sync steps")
+    parser.add_argument("--watch-pods", action="store_true", help="set watch_pods on the pod pull step")
+    parser.add_argument("--bulk-list-controllers", action="store_true",
+                        help="set bulk_list_controllers on the pod pull step")
+    parser.add_argument("--api-qps", type=float, help="set api_qps on the API client (0 disables rate limiting)")
+    parser.add_argument("--trace-dir", help="write a trace of each scenario, and a profile of each pull cycle, here")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    return parser
+
+
+def print_result(result):
+    print("%s: %d pods in the cluster, peak %.1f MB (%.1f MB after setup)" %
+          (result["scenario"], result["cluster_pods"], result["peak_kb"] / 1024.0, result["setup_peak_kb"] / 1024.0))
+    print("  %-12s %10s %12s %12s %12s" % ("phase", "seconds", "api calls", "xos queries", "xos writes"))
+    for phase in result["phases"]:
+        print("  %-12s %10.3f %12d %12d %12d" % (phase["phase"], phase["seconds"], phase["api_requests"],
+                                                phase["xos_queries"], phase["xos_writes"]))
+        for (kind, count) in phase["api_requests_by_kind"]:
+            print("      %-30s %8d" % (kind, count))
+    for (error, count) in result["errors"]:
+        print("  error (x%d): %s" % (count, error))
+
+
+def main(argv):
+    args = make_parser().parse_args(argv)
+
+    if args.run:
+        print(json.dumps(Benchmark(args).run(args.run)))
+        # Exit without waiting for the informer and server threads, which are blocked on their sockets
+        sys.stdout.flush()
+        os._exit(0)
+
+    results = []
+    for scenario in args.scenario or SCENARIOS:
+        # Pass every option through to a fresh process for each scenario
+        child_argv = [a for a in argv if a != "--json"]
+        output = subprocess.check_output([sys.executable, os.path.realpath(__file__), "--run", scenario] + child_argv)
+        result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+        results.append(result)
+        if not args.json:
+            print_result(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,175 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    event_publisher.py
+
+    Publish Kafka events from a background thread, so that a slow or unavailable broker does not stall the pull
+    steps.
+"""
+
+import functools
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from xosconfig import Config
+from multistructlog import create_logger
+from metrics import KAFKA_PUBLISH_SECONDS
+
+log = create_logger(Config().get('logging'))
+
+
+class EventPublisher(object):
+    """
+        EventPublisher
+
+        A bounded queue of events, drained by a background thread that hands them to the Kafka producer in batches
+        and waits for the delivery reports. The on_delivered callback of an event is called, from the publisher's
+        thread, only once the broker has confirmed delivery.
+
+        publish() never blocks. It returns False without queueing the event when the queue is full, or when an event
+        with the same pending_key has not been delivered yet. Callers should treat this as "try again later".
+    """
+
+    max_queue_size = 10000
+    batch_size = 500
+    delivery_timeout = 10
+
+    # While delivery reports are outstanding, how long to wait for new events before polling the producer for them
+    poll_interval = 1
+
+    def __init__(self):
+        self.queue = queue.Queue(self.max_queue_size)
+        self.lock = threading.Lock()
+        self.pending_keys = set()
+        self.thread = None
+
+    def start(self):
+        if self.thread:
+            return
+        self.thread = threading.Thread(target=self.run, name="event_publisher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get_producer(self):
+        from xoskafka import xoskafkaproducer
+        return xoskafkaproducer.kafka_producer
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def publish(self, topic, key, value, on_delivered=None, pending_key=None):
+        with self.lock:
+            if (pending_key is not None) and (pending_key in self.pending_keys):
+                return False
+            try:
+                self.queue.put_nowait((topic, key, value, on_delivered, pending_key))
+            except queue.Full:
+                log.warning("Event queue is full, deferring event", topic=topic, key=key)
+                return False
+            if pending_key is not None:
+                self.pending_keys.add(pending_key)
+        return True
+
+    def release(self, event):
+        (topic, key, value, on_delivered, pending_key) = event
+        if pending_key is not None:
+            with self.lock:
+                self.pending_keys.discard(pending_key)
+
+    def delivery_report(self, event, err, msg):
+        (topic, key, value, on_delivered, pending_key) = event
+        try:
+            if err:
+                log.error("Event failed delivery", topic=topic, key=key, err=err)
+            elif on_delivered:
+                on_delivered()
+        except Exception:
+            log.exception("Failed to process delivery report", topic=topic, key=key)
+        finally:
+            self.release(event)
+
+    def send_batch(self, batch):
+        producer = self.get_producer()
+        if producer is None:
+            log.error("Kafka producer is not available, dropping events", count=len(batch))
+            for event in batch:
+                self.release(event)
+            return
+
+        with KAFKA_PUBLISH_SECONDS.time():
+            for event in batch:
+                (topic, key, value, on_delivered, pending_key) = event
+                try:
+                    producer.produce(topic, value, key, callback=functools.partial(self.delivery_report, event))
+                except Exception:
+                    log.exception("Failed to produce event", topic=topic, key=key)
+                    self.release(event)
+                producer.poll(0)
+
+            # Wait for the delivery reports. Any that are still outstanding are collected by poll().
+            producer.flush(self.delivery_timeout)
+
+    def poll(self):
+        """ Collect the delivery reports of events that were still outstanding when send_batch() returned. """
+        producer = self.get_producer()
+        if producer is not None:
+            producer.poll(0)
+
+    def has_pending(self):
+        with self.lock:
+            return bool(self.pending_keys)
+
+    def next_batch(self, block, timeout=None):
+        batch = []
+        try:
+            batch.append(self.queue.get(block, timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def drain(self):
+        """ Send every queued event from the calling thread. """
+        batch = self.next_batch(block=False)
+        while batch:
+            self.send_batch(batch)
+            batch = self.next_batch(block=False)
+
+    def run_once(self):
+        if self.has_pending():
+            # Do not block indefinitely while delivery reports are outstanding. Until they arrive, their pending keys
+            # are held and publish() rejects new events for the same keys.
+            batch = self.next_batch(block=True, timeout=self.poll_interval)
+        else:
+            batch = self.next_batch(block=True)
+        if batch:
+            self.send_batch(batch)
+        else:
+            self.poll()
+
+    def run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("Event publisher failed")
+
+
+publisher = EventPublisher()
@@ -34,3 +34,89 @@ def debug_once(msg, *args, **kwargs):
         log.debug("[Further messages suppressed] " + msg, *args, **kwargs)
 
     squelched_messages[msg] = count + 1
+
+
+def data_merge_patch(current, desired):
+    """ Compute a JSON merge patch that turns the data dictionary current into desired. Keys that are added or
+        changed map to their new value, and keys that are removed map to None. Returns an empty dictionary if the
+        two are equal.
+    """
+    current = current or {}
+    desired = desired or {}
+    patch = {}
+    for (k, v) in desired.items():
+        if current.get(k) != v:
+            patch[k] = v
+    for k in current.keys():
+        if k not in desired:
+            patch[k] = None
+    return patch
+
+
+def create_ignore_conflict(create_func, *args, **kwargs):
+    """ Call a kubernetes client create function. Returns the created object, or None if an object with the same
+        name already exists (409 Conflict).
+    """
+    try:
+        return create_func(*args, **kwargs)
+    except Exception as e:
+        if getattr(e, "status", None) == 409:
+            return None
+        raise
+
+
+def delete_ignore_missing(delete_func, *args, **kwargs):
+    """ Call a kubernetes client delete function. Returns True if the object was deleted, or False if it did not
+        exist (404 Not Found).
+    """
+    try:
+        delete_func(*args, **kwargs)
+        return True
+    except Exception as e:
+        if getattr(e, "status", None) == 404:
+            return False
+        raise
+
+
+def deleted_with_namespace(trust_domain_id):
+    """ Return True if the TrustDomain with the given id is being deleted and is owned by KubernetesService. Deleting
+        its namespace deletes every resource in the namespace, so those resources need not be deleted one at a time.
+    """
+    from xossynchronizer.modelaccessor import TrustDomain
+
+    if not trust_domain_id:
+        return False
+    try:
+        trust_domains = TrustDomain.deleted_objects.filter(id=trust_domain_id)
+        if not trust_domains:
+            return False
+        return "KubernetesService" in trust_domains[0].owner.leaf_model.class_names
+    except Exception:
+        # If we can't tell, delete the resource as usual
+        log.exception("Unable to determine whether trust domain is being deleted", trust_domain_id=trust_domain_id)
+        return False
+
+
+def get_kubernetes_service_ids(deleted=False):
+    """ Return the set of ids of KubernetesServices. If deleted is True, KubernetesServices that are being deleted are
+        included.
+    """
+    from xossynchronizer.modelaccessor import KubernetesService
+
+    services = list(KubernetesService.objects.all())
+    if deleted:
+        services += list(KubernetesService.deleted_objects.all())
+    return set([s.id for s in services])
+
+
+def get_kubernetes_trust_domain_ids(deleted=False):
+    """ Return the set of ids of TrustDomains owned by KubernetesService, using one query per model rather than
+        following each TrustDomain's owner. If deleted is True, objects that are being deleted are included.
+    """
+    from xossynchronizer.modelaccessor import TrustDomain
+
+    service_ids = get_kubernetes_service_ids(deleted)
+    trust_domains = list(TrustDomain.objects.all())
+    if deleted:
+        trust_domains += list(TrustDomain.deleted_objects.all())
+    return set([t.id for t in trust_domains if t.owner_id in service_ids])
@@ -0,0 +1,161 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    informer.py
+
+    Process-wide caches of Kubernetes resources, kept up to date by list+watch. Sync steps read from these caches
+    instead of issuing a GET to the API server before every create or patch.
+"""
+
+import copy
+import threading
+import time
+
+from xosconfig import Config
+from multistructlog import create_logger
+from metrics import record_cache_lookup
+
+log = create_logger(Config().get('logging'))
+
+
+class Informer(object):
+    """
+        Informer
+
+        Caches every object of one resource kind, keyed by (namespace, name). Cluster-scoped objects use a namespace
+        of None. A background thread lists the resource once and then follows the watch stream, relisting if the
+        watch expires.
+
+        Until the first list has completed, has_synced() returns False, and callers should read from the API server
+        instead.
+
+        If transform is given, each object is passed through it before being cached, so that an informer for a
+        numerous resource kind can keep only the fields its callers use.
+    """
+
+    watch_timeout_seconds = 300
+    retry_seconds = 5
+
+    def __init__(self, name, list_func, transform=None):
+        """
+            name - name of the resource, used for logging
+            list_func - a kubernetes client list function such as CoreV1Api.list_config_map_for_all_namespaces
+            transform - optional function that returns the part of an object to cache
+        """
+        self.name = name
+        self.list_func = list_func
+        self.transform = transform
+        self.objects = {}
+        self.resource_version = None
+        self.synced = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="informer-%s" % self.name)
+        thread.daemon = True
+        thread.start()
+
+    def has_synced(self):
+        return self.synced.is_set()
+
+    def key(self, obj):
+        return (obj.metadata.namespace, obj.metadata.name)
+
+    def cached(self, obj):
+        if self.transform:
+            return self.transform(obj)
+        return obj
+
+    def get(self, namespace, name):
+        """ Return a copy of the cached object, or None if it does not exist. A copy is returned so callers can
+            modify it the same way they would modify the result of a read.
+        """
+        with self.lock:
+            obj = self.objects.get((namespace, name))
+        record_cache_lookup(self.name, obj is not None)
+        if obj is None:
+            return None
+        return copy.deepcopy(obj)
+
+    def relist(self):
+        ret = self.list_func(watch=False)
+        objects = {}
+        for item in ret.items:
+            objects[self.key(item)] = self.cached(item)
+        with self.lock:
+            self.objects = objects
+        self.resource_version = ret.metadata.resource_version
+        self.synced.set()
+        log.info("Informer listed resources", informer=self.name, count=len(objects))
+
+    def apply_event(self, event):
+        """ Apply one event from the watch stream to the cache. Returns False if the watch has expired and the
+            resource needs to be relisted.
+        """
+        if event["type"] == "ERROR":
+            status = event["raw_object"]
+            if status.get("code") == 410:
+                return False
+            raise Exception("Watch of %s failed: %s" % (self.name, status.get("message")))
+
+        obj = event["object"]
+        with self.lock:
+            if event["type"] == "DELETED":
+                self.objects.pop(self.key(obj), None)
+            else:
+                self.objects[self.key(obj)] = self.cached(obj)
+        self.resource_version = obj.metadata.resource_version
+        return True
+
+    def watch(self):
+        from kubernetes import watch as kubernetes_watch
+
+        w = kubernetes_watch.Watch()
+        for event in w.stream(self.list_func,
+                              resource_version=self.resource_version,
+                              timeout_seconds=self.watch_timeout_seconds):
+            if not self.apply_event(event):
+                log.info("Informer watch expired, relisting", informer=self.name)
+                self.resource_version = None
+                w.stop()
+                break
+
+    def run(self):
+        while True:
+            try:
+                if self.resource_version is None:
+                    self.relist()
+                self.watch()
+            except Exception as e:
+                if getattr(e, "status", None) == 410:
+                    self.resource_version = None
+                    continue
+                log.exception("Informer failed, retrying", informer=self.name)
+                time.sleep(self.retry_seconds)
+
+
+informers = {}
+informers_lock = threading.Lock()
+
+
+def get_informer(name, list_func, transform=None):
+    """ Return the process-wide informer for the named resource, starting it if necessary. """
+    with informers_lock:
+        informer = informers.get(name)
+        if not informer:
+            informer = Informer(name, list_func, transform)
+            informers[name] = informer
+            informer.start()
+    return informer
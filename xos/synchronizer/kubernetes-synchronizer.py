@@ -46,4 +46,13 @@ logging.getLogger("kubernetes.client.rest").setLevel(logging.WARNING)
 # init kafka producer connection
 XOSKafkaProducer.init()
 
+# pod events are published to kafka from a background thread
+from event_publisher import publisher
+publisher.start()
+
+# serve prometheus metrics
+import metrics
+metrics.watch_queue_depth(publisher)
+metrics.start_metrics_server()
+
 Synchronizer().run()
@@ -0,0 +1,118 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    kubernetes_clients.py
+
+    The Kubernetes API clients used by the sync and pull steps. In-cluster credentials are loaded once per process,
+    and every API object shares one ApiClient, so steps reuse the same pool of keep-alive connections to the API
+    server instead of each opening their own.
+"""
+
+import socket
+import threading
+
+from xosconfig import Config
+from multistructlog import create_logger
+from metrics import instrument_api_client
+from tracing import trace_api_client
+from ratelimit import AdaptiveRateLimiter, rate_limit_api_client
+
+log = create_logger(Config().get('logging'))
+
+# Maximum number of connections kept open to the API server. Informer watches each hold a connection, so this should
+# cover those plus the number of threads making requests at the same time.
+connection_pool_maxsize = 32
+
+# Enable TCP keepalive on connections to the API server, so idle connections in the pool are not silently dropped
+# by NAT or load balancers between the synchronizer and the API server.
+tcp_keepalive = True
+
+# Requests per second sent to the API server, shared by every step, and the number of requests that may be sent at
+# once after a quiet period. The rate is lowered automatically while the API server is throttling requests. A qps of 0
+# disables client-side rate limiting, but throttled requests are still retried.
+api_qps = 50
+api_burst = 100
+
+# Number of times a request rejected with 429 Too Many Requests or 503 Service Unavailable is retried, after the
+# Retry-After delay given by the API server
+api_max_retries = 5
+
+api_client = None
+api_client_lock = threading.Lock()
+
+
+def create_api_client():
+    from kubernetes import client as kubernetes_client, config as kubernetes_config
+
+    kubernetes_config.load_incluster_config()
+
+    # Configuration() returns a copy of the default configuration set by load_incluster_config()
+    client = build_api_client(kubernetes_client.Configuration())
+
+    log.info("Created Kubernetes API client", host=client.configuration.host,
+             connection_pool_maxsize=connection_pool_maxsize, api_qps=api_qps, api_burst=api_burst)
+    return client
+
+
+def build_api_client(configuration):
+    """ Create an ApiClient for the API server described by configuration, with the connection pool settings,
+        rate limiting, metrics and tracing that every client used by the synchronizer has.
+    """
+    from kubernetes import client as kubernetes_client
+
+    configuration.connection_pool_maxsize = connection_pool_maxsize
+
+    client = kubernetes_client.ApiClient(configuration)
+
+    if tcp_keepalive:
+        from urllib3.connection import HTTPConnection
+        pool_manager = client.rest_client.pool_manager
+        pool_manager.connection_pool_kw["socket_options"] = HTTPConnection.default_socket_options + \
+            [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+    rate_limit_api_client(client, AdaptiveRateLimiter(api_qps, api_burst), api_max_retries)
+    instrument_api_client(client)
+    trace_api_client(client)
+
+    return client
+
+
+def get_api_client():
+    """ Return the process-wide ApiClient, creating it if necessary. """
+    global api_client
+    with api_client_lock:
+        if api_client is None:
+            api_client = create_api_client()
+    return api_client
+
+
+def get_core_v1_api():
+    from kubernetes import client as kubernetes_client
+    return kubernetes_client.CoreV1Api(get_api_client())
+
+
+def get_apps_v1_api():
+    from kubernetes import client as kubernetes_client
+    return kubernetes_client.AppsV1Api(get_api_client())
+
+
+def get_batch_v1_api():
+    from kubernetes import client as kubernetes_client
+    return kubernetes_client.BatchV1Api(get_api_client())
+
+
+def get_version_api():
+    from kubernetes import client as kubernetes_client
+    return kubernetes_client.VersionApi(get_api_client())
@@ -0,0 +1,216 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    metrics.py
+
+    Prometheus metrics for the synchronizer: sync step and pull step latency, Kubernetes API calls and rate limiting,
+    cache lookups and the Kafka event queue. The metrics are served over HTTP by start_metrics_server().
+"""
+
+import functools
+import threading
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, ProcessCollector, start_http_server
+
+from xosconfig import Config
+from multistructlog import create_logger
+import tracing
+
+log = create_logger(Config().get('logging'))
+
+# Port that the metrics are served on. 0 disables the endpoint.
+metrics_port = 9102
+
+# The synchronizer's metrics are kept in their own registry rather than prometheus_client's global one, so that
+# importing this module again, as the unit tests do, does not fail with duplicate metrics.
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+
+SYNC_SECONDS = Histogram("xos_kubernetes_sync_seconds",
+                         "Time taken by sync_record and delete_record",
+                         ["step", "operation"],
+                         registry=registry)
+
+SYNC_ERRORS = Counter("xos_kubernetes_sync_errors_total",
+                      "Number of sync_record and delete_record calls that raised an exception",
+                      ["step", "operation"],
+                      registry=registry)
+
+PULL_SECONDS = Histogram("xos_kubernetes_pull_seconds",
+                         "Time taken by one pull_records cycle",
+                         ["step"],
+                         buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+                         registry=registry)
+
+PODS_PROCESSED = Counter("xos_kubernetes_pods_processed_total",
+                         "Number of pods examined by the pod pull step",
+                         ["result"],
+                         registry=registry)
+
+API_REQUESTS = Counter("xos_kubernetes_api_requests_total",
+                       "Number of requests made to the Kubernetes API server",
+                       ["verb", "resource"],
+                       registry=registry)
+
+API_ERRORS = Counter("xos_kubernetes_api_errors_total",
+                     "Number of requests to the Kubernetes API server that failed",
+                     ["verb", "resource", "code"],
+                     registry=registry)
+
+API_SECONDS = Histogram("xos_kubernetes_api_seconds",
+                        "Time taken by requests to the Kubernetes API server",
+                        ["verb", "resource"],
+                        registry=registry)
+
+API_THROTTLED = Counter("xos_kubernetes_api_throttled_total",
+                        "Number of requests that the Kubernetes API server rejected with 429 or 503, and that were "
+                        "retried unless out of retries",
+                        ["code"],
+                        registry=registry)
+
+RATE_LIMIT_QPS = Gauge("xos_kubernetes_api_rate_limit_qps",
+                       "Requests per second currently allowed to the Kubernetes API server by the rate limiter",
+                       registry=registry)
+
+RATE_LIMIT_WAIT_SECONDS = Counter("xos_kubernetes_api_rate_limit_wait_seconds_total",
+                                  "Total time that requests waited for the rate limiter",
+                                  registry=registry)
+
+CACHE_LOOKUPS = Counter("xos_kubernetes_cache_lookups_total",
+                        "Number of lookups in the synchronizer's caches, by whether they were served from the cache",
+                        ["cache", "result"],
+                        registry=registry)
+
+KAFKA_QUEUE_DEPTH = Gauge("xos_kubernetes_kafka_queue_depth",
+                          "Number of events waiting to be handed to the Kafka producer",
+                          registry=registry)
+
+KAFKA_PUBLISH_SECONDS = Histogram("xos_kubernetes_kafka_publish_seconds",
+                                  "Time taken to produce a batch of events and wait for their delivery reports",
+                                  registry=registry)
+
+server_started = False
+server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None):
+    """ Serve the metrics over HTTP from a background thread. Does nothing if the server is already running or the
+        port is 0.
+    """
+    global server_started
+    if port is None:
+        port = metrics_port
+    with server_lock:
+        if server_started or (not port):
+            return
+        start_http_server(port, registry=registry)
+        server_started = True
+    log.info("Serving metrics", port=port)
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def watch_queue_depth(publisher):
+    """ Report the depth of an EventPublisher's queue whenever the metrics are collected. """
+    KAFKA_QUEUE_DEPTH.set_function(publisher.queue_depth)
+
+
+def timed_step(operation):
+    """ Decorator for the sync_record and delete_record methods of a sync step. Records how long each call takes,
+        and whether it raised, labeled by the class name of the step, and traces the call if tracing is enabled.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, o):
+            step = self.__class__.__name__
+            start = time.time()
+            try:
+                with tracing.span(operation, step, tracing.object_label(o)):
+                    return method(self, o)
+            except Exception:
+                SYNC_ERRORS.labels(step=step, operation=operation).inc()
+                raise
+            finally:
+                SYNC_SECONDS.labels(step=step, operation=operation).observe(time.time() - start)
+        return wrapper
+    return decorator
+
+
+def timed_pull(method):
+    """ Decorator for the pull_records method of a pull step. Records how long each cycle takes, and traces and
+        profiles the cycle if tracing or profiling is enabled.
+    """
+    @functools.wraps(method)
+    def wrapper(self):
+        step = self.__class__.__name__
+        start = time.time()
+        try:
+            with tracing.span("pull", step):
+                return tracing.profile_cycle(step, method, self)
+        finally:
+            PULL_SECONDS.labels(step=step).observe(time.time() - start)
+            tracing.flush()
+    return wrapper
+
+
+def api_resource(path):
+    """ Return the resource that an API path refers to, such as "pods" or "pods/log", without the names of the
+        namespace and object, so that the metrics have a bounded number of labels. Works on both the templated paths
+        used by the kubernetes client and concrete paths.
+    """
+    parts = [p for p in path.split("?")[0].split("/") if p]
+    if parts[:1] == ["api"]:
+        parts = parts[2:]
+    elif parts[:1] == ["apis"]:
+        parts = parts[3:]
+    if (len(parts) > 2) and (parts[0] == "namespaces"):
+        parts = parts[2:]
+    if not parts:
+        return "discovery"
+    if len(parts) > 2:
+        return "%s/%s" % (parts[0], parts[2])
+    return parts[0]
+
+
+def api_verb(method, query_params):
+    for (k, v) in query_params or []:
+        if (k == "watch") and v:
+            return "WATCH"
+    return method
+
+
+def instrument_api_client(client):
+    """ Count, time and trace every request made through a kubernetes ApiClient. """
+    call_api = client.call_api
+
+    def instrumented_call_api(resource_path, method, path_params=None, query_params=None, *args, **kwargs):
+        verb = api_verb(method, query_params)
+        resource = api_resource(resource_path)
+        API_REQUESTS.labels(verb=verb, resource=resource).inc()
+        start = time.time()
+        try:
+            with tracing.api_call(verb, resource, path_params):
+                return call_api(resource_path, method, path_params, query_params, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.labels(verb=verb, resource=resource, code=str(getattr(e, "status", None) or "error")).inc()
+            raise
+        finally:
+            API_SECONDS.labels(verb=verb, resource=resource).observe(time.time() - start)
+
+    client.call_api = instrumented_call_api
+    return client
@@ -0,0 +1,140 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    pod_snapshot.py
+
+    Compact records of the pod fields used by the pod pull step. The pull step keeps one of these per pod rather than
+    the V1Pod objects returned by the kubernetes client.
+"""
+
+import json
+
+
+class OwnerReference(object):
+    """
+        OwnerReference
+
+        The fields of a Kubernetes ownerReference used to find a pod's controller.
+    """
+
+    __slots__ = ("kind", "name", "uid", "controller")
+
+    def __init__(self, kind, name, uid, controller):
+        self.kind = kind
+        self.name = name
+        self.uid = uid
+        self.controller = controller
+
+    @classmethod
+    def from_k8s(cls, ref):
+        return cls(ref.kind, ref.name, ref.uid, getattr(ref, "controller", False))
+
+    @classmethod
+    def from_dict(cls, ref):
+        return cls(ref.get("kind"), ref.get("name"), ref.get("uid"), ref.get("controller", False))
+
+    def key(self):
+        return (self.kind, self.name, self.uid, self.controller)
+
+
+class PodSnapshot(object):
+    """
+        PodSnapshot
+
+        The fields of a pod that the pull step uses. image is the image of the pod's first container, or None if the
+        pod has no containers.
+    """
+
+    __slots__ = ("name", "namespace", "self_link", "pod_ip", "service_account", "labels", "image",
+                 "owner_references")
+
+    def __init__(self, name, namespace=None, self_link=None, pod_ip=None, service_account=None, labels=None,
+                 image=None, owner_references=()):
+        self.name = name
+        self.namespace = namespace
+        self.self_link = self_link
+        self.pod_ip = pod_ip
+        self.service_account = service_account
+        self.labels = labels
+        self.image = image
+        self.owner_references = tuple(owner_references)
+
+    @classmethod
+    def from_k8s(cls, pod):
+        """ Extract a snapshot from a V1Pod returned by the kubernetes client. """
+        metadata = pod.metadata
+        spec = pod.spec
+
+        image = None
+        if spec.containers:
+            image = spec.containers[0].image
+
+        return cls(name=metadata.name,
+                   namespace=metadata.namespace,
+                   self_link=metadata.self_link,
+                   pod_ip=pod.status.pod_ip,
+                   service_account=getattr(spec, "service_account", None),
+                   labels=metadata.labels,
+                   image=image,
+                   owner_references=[OwnerReference.from_k8s(ref) for ref in (metadata.owner_references or [])])
+
+    @classmethod
+    def from_dict(cls, pod):
+        """ Extract a snapshot from a pod in the JSON form returned by the API server. """
+        metadata = pod.get("metadata", {})
+        spec = pod.get("spec", {})
+
+        image = None
+        containers = spec.get("containers")
+        if containers:
+            image = containers[0].get("image")
+
+        return cls(name=metadata.get("name"),
+                   namespace=metadata.get("namespace"),
+                   self_link=metadata.get("selfLink"),
+                   pod_ip=pod.get("status", {}).get("podIP"),
+                   service_account=spec.get("serviceAccount"),
+                   labels=metadata.get("labels"),
+                   image=image,
+                   owner_references=[OwnerReference.from_dict(ref) for ref in (metadata.get("ownerReferences") or [])])
+
+    def __repr__(self):
+        return "PodSnapshot(%s/%s)" % (self.namespace, self.name)
+
+    def fingerprint(self):
+        """ Return a value that changes whenever any field of the snapshot changes. """
+        if self.labels:
+            labels = tuple(sorted(self.labels.items()))
+        else:
+            labels = ()
+        return hash((self.namespace, self.self_link, self.pod_ip, self.service_account, labels, self.image,
+                     tuple(ref.key() for ref in self.owner_references)))
+
+
+def parse_pod_list(data):
+    """ Parse the raw JSON body of a pod list. Returns a tuple of (list of PodSnapshots, resourceVersion,
+        continue token). The continue token is None on the last page.
+    """
+    pod_list = json.loads(data)
+    metadata = pod_list.get("metadata", {})
+    items = pod_list.get("items") or []
+
+    snapshots = []
+    while items:
+        # Consume the list from the end, so each pod's JSON can be freed as soon as its snapshot is made
+        snapshots.append(PodSnapshot.from_dict(items.pop()))
+    snapshots.reverse()
+
+    return (snapshots, metadata.get("resourceVersion"), metadata.get("continue") or None)
@@ -0,0 +1,132 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    pull_config_drift.py
+
+    Implements a pull step that detects ConfigMaps and Secrets that have been changed or deleted in Kubernetes
+    without going through XOS.
+"""
+
+import hashlib
+import json
+import time
+
+from xossynchronizer.pull_steps.pullstep import PullStep
+from xossynchronizer.modelaccessor import KubernetesConfigMap, KubernetesSecret, TrustDomain
+
+from xosconfig import Config
+from multistructlog import create_logger
+from metrics import timed_pull
+from kubernetes_clients import get_core_v1_api
+
+log = create_logger(Config().get('logging'))
+
+# Time of the last drift check. The pull step engine creates a new pull step every few seconds, so this is kept at
+# module scope.
+last_check_time = 0
+
+
+def data_hash(data):
+    """ Return a hash of the data of a ConfigMap or Secret. Missing and empty data hash the same. """
+    return hashlib.sha256(json.dumps(data or {}, sort_keys=True)).hexdigest()
+
+
+class KubernetesConfigDriftPullStep(PullStep):
+    """
+         KubernetesConfigDriftPullStep
+
+         Every check_interval seconds, lists the ConfigMaps and Secrets in Kubernetes, one list per kind, and compares
+         a hash of the data of each one against the data of the KubernetesConfigMap or KubernetesSecret in XOS.
+         Objects whose resource has different data, or no longer exists, are saved with a new updated timestamp so
+         that their sync step runs again and puts the resource back. Objects that are already waiting to be synced
+         are left alone.
+    """
+
+    check_interval = 300
+
+    def __init__(self, *args, **kwargs):
+        super(KubernetesConfigDriftPullStep, self).__init__(*args, observed_model=KubernetesConfigMap, **kwargs)
+        self.init_kubernetes_client()
+
+    def init_kubernetes_client(self):
+        self.v1core = get_core_v1_api()
+
+    def list_data_hashes(self, list_func):
+        """ List every object of one kind in Kubernetes. Returns a dictionary of data hashes keyed by
+            (namespace, name). The raw JSON is read, rather than having the kubernetes client build a model object
+            for each item.
+        """
+        response = list_func(watch=False, _preload_content=False)
+        hashes = {}
+        for item in json.loads(response.data).get("items") or []:
+            metadata = item.get("metadata", {})
+            hashes[(metadata.get("namespace"), metadata.get("name"))] = data_hash(item.get("data"))
+        return hashes
+
+    def is_synced(self, o):
+        """ Return True if o has been synced and has not changed since. Only these objects are checked for drift.
+            The rest are either about to be synced or deleted anyway.
+        """
+        if o.deleted or (not o.enacted) or (not o.backend_handle):
+            return False
+        return o.enacted >= o.updated
+
+    def find_drifted(self, xos_objects, live_hashes, trust_domain_names):
+        """ Return the XOS objects whose resource in Kubernetes is missing or has different data. """
+        drifted = []
+        for o in xos_objects:
+            if not self.is_synced(o):
+                continue
+            namespace = trust_domain_names.get(o.trust_domain_id)
+            if namespace is None:
+                continue
+            try:
+                xos_hash = data_hash(json.loads(o.data))
+            except ValueError:
+                log.warning("Unable to parse data; Skipping drift check.", o=o)
+                continue
+            live_hash = live_hashes.get((namespace, o.name))
+            if live_hash != xos_hash:
+                log.info("Resource has drifted from XOS; Requeueing.", o=o, namespace=namespace,
+                         missing=(live_hash is None))
+                drifted.append(o)
+        return drifted
+
+    def requeue(self, o):
+        o.save(update_fields=["updated"], always_update_timestamp=True)
+
+    def check_drift(self):
+        trust_domain_names = {}
+        for trust_domain in TrustDomain.objects.all():
+            trust_domain_names[trust_domain.id] = trust_domain.name
+
+        for (model, list_func) in [(KubernetesConfigMap, self.v1core.list_config_map_for_all_namespaces),
+                                   (KubernetesSecret, self.v1core.list_secret_for_all_namespaces)]:
+            xos_objects = model.objects.all()
+            if not xos_objects:
+                continue
+            live_hashes = self.list_data_hashes(list_func)
+            for o in self.find_drifted(xos_objects, live_hashes, trust_domain_names):
+                self.requeue(o)
+
+    @timed_pull
+    def pull_records(self):
+        global last_check_time
+
+        if time.time() - last_check_time < self.check_interval:
+            return
+        last_check_time = time.time()
+
+        self.check_drift()
@@ -18,7 +18,10 @@
     Implements a syncstep to pull information about pods form Kubernetes.
 """
 
+import functools
 import json
+import threading
+import time
 
 from xossynchronizer.pull_steps.pullstep import PullStep
 from xossynchronizer.modelaccessor import KubernetesServiceInstance, KubernetesService, Slice, Principal, \
@@ -26,12 +29,154 @@ from xossynchronizer.modelaccessor import KubernetesServiceInstance, KubernetesS
 
 from xosconfig import Config
 from multistructlog import create_logger
-from xoskafka import XOSKafkaProducer
+from metrics import timed_pull, PODS_PROCESSED
+import tracing
+from event_publisher import publisher
 from helpers import debug_once
+from kubernetes_clients import get_core_v1_api, get_apps_v1_api, get_batch_v1_api
+from pod_snapshot import PodSnapshot, parse_pod_list
 
 log = create_logger(Config().get('logging'))
 
 
+class PodWatchState(object):
+    """
+        PodWatchState
+
+        The pods seen by the watch, the resourceVersion to resume watching from, and the pods that failed to be
+        processed or, once deleted, removed from XOS. Those are retried on the next cycle even if the watch reports no
+        change to them. The pull step engine creates a new pull step for every cycle, so this state is kept at module
+        scope.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.resource_version = None
+        self.pods_by_name = {}  # PodSnapshot of each pod, keyed by name
+        self.failed_names = set()
+        self.failed_deleted_names = set()
+
+
+pod_watch_state = PodWatchState()
+
+
+class PodEventGenerations(object):
+    """
+        PodEventGenerations
+
+        Counts the changes to each pod that need a Kafka event. Events are delivered asynchronously, so by the time
+        the delivery of an event is confirmed, the pod may have changed again. need_event is only cleared if no
+        change has been recorded since the event was queued.
+
+        Delivery is confirmed on the publisher's thread, which holds lock while it checks the generation and clears
+        need_event, so that a change recorded by the pull step cannot fall between the two.
+    """
+
+    def __init__(self):
+        self.generations = {}
+        self.lock = threading.RLock()
+
+    def clear(self):
+        with self.lock:
+            self.generations = {}
+
+    def get(self, name):
+        with self.lock:
+            return self.generations.get(name, 0)
+
+    def changed(self, name):
+        with self.lock:
+            self.generations[name] = self.get(name) + 1
+
+    def forget(self, name):
+        with self.lock:
+            self.generations.pop(name, None)
+
+
+pod_event_generations = PodEventGenerations()
+
+# Fingerprint of each pod as of the last time it was processed, keyed by pod name. Pods whose fingerprint has not
+# changed, and that have no Kafka event outstanding, are skipped.
+pod_fingerprints = {}
+
+
+class ControllerCache(object):
+    """
+        ControllerCache
+
+        Remembers which controller each owner resolves to, so that pods that share an owner (for example, the
+        replicas of a Deployment) only cost one walk of the ownerReferences chain.
+
+        Entries are keyed by (namespace, kind, name) and remember the uid of the owner. A lookup with a different uid
+        is a miss, which handles an owner that was deleted and recreated under the same name. Entries expire after
+        ttl seconds. Owners that do not resolve to a controller, for example because they are of a kind we cannot
+        read such as EtcdCluster, are cached as None and expire after negative_ttl seconds.
+    """
+
+    ttl = 300
+    negative_ttl = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+    def lookup(self, namespace, kind, name, uid):
+        """ Return a tuple (found, controller) """
+        key = (namespace, kind, name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return (False, None)
+            (entry_uid, controller, expires) = entry
+            if (entry_uid != uid) or (expires < time.time()):
+                del self.entries[key]
+                return (False, None)
+            return (True, controller)
+
+    def store(self, namespace, kind, name, uid, controller):
+        if controller is None:
+            expires = time.time() + self.negative_ttl
+        else:
+            expires = time.time() + self.ttl
+        with self.lock:
+            self.entries[(namespace, kind, name)] = (uid, controller, expires)
+
+
+controller_cache = ControllerCache()
+
+
+class ModelIndex(object):
+    """
+        ModelIndex
+
+        XOS objects of one model, loaded with a single query the first time they are needed and indexed by key_func.
+        When several objects share a key, the first one loaded wins, as it would with filter()[0]. Objects created
+        after loading are added with add(), so that they are found without another query.
+    """
+
+    def __init__(self, load_func, key_func):
+        self.load_func = load_func
+        self.key_func = key_func
+        self.objects = None
+
+    def get(self, key):
+        if self.objects is None:
+            self.objects = {}
+            for obj in self.load_func():
+                self.objects.setdefault(self.key_func(obj), obj)
+        return self.objects.get(key)
+
+    def add(self, obj):
+        if self.objects is not None:
+            self.objects[self.key_func(obj)] = obj
+
+
 class KubernetesServiceInstancePullStep(PullStep):
     """
          KubernetesServiceInstancePullStep
@@ -39,19 +184,52 @@ class KubernetesServiceInstancePullStep(PullStep):
          Pull pod-related information from Kubernetes. Each pod we find is used to create a KubernetesServiceInstance
          if one does not already exist. Additional support objects (Slices, TrustDomains, Principals) may be created
          as necessary to fill the required dependencies of the KubernetesServiceInstance.
+
+         Pods are listed pod_list_page_size at a time, and each page is processed before the next is requested.
+
+         Pods are held as PodSnapshots rather than kubernetes client objects. A pod is only processed if its snapshot
+         has changed since it was last processed, or if its Kafka event has not been delivered yet.
+
+         If watch_pods is set, only the first cycle lists all pods. Later cycles apply the events from the Kubernetes
+         watch stream, so a cycle where nothing changed costs one short-lived watch request.
+
+         If bulk_list_controllers is set, owners are resolved from ReplicaSets, Deployments, StatefulSets, DaemonSets
+         and Jobs listed once per cycle, rather than read one at a time. controller_list_scope selects whether the
+         lists cover the whole cluster ("cluster") or only the namespaces that have pods to resolve ("namespace").
     """
 
+    pod_list_page_size = 500
+    pod_list_max_restarts = 3
+
+    watch_pods = False
+    watch_timeout_seconds = 1
+
+    bulk_list_controllers = False
+    controller_list_scope = "cluster"
+
     def __init__(self, *args, **kwargs):
         super(KubernetesServiceInstancePullStep, self).__init__(*args, observed_model=KubernetesServiceInstance, **kwargs)
 
+        # Controller indexes built during this cycle, keyed by namespace, or None for the whole cluster
+        self.controller_indexes = {}
+
+        # XOS objects that pods are attached to, each loaded with one query the first time it is needed this cycle
+        self.trust_domains = ModelIndex(lambda: TrustDomain.objects.all(), lambda o: o.name)
+        self.principals = ModelIndex(lambda: Principal.objects.all(), lambda o: o.name)
+        self.slices = ModelIndex(lambda: Slice.objects.all(), lambda o: o.name)
+        self.images = ModelIndex(lambda: Image.objects.filter(kind="container"), lambda o: (o.name, o.tag))
+        self.default_site = None
+
         self.init_kubernetes_client()
 
     def init_kubernetes_client(self):
-        from kubernetes import client as kubernetes_client, config as kubernetes_config
-        kubernetes_config.load_incluster_config()
-        self.v1core = kubernetes_client.CoreV1Api()
-        self.v1apps = kubernetes_client.AppsV1Api()
-        self.v1batch = kubernetes_client.BatchV1Api()
+        from kubernetes import watch as kubernetes_watch
+        from kubernetes.client.rest import ApiException
+        self.kubernetes_watch = kubernetes_watch
+        self.ApiException = ApiException
+        self.v1core = get_core_v1_api()
+        self.v1apps = get_apps_v1_api()
+        self.v1batch = get_batch_v1_api()
 
     def obj_to_handle(self, obj):
         """ Convert a Kubernetes resource into a handle that we can use to uniquely identify the object within
@@ -75,6 +253,56 @@ class KubernetesServiceInstancePullStep(PullStep):
             resource = None
         return resource
 
+    def list_controllers(self, namespace):
+        """ List every object of the controller kinds we understand, either in one namespace or, if namespace is
+            None, in the whole cluster. Returns a list of (kind, object) tuples.
+        """
+        if namespace is None:
+            list_funcs = [("ReplicaSet", self.v1apps.list_replica_set_for_all_namespaces),
+                          ("StatefulSet", self.v1apps.list_stateful_set_for_all_namespaces),
+                          ("DaemonSet", self.v1apps.list_daemon_set_for_all_namespaces),
+                          ("Deployment", self.v1apps.list_deployment_for_all_namespaces),
+                          ("Job", self.v1batch.list_job_for_all_namespaces)]
+            args = []
+        else:
+            list_funcs = [("ReplicaSet", self.v1apps.list_namespaced_replica_set),
+                          ("StatefulSet", self.v1apps.list_namespaced_stateful_set),
+                          ("DaemonSet", self.v1apps.list_namespaced_daemon_set),
+                          ("Deployment", self.v1apps.list_namespaced_deployment),
+                          ("Job", self.v1batch.list_namespaced_job)]
+            args = [namespace]
+
+        controllers = []
+        for (kind, list_func) in list_funcs:
+            for item in list_func(*args, watch=False).items:
+                controllers.append((kind, item))
+        return controllers
+
+    def get_controller_index(self, trust_domain):
+        """ Return a dictionary of controllers keyed by uid, listing them the first time it is needed during this
+            cycle.
+        """
+        if self.controller_list_scope == "namespace":
+            namespace = trust_domain.name
+        else:
+            namespace = None
+
+        index = self.controller_indexes.get(namespace)
+        if index is None:
+            index = {}
+            for (kind, item) in self.list_controllers(namespace):
+                # Objects returned by a list do not have their kind filled in
+                item.kind = kind
+                index[item.metadata.uid] = item
+            self.controller_indexes[namespace] = index
+        return index
+
+    def get_owner(self, owner_reference, trust_domain):
+        """ Given an owner reference, return the owner object, or None if it cannot be found. """
+        if self.bulk_list_controllers:
+            return self.get_controller_index(trust_domain).get(owner_reference.uid)
+        return self.read_obj_kind(owner_reference.kind, owner_reference.name, trust_domain)
+
     def get_controller_from_obj(self, pod_name, obj, trust_domain, depth=0):
         """ Given an object, Search for its controller. Strategy is to walk backward until we find some object that
             is marked as a controller, but does not have any owners.
@@ -90,26 +318,41 @@ class KubernetesServiceInstancePullStep(PullStep):
                 return None
             return obj
 
+        return self.get_controller_from_owner_references(pod_name, owner_references, trust_domain, depth)
+
+    def get_controller_from_owner_references(self, pod_name, owner_references, trust_domain, depth):
+        """ Search the controlling owners in owner_references for their controller. """
         for owner_reference in owner_references:
             if not getattr(owner_reference, "controller", False):
                 continue
-            owner = self.read_obj_kind(owner_reference.kind, owner_reference.name, trust_domain)
-            if not owner:
-                # Failed to fetch the owner, probably because the owner's kind is something we do not understand. An
-                # example is the etcd-cluser pod, which is owned by a deployment of kind "EtcdCluster".
-                debug_once("Pod %s: Failed to fetch owner" % pod_name, owner_reference=owner_reference)
-                continue
-            controller = self.get_controller_from_obj(pod_name, owner, trust_domain, depth+1)
+            (found, controller) = controller_cache.lookup(trust_domain.name, owner_reference.kind,
+                                                          owner_reference.name, owner_reference.uid)
+            if not found:
+                controller = self.get_controller_from_owner(pod_name, owner_reference, trust_domain, depth)
+                controller_cache.store(trust_domain.name, owner_reference.kind, owner_reference.name,
+                                       owner_reference.uid, controller)
             if controller:
                 return controller
 
         return None
 
+    def get_controller_from_owner(self, pod_name, owner_reference, trust_domain, depth):
+        """ Read the object named by owner_reference and search for its controller. Returns None if the owner
+            could not be read.
+        """
+        owner = self.get_owner(owner_reference, trust_domain)
+        if not owner:
+            # Failed to fetch the owner, probably because the owner's kind is something we do not understand. An
+            # example is the etcd-cluser pod, which is owned by a deployment of kind "EtcdCluster".
+            debug_once("Pod %s: Failed to fetch owner" % pod_name, owner_reference=owner_reference)
+            return None
+        return self.get_controller_from_obj(pod_name, owner, trust_domain, depth+1)
+
     def get_slice_from_pod(self, pod_name, pod, trust_domain, principal):
         """ Given a pod, determine which XOS Slice goes with it
             If the Slice doesn't exist, create it.
         """
-        controller = self.get_controller_from_obj(pod_name, pod, trust_domain)
+        controller = self.get_controller_from_owner_references(pod_name, pod.owner_references, trust_domain, 0)
         if not controller:
             return None
 
@@ -119,47 +362,52 @@ class KubernetesServiceInstancePullStep(PullStep):
                 # Someone has labeled the controller with an xos slice name. Use it.
                 slice_name = controller.metadata.labels["xos_slice_name"]
 
-        existing_slices = Slice.objects.filter(name = slice_name)
-        if not existing_slices:
+        existing_slice = self.slices.get(slice_name)
+        if not existing_slice:
+            if not self.default_site:
+                self.default_site = Site.objects.first()
+
             # TODO(smbaker): atomicity
-            s = Slice(name=slice_name, site = Site.objects.first(),
+            s = Slice(name=slice_name, site = self.default_site,
                       trust_domain=trust_domain,
                       principal=principal,
                       backend_handle=self.obj_to_handle(controller),
                       controller_kind=controller.kind,
                       xos_managed=False)
             s.save()
+            self.slices.add(s)
             return s
         else:
-            return existing_slices[0]
+            return existing_slice
 
     def get_trustdomain_from_pod(self, pod, owner_service):
         """ Given a pod, determine which XOS TrustDomain goes with it
             If the TrustDomain doesn't exist, create it.
         """
-        existing_trustdomains = TrustDomain.objects.filter(name = pod.metadata.namespace)
-        if not existing_trustdomains:
-            k8s_trust_domain = self.v1core.read_namespace(pod.metadata.namespace)
+        existing_trustdomain = self.trust_domains.get(pod.namespace)
+        if not existing_trustdomain:
+            k8s_trust_domain = self.v1core.read_namespace(pod.namespace)
 
             # TODO(smbaker): atomicity
-            t = TrustDomain(name = pod.metadata.namespace,
+            t = TrustDomain(name = pod.namespace,
                             xos_managed=False,
                             owner=owner_service,
                             backend_handle = self.obj_to_handle(k8s_trust_domain))
             t.save()
+            self.trust_domains.add(t)
             return t
         else:
-            return existing_trustdomains[0]
+            return existing_trustdomain
 
     def get_principal_from_pod(self, pod, trust_domain):
         """ Given a pod, determine which XOS Principal goes with it
             If the Principal doesn't exist, create it.
         """
-        principal_name = getattr(pod.spec, "service_account", None)
+        principal_name = pod.service_account
         if not principal_name:
             return None
-        existing_principals = Principal.objects.filter(name = principal_name)
-        if not existing_principals:
+        existing_principal = self.principals.get(principal_name)
+        if not existing_principal:
             k8s_service_account = self.v1core.read_namespaced_service_account(principal_name, trust_domain.name)
 
             # TODO(smbaker): atomicity
@@ -168,37 +416,40 @@ class KubernetesServiceInstancePullStep(PullStep):
                           xos_managed = False,
                           backend_handle = self.obj_to_handle(k8s_service_account))
             p.save()
+            self.principals.add(p)
             return p
         else:
-            return existing_principals[0]
+            return existing_principal
 
     def get_image_from_pod(self, pod):
         """ Given a pod, determine which XOS Image goes with it
             If the Image doesn't exist, create it.
         """
-        containers = pod.spec.containers
-        if containers:
-            # TODO(smbaker): Assumes all containers in a pod use the same image. Valid assumption for now?
-            container = containers[0]
-            if ":" in container.image:
-                (name, tag) = container.image.rsplit(":", 1)
+        # TODO(smbaker): Assumes all containers in a pod use the same image. Valid assumption for now?
+        if pod.image:
+            if ":" in pod.image:
+                (name, tag) = pod.image.rsplit(":", 1)
             else:
                 # Is assuming a default necessary?
-                name = container.image
+                name = pod.image
                 tag = "master"
 
             # FIXME image.name is unique, but tag may differ. Update validation in the Image model so that the combination of name and tag is unique
-            existing_images = Image.objects.filter(name=name, tag=tag, kind="container")
-            if not existing_images:
+            existing_image = self.images.get((name, tag))
+            if not existing_image:
                 i = Image(name=name, tag=tag, kind="container", xos_managed=False)
                 i.save()
+                self.images.add(i)
                 return i
             else:
-                return existing_images[0]
+                return existing_image
         else:
             return None
 
-    def send_notification(self, xos_pod, k8s_pod, status):
+    def send_notification(self, xos_pod, k8s_pod, status, on_delivered=None):
+        """ Queue a Kafka event for xos_pod. Returns False if the event could not be queued, in which case the
+            caller should try again later. on_delivered is called once Kafka has confirmed delivery.
+        """
 
         event = {"status": status,
                  "name": xos_pod.name,
@@ -208,112 +459,322 @@ class KubernetesServiceInstancePullStep(PullStep):
             event["kubernetesserviceinstance_id"] = xos_pod.id
 
         if k8s_pod:
-            event["labels"] = k8s_pod.metadata.labels
+            event["labels"] = k8s_pod.labels
 
-            if k8s_pod.status.pod_ip:
+            if k8s_pod.pod_ip:
                 event["netinterfaces"] = [{"name": "primary",
-                                          "addresses": [k8s_pod.status.pod_ip]}]
+                                          "addresses": [k8s_pod.pod_ip]}]
 
         topic = "xos.kubernetes.pod-details"
         key = xos_pod.name
         value = json.dumps(event, default=lambda o: repr(o))
 
-        XOSKafkaProducer.produce(topic, key, value)
+        # Only one created/updated event per pod may be in flight. Deleted events are always queued.
+        if status == "deleted":
+            pending_key = None
+        else:
+            pending_key = key
 
+        return publisher.publish(topic, key, value, on_delivered=on_delivered, pending_key=pending_key)
 
-    def pull_records(self):
-        # Read all pods from Kubernetes, store them in k8s_pods_by_name
-        k8s_pods_by_name = {}
-        ret = self.v1core.list_pod_for_all_namespaces(watch=False)
-        for item in ret.items:
-            k8s_pods_by_name[item.metadata.name] = item
+    def event_delivered(self, xos_pod, event_kind, generation):
+        """ Called from the publisher's thread once Kafka has confirmed delivery of an event for xos_pod. """
+        with pod_event_generations.lock:
+            if pod_event_generations.get(xos_pod.name) != generation:
+                # The pod changed after the event was queued. Leave need_event set so another event is sent.
+                return
+            xos_pod.need_event = False
+            xos_pod.last_event_sent = event_kind
+            xos_pod.save(update_fields=["need_event", "last_event_sent"])
 
-        # Read all pods from XOS, store them in xos_pods_by_name
-        xos_pods_by_name = {}
-        existing_pods = KubernetesServiceInstance.objects.all()
-        for pod in existing_pods:
-            xos_pods_by_name[pod.name] = pod
 
+    def get_kubernetes_service(self):
         kubernetes_services = KubernetesService.objects.all()
         if len(kubernetes_services)==0:
             raise Exception("There are no Kubernetes Services yet")
         if len(kubernetes_services)>1:
             # Simplifying assumption -- there is only one Kubernetes Service
             raise Exception("There are too many Kubernetes Services")
-        kubernetes_service = kubernetes_services[0]
+        return kubernetes_services[0]
+
+    def process_k8s_pods(self, k8s_pods_by_name, xos_pods_by_name, kubernetes_service):
+        """ For each k8s pod, see if there is an xos pod. If there is not, then create the xos pod. Newly created
+            xos pods are added to xos_pods_by_name. k8s_pods_by_name holds PodSnapshots.
 
-        # For each k8s pod, see if there is an xos pod. If there is not, then create the xos pod.
+            Returns the set of names of the pods that failed to be processed.
+        """
+        failed_names = set()
         for (k, pod) in k8s_pods_by_name.items():
             try:
-                if not k in xos_pods_by_name:
-                    trust_domain = self.get_trustdomain_from_pod(pod, owner_service=kubernetes_service)
-                    if not trust_domain:
-                        # All kubernetes pods should belong to a namespace. If we can't find the namespace, then
-                        # something is very wrong in K8s.
-                        log.warning("Unable to determine trust_domain for pod %s. Ignoring." % k)
-                        continue
-
-                    principal = self.get_principal_from_pod(pod, trust_domain)
-                    slice = self.get_slice_from_pod(k, pod, trust_domain=trust_domain, principal=principal)
-                    image = self.get_image_from_pod(pod)
-
-                    if not slice:
-                        # We could get here if the pod doesn't have a controller, or if the controller is of a kind
-                        # that we don't understand (such as the Etcd controller). If so, the pod is not something we
-                        # are interested in.
-                        debug_once("Pod %s: Unable to determine slice. Ignoring." % k)
-                        continue
-
-                    xos_pod = KubernetesServiceInstance(name=k,
-                                                        pod_ip = pod.status.pod_ip,
-                                                        owner = kubernetes_service,
-                                                        slice = slice,
-                                                        image = image,
-                                                        backend_handle = self.obj_to_handle(pod),
-                                                        xos_managed = False,
-                                                        need_event = True)
-                    xos_pod.save()
-                    xos_pods_by_name[k] = xos_pod
-                    log.info("Created XOS POD %s" % xos_pod.name)
-
-                xos_pod = xos_pods_by_name[k]
-
-                # Check to see if the ip address has changed. This can happen for pods that are managed by XOS. The IP
-                # isn't available immediately when XOS creates a pod, but shows up a bit later. So handle that case
-                # here.
-                if (pod.status.pod_ip is not None) and (xos_pod.pod_ip != pod.status.pod_ip):
-                    xos_pod.pod_ip = pod.status.pod_ip
-                    xos_pod.need_event = True # Trigger a new kafka event
-                    xos_pod.save(update_fields = ["pod_ip", "need_event"])
-                    log.info("Updated XOS POD %s" % xos_pod.name)
-
-                # Check to see if we haven't sent the Kafka event yet. It's possible Kafka could be down. If
-                # so, then we'll try to send the event again later.
-                if (xos_pod.need_event):
-                    if xos_pod.last_event_sent == "created":
-                        event_kind = "updated"
-                    else:
-                        event_kind = "created"
-
-                    self.send_notification(xos_pod, pod, event_kind)
-
-                    xos_pod.need_event = False
-                    xos_pod.last_event_sent = event_kind
-                    xos_pod.save(update_fields=["need_event", "last_event_sent"])
+                fingerprint = pod.fingerprint()
+                xos_pod = xos_pods_by_name.get(k)
+                if xos_pod and (not xos_pod.need_event) and (pod_fingerprints.get(k) == fingerprint):
+                    # Nothing we use has changed since the pod was last processed
+                    PODS_PROCESSED.labels(result="unchanged").inc()
+                    continue
+                PODS_PROCESSED.labels(result="reconciled").inc()
+
+                with tracing.span("pod", self.__class__.__name__, "Pod %s/%s" % (pod.namespace, k)):
+                    if not xos_pod:
+                        trust_domain = self.get_trustdomain_from_pod(pod, owner_service=kubernetes_service)
+                        if not trust_domain:
+                            # All kubernetes pods should belong to a namespace. If we can't find the namespace, then
+                            # something is very wrong in K8s.
+                            log.warning("Unable to determine trust_domain for pod %s. Ignoring." % k)
+                            continue
+
+                        principal = self.get_principal_from_pod(pod, trust_domain)
+                        slice = self.get_slice_from_pod(k, pod, trust_domain=trust_domain, principal=principal)
+                        image = self.get_image_from_pod(pod)
+
+                        if not slice:
+                            # We could get here if the pod doesn't have a controller, or if the controller is of a kind
+                            # that we don't understand (such as the Etcd controller). If so, the pod is not something we
+                            # are interested in.
+                            debug_once("Pod %s: Unable to determine slice. Ignoring." % k)
+                            continue
+
+                        xos_pod = KubernetesServiceInstance(name=k,
+                                                            pod_ip = pod.pod_ip,
+                                                            owner = kubernetes_service,
+                                                            slice = slice,
+                                                            image = image,
+                                                            backend_handle = pod.self_link,
+                                                            xos_managed = False,
+                                                            need_event = True)
+                        xos_pod.save()
+                        xos_pods_by_name[k] = xos_pod
+                        log.info("Created XOS POD %s" % xos_pod.name)
+
+                    # Check to see if the ip address has changed. This can happen for pods that are managed by XOS. The
+                    # IP isn't available immediately when XOS creates a pod, but shows up a bit later. So handle that
+                    # case here.
+                    if (pod.pod_ip is not None) and (xos_pod.pod_ip != pod.pod_ip):
+                        # Record the change before setting need_event, so that a delivery report for an earlier
+                        # event that arrives in between cannot clear it
+                        pod_event_generations.changed(k)
+                        xos_pod.pod_ip = pod.pod_ip
+                        xos_pod.need_event = True # Trigger a new kafka event
+                        xos_pod.save(update_fields = ["pod_ip", "need_event"])
+                        log.info("Updated XOS POD %s" % xos_pod.name)
+
+                    # Check to see if we haven't sent the Kafka event yet. It's possible Kafka could be down, or the
+                    # publisher's queue could be full. If so, then need_event stays set and we'll try to send the event
+                    # again later.
+                    if (xos_pod.need_event):
+                        if xos_pod.last_event_sent == "created":
+                            event_kind = "updated"
+                        else:
+                            event_kind = "created"
+
+                        on_delivered = functools.partial(self.event_delivered, xos_pod, event_kind,
+                                                         pod_event_generations.get(k))
+                        self.send_notification(xos_pod, pod, event_kind, on_delivered=on_delivered)
+
+                    pod_fingerprints[k] = fingerprint
 
             except:
                 log.exception("Failed to process k8s pod", k=k, pod=pod)
+                failed_names.add(k)
 
-        # For each xos pod, see if there is no k8s pod. If that's the case, then the pud must have been deleted.
-        for (k,xos_pod) in xos_pods_by_name.items():
+        return failed_names
+
+    def process_deleted_pods(self, names, xos_pods_by_name):
+        """ For each name of a pod that no longer exists in k8s, delete the corresponding xos pod. The xos pod is only
+            deleted once its "deleted" event has been queued.
+
+            Returns the set of names of the pods that could not be deleted, and should be tried again later.
+        """
+        failed_names = set()
+        for k in names:
+            xos_pod = xos_pods_by_name.get(k)
+            if not xos_pod:
+                continue
             try:
-                if (not k in k8s_pods_by_name):
-                    if (xos_pod.xos_managed):
-                        # Should we do something so it gets re-created by the syncstep?
-                        pass
-                    else:
-                        self.send_notification(xos_pod, None, "deleted")
-                        xos_pod.delete()
-                        log.info("Deleted XOS POD %s" % k)
+                if (xos_pod.xos_managed):
+                    # Should we do something so it gets re-created by the syncstep?
+                    pass
+                else:
+                    if not self.send_notification(xos_pod, None, "deleted"):
+                        # The event queue is full. Keep the xos pod, so the event is sent on a later cycle.
+                        failed_names.add(k)
+                        continue
+                    xos_pod.delete()
+                    pod_event_generations.forget(k)
+                    pod_fingerprints.pop(k, None)
+                    log.info("Deleted XOS POD %s" % k)
             except:
                 log.exception("Failed to process xos pod", k=k, xos_pod=xos_pod)
+                failed_names.add(k)
+
+        return failed_names
+
+    def list_pod_pages(self):
+        """ List every pod in Kubernetes, pod_list_page_size pods at a time. Yields a tuple of (list of PodSnapshots,
+            resourceVersion) for each page.
+
+            The response is parsed as plain JSON rather than deserialized into kubernetes client objects, as only a
+            few fields of each pod are needed.
+
+            If the continue token expires (410 Gone) before the last page, the list restarts from the first page, so
+            pods from the earlier pages may be yielded twice.
+        """
+        restarts = 0
+        continue_token = None
+        while True:
+            kwargs = {"watch": False, "_preload_content": False, "limit": self.pod_list_page_size}
+            if continue_token:
+                kwargs["_continue"] = continue_token
+            try:
+                response = self.v1core.list_pod_for_all_namespaces(**kwargs)
+            except self.ApiException as e:
+                if (e.status != 410) or (not continue_token) or (restarts >= self.pod_list_max_restarts):
+                    raise
+                log.info("Pod list continue token expired, restarting list")
+                restarts += 1
+                continue_token = None
+                continue
+
+            (pods, resource_version, continue_token) = parse_pod_list(response.data)
+            yield (pods, resource_version)
+
+            if not continue_token:
+                break
+
+    @timed_pull
+    def pull_records(self):
+        if self.watch_pods:
+            self.pull_records_watch()
+        else:
+            self.pull_records_list()
+
+    def pull_all_pods(self, kubernetes_service, pods_by_name=None, failed_names=None, failed_deleted_names=None):
+        """ Reconcile by listing every pod in Kubernetes and comparing against every pod in XOS. Each page of pods is
+            processed as it arrives, so only one page is held at a time, unless pods_by_name is given, in which case
+            every PodSnapshot is stored in it. If failed_names is given, the names of pods that failed to be processed
+            are added to it, and likewise for failed_deleted_names and pods that could not be removed from XOS.
+
+            Returns the resourceVersion of the list.
+        """
+
+        # Read all pods from XOS, store them in xos_pods_by_name
+        xos_pods_by_name = {}
+        existing_pods = KubernetesServiceInstance.objects.all()
+        for pod in existing_pods:
+            xos_pods_by_name[pod.name] = pod
+
+        k8s_pod_names = set()
+        resource_version = None
+        for (pods, resource_version) in self.list_pod_pages():
+            page_by_name = {}
+            for pod in pods:
+                page_by_name[pod.name] = pod
+                k8s_pod_names.add(pod.name)
+            if pods_by_name is not None:
+                pods_by_name.update(page_by_name)
+
+            failed = self.process_k8s_pods(page_by_name, xos_pods_by_name, kubernetes_service)
+            if failed_names is not None:
+                failed_names.update(failed)
+
+        # Forget the fingerprints of pods that are gone
+        for name in list(pod_fingerprints.keys()):
+            if name not in k8s_pod_names:
+                del pod_fingerprints[name]
+
+        # For each xos pod, see if there is no k8s pod. If that's the case, then the pud must have been deleted.
+        deleted_names = [k for k in xos_pods_by_name.keys() if k not in k8s_pod_names]
+        failed = self.process_deleted_pods(deleted_names, xos_pods_by_name)
+        if failed_deleted_names is not None:
+            failed_deleted_names.update(failed)
+
+        return resource_version
+
+    def pull_records_list(self):
+        self.pull_all_pods(self.get_kubernetes_service())
+
+    def watch_pod_events(self, resource_version):
+        """ Return the pod events that occurred after resource_version. The stream is closed by the server after
+            watch_timeout_seconds, so this returns promptly when nothing has changed.
+        """
+        w = self.kubernetes_watch.Watch()
+        return w.stream(self.v1core.list_pod_for_all_namespaces,
+                        resource_version=resource_version,
+                        timeout_seconds=self.watch_timeout_seconds)
+
+    def pull_records_watch(self):
+        """ Reconcile incrementally. The first cycle lists every pod and remembers the resourceVersion of the list.
+            Subsequent cycles only apply the ADDED/MODIFIED/DELETED events reported by the watch stream. If the
+            resourceVersion has expired (410 Gone), fall back to a full list on the next cycle.
+        """
+        kubernetes_service = self.get_kubernetes_service()
+
+        if pod_watch_state.resource_version is None:
+            pods_by_name = {}
+            failed_names = set()
+            failed_deleted_names = set()
+            resource_version = self.pull_all_pods(kubernetes_service, pods_by_name, failed_names, failed_deleted_names)
+            pod_watch_state.pods_by_name = pods_by_name
+            pod_watch_state.failed_names = failed_names
+            pod_watch_state.failed_deleted_names = failed_deleted_names
+            pod_watch_state.resource_version = resource_version
+            return
+
+        changed_pods_by_name = {}
+        deleted_names = set()
+        try:
+            for event in self.watch_pod_events(pod_watch_state.resource_version):
+                if event["type"] == "ERROR":
+                    status = event["raw_object"]
+                    if status.get("code") == 410:
+                        log.info("Pod watch expired, relisting", resource_version=pod_watch_state.resource_version)
+                        pod_watch_state.reset()
+                        break
+                    raise Exception("Pod watch failed: %s" % status.get("message"))
+
+                obj = event["object"]
+                name = obj.metadata.name
+                if event["type"] == "DELETED":
+                    pod_watch_state.pods_by_name.pop(name, None)
+                    changed_pods_by_name.pop(name, None)
+                    pod_fingerprints.pop(name, None)
+                    deleted_names.add(name)
+                else:
+                    pod = PodSnapshot.from_k8s(obj)
+                    pod_watch_state.pods_by_name[name] = pod
+                    changed_pods_by_name[name] = pod
+                    deleted_names.discard(name)
+                pod_watch_state.resource_version = obj.metadata.resource_version
+        except self.ApiException as e:
+            if e.status != 410:
+                raise
+            log.info("Pod watch expired, relisting", resource_version=pod_watch_state.resource_version)
+            pod_watch_state.reset()
+
+        # Pods that failed to be processed last cycle are retried, even if nothing changed in Kubernetes.
+        for name in pod_watch_state.failed_names:
+            if (name not in changed_pods_by_name) and (name in pod_watch_state.pods_by_name):
+                changed_pods_by_name[name] = pod_watch_state.pods_by_name[name]
+
+        for name in pod_watch_state.failed_deleted_names:
+            if name not in pod_watch_state.pods_by_name:
+                deleted_names.add(name)
+
+        # Pods with a Kafka event still outstanding are retried every cycle, even if nothing changed in Kubernetes.
+        xos_pods_by_name = {}
+        for xos_pod in KubernetesServiceInstance.objects.filter(need_event=True):
+            xos_pods_by_name[xos_pod.name] = xos_pod
+            if (xos_pod.name not in changed_pods_by_name) and (xos_pod.name in pod_watch_state.pods_by_name):
+                changed_pods_by_name[xos_pod.name] = pod_watch_state.pods_by_name[xos_pod.name]
+
+        # Read the other xos pods that changed with one query, rather than one query per pod. The XOS API cannot
+        # filter on a list of names, so read them all.
+        missing_names = [name for name in list(changed_pods_by_name.keys()) + list(deleted_names)
+                         if name not in xos_pods_by_name]
+        if missing_names:
+            for xos_pod in KubernetesServiceInstance.objects.all():
+                xos_pods_by_name.setdefault(xos_pod.name, xos_pod)
+
+        pod_watch_state.failed_names = self.process_k8s_pods(changed_pods_by_name, xos_pods_by_name,
+                                                             kubernetes_service)
+        pod_watch_state.failed_deleted_names = self.process_deleted_pods(deleted_names, xos_pods_by_name)
@@ -0,0 +1,189 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    ratelimit.py
+
+    Client-side rate limiting of requests to the Kubernetes API server. Requests wait for a token from a token bucket
+    shared by every step. When the API server rejects a request with 429 Too Many Requests or 503 Service Unavailable,
+    the request is retried after the Retry-After delay the server asked for, every other request waits out the same
+    delay, and the rate is cut, then recovers gradually as requests succeed.
+"""
+
+import email.utils
+import threading
+import time
+
+from xosconfig import Config
+from multistructlog import create_logger
+from metrics import API_THROTTLED, RATE_LIMIT_QPS, RATE_LIMIT_WAIT_SECONDS
+
+log = create_logger(Config().get('logging'))
+
+# Statuses that mean the API server is shedding load, and the request can be retried
+THROTTLE_STATUSES = (429, 503)
+
+
+class AdaptiveRateLimiter(object):
+    """
+        AdaptiveRateLimiter
+
+        A token bucket that refills at qps tokens per second, up to burst tokens. A qps of 0 disables the bucket, so
+        that only pauses requested by the API server are applied.
+
+        The rate adapts to the API server: each time it throttles a request, the rate is multiplied by
+        decrease_factor, at most once per decrease_interval and never below min_qps, and each request that succeeds
+        adds increase_per_request to the rate, up to the configured qps.
+    """
+
+    # Fraction of the rate kept when the API server throttles a request
+    decrease_factor = 0.5
+
+    # Minimum time between two decreases, so that a burst of rejections of requests that were already in flight only
+    # counts once
+    decrease_interval = 1.0
+
+    # Lowest rate the limiter backs off to
+    min_qps = 1.0
+
+    # Rate added for each successful request, while below the configured qps
+    increase_per_request = 0.1
+
+    # Delay before retrying a throttled request when the API server does not send Retry-After. Doubles with each
+    # retry of the same request, up to max_retry_delay.
+    retry_delay = 1.0
+
+    # Longest delay that a request waits before being retried, whatever the API server asks for
+    max_retry_delay = 60.0
+
+    def __init__(self, qps, burst):
+        self.max_qps = float(qps)
+        self.qps = float(qps)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.last = time.time()  # Time up to which tokens have been added. In the future while paused.
+        self.last_decrease = 0
+        self.lock = threading.Lock()
+        RATE_LIMIT_QPS.set(self.qps)
+
+    def refill(self, now):
+        if now > self.last:
+            if self.qps:
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.qps)
+            self.last = now
+
+    def reserve(self):
+        """ Take a token, and return how long the caller has to wait before it may make its request. Tokens are
+            handed out in order, so the bucket can go into debt, which later callers wait for.
+        """
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            if not self.qps:
+                return max(0, self.last - now)
+            self.tokens -= 1
+            available = self.last + max(0, -self.tokens) / self.qps
+            return max(0, available - now)
+
+    def acquire(self):
+        """ Wait until a request may be made. """
+        wait = self.reserve()
+        if wait > 0:
+            RATE_LIMIT_WAIT_SECONDS.inc(wait)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """ Hold back every request for seconds. Requests already waiting for a token wait that much longer. """
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            until = now + seconds
+            if until > self.last:
+                self.tokens = min(self.tokens, 0)
+                self.last = until
+
+    def throttled(self, delay):
+        """ Called when the API server throttled a request and asked for it to be retried after delay seconds. """
+        self.pause(delay)
+        with self.lock:
+            now = time.time()
+            if (not self.qps) or (now - self.last_decrease < self.decrease_interval):
+                return
+            self.last_decrease = now
+            self.qps = max(min(self.min_qps, self.max_qps), self.qps * self.decrease_factor)
+            RATE_LIMIT_QPS.set(self.qps)
+        log.info("Kubernetes API server is throttling requests, reducing request rate", qps=self.qps, delay=delay)
+
+    def succeeded(self):
+        if self.qps >= self.max_qps:
+            return
+        with self.lock:
+            self.qps = min(self.max_qps, self.qps + self.increase_per_request)
+            RATE_LIMIT_QPS.set(self.qps)
+
+    def get_retry_delay(self, e, attempt):
+        """ Return how long to wait before retrying the request that raised e, from its Retry-After header, or by
+            exponential backoff if it has none.
+        """
+        delay = parse_retry_after((getattr(e, "headers", None) or {}).get("Retry-After"))
+        if delay is None:
+            delay = self.retry_delay * (2 ** attempt)
+        return min(delay, self.max_retry_delay)
+
+
+def parse_retry_after(value):
+    """ Return the delay in seconds given by a Retry-After header, which holds either a number of seconds or an HTTP
+        date, or None if it is missing or cannot be parsed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+def rate_limit_api_client(client, limiter, max_retries):
+    """ Make every request sent by a kubernetes ApiClient wait for limiter, and retry requests that the API server
+        throttles up to max_retries times.
+    """
+    request = client.request
+
+    def rate_limited_request(*args, **kwargs):
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                response = request(*args, **kwargs)
+            except Exception as e:
+                status = getattr(e, "status", None)
+                if status not in THROTTLE_STATUSES:
+                    raise
+                API_THROTTLED.labels(code=str(status)).inc()
+                delay = limiter.get_retry_delay(e, attempt)
+                limiter.throttled(delay)
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                log.debug("Retrying throttled request", status=status, delay=delay, attempt=attempt)
+                continue
+            limiter.succeeded()
+            return response
+
+    client.request = rate_limited_request
+    return client
@@ -0,0 +1,379 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    resource_apply.py
+
+    Apply and delete arbitrary Kubernetes resources described by YAML manifests, by talking to the API server
+    directly rather than running kubectl.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import six
+import yaml
+
+from xosconfig import Config
+from multistructlog import create_logger
+from metrics import record_cache_lookup
+
+log = create_logger(Config().get('logging'))
+
+# File holding the namespace of the pod's service account, which kubectl uses as the default namespace in-cluster
+service_account_namespace_file = "/var/run/secrets/kubernetes.io/serviceaccount/namespace"
+
+
+class ResourceApplyError(Exception):
+    """ A manifest could not be applied or deleted. """
+
+    def __init__(self, message, status=None, reason=None):
+        super(ResourceApplyError, self).__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+def parse_manifests(text):
+    """ Parse a multi-document YAML string into a list of manifests. Empty documents are skipped and the items of a
+        List are returned individually.
+    """
+    manifests = []
+    for doc in yaml.safe_load_all(text):
+        if not doc:
+            continue
+        if not isinstance(doc, dict):
+            raise ResourceApplyError("Manifest is not a mapping: %r" % doc)
+        if doc.get("kind", "").endswith("List") and "items" in doc:
+            manifests.extend([item for item in doc["items"] if item])
+        else:
+            manifests.append(doc)
+    return manifests
+
+
+def definition_hash(text, server_side=False):
+    """ Return a hash of a resource definition and of the way it is applied, used to tell whether either has changed
+        since it was last applied. Switching between client-side and server-side apply changes the hash.
+    """
+    if isinstance(text, six.text_type):
+        text = text.encode("utf-8")
+    if server_side:
+        text = b"server-side\0" + text
+    return hashlib.sha256(text).hexdigest()
+
+
+def in_cluster_namespace():
+    """ Return the namespace that kubectl would use for manifests without one when running in this pod: the
+        POD_NAMESPACE environment variable, then the namespace of the service account, then "default".
+    """
+    namespace = os.environ.get("POD_NAMESPACE")
+    if namespace:
+        return namespace
+    try:
+        with open(service_account_namespace_file) as f:
+            namespace = f.read().strip()
+    except (IOError, OSError):
+        namespace = None
+    return namespace or "default"
+
+
+def describe(manifest):
+    """ Return a short description of a manifest, such as "Deployment default/foo", for log and error messages. """
+    metadata = manifest.get("metadata") or {}
+    name = metadata.get("name")
+    if metadata.get("namespace"):
+        name = "%s/%s" % (metadata["namespace"], name)
+    return "%s %s" % (manifest.get("kind"), name)
+
+
+class Resource(object):
+    """
+        Resource
+
+        The REST resource that serves one kind, as reported by API discovery.
+    """
+
+    def __init__(self, api_version, kind, plural, namespaced):
+        self.api_version = api_version
+        self.kind = kind
+        self.plural = plural
+        self.namespaced = namespaced
+
+    def path(self, namespace=None, name=None):
+        if "/" in self.api_version:
+            path = "/apis/%s" % self.api_version
+        else:
+            path = "/api/%s" % self.api_version
+        if self.namespaced:
+            path += "/namespaces/%s" % namespace
+        path += "/%s" % self.plural
+        if name:
+            path += "/%s" % name
+        return path
+
+    @property
+    def builtin(self):
+        """ True if the kind is built into Kubernetes, and so supports strategic merge patch. Custom resources are
+            in groups whose names contain a dot, and only built-in groups end in .k8s.io.
+        """
+        if "/" not in self.api_version:
+            return True
+        group = self.api_version.split("/")[0]
+        return ("." not in group) or group.endswith(".k8s.io")
+
+
+class Discovery(object):
+    """
+        Discovery
+
+        Maps (apiVersion, kind) to the Resource that serves it. Each apiVersion is discovered the first time it is
+        used and then cached. If a kind is not found, for example because its CustomResourceDefinition was installed
+        after the apiVersion was discovered, the apiVersion is discovered again, at most once every
+        refresh_seconds.
+    """
+
+    refresh_seconds = 30
+
+    def __init__(self, request_func):
+        """ request_func(method, path) performs a GET against the API server and returns the decoded JSON """
+        self.request_func = request_func
+        self.resources = {}
+        self.discovered_at = {}
+        self.lock = threading.Lock()
+
+    def discover(self, api_version):
+        from kubernetes.client.rest import ApiException
+
+        if "/" in api_version:
+            path = "/apis/%s" % api_version
+        else:
+            path = "/api/%s" % api_version
+        try:
+            resource_list = self.request_func("GET", path)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            # The apiVersion is not served at all. Cache that, so it is not asked for again until the next refresh.
+            resource_list = {}
+
+        resources = {}
+        for r in resource_list.get("resources", []):
+            if "/" in r["name"]:
+                # Subresources, such as deployments/scale
+                continue
+            resources[r["kind"]] = Resource(api_version, r["kind"], r["name"], r.get("namespaced", False))
+
+        with self.lock:
+            self.resources[api_version] = resources
+            self.discovered_at[api_version] = time.time()
+
+    def get_resource(self, api_version, kind):
+        with self.lock:
+            resources = self.resources.get(api_version)
+            discovered_at = self.discovered_at.get(api_version, 0)
+
+        if (resources is None) or ((kind not in resources) and
+                                   (time.time() - discovered_at > self.refresh_seconds)):
+            record_cache_lookup("discovery", False)
+            self.discover(api_version)
+            with self.lock:
+                resources = self.resources[api_version]
+        else:
+            record_cache_lookup("discovery", True)
+
+        resource = resources.get(kind)
+        if not resource:
+            raise ResourceApplyError("Kind %s is not served by %s" % (kind, api_version))
+        return resource
+
+
+class ResourceApplier(object):
+    """
+        ResourceApplier
+
+        Creates, updates and deletes the resources in a manifest. An existing resource is updated with a strategic
+        merge patch of the manifest, as kubectl apply does, so lists such as containers, ports and env are merged by
+        key. Custom resources do not support strategic merge, and are updated with a JSON merge patch instead.
+        Alternatively, the manifest is sent using server-side apply, in which case the API server creates or updates
+        the resource and records the fields it sets as owned by field_manager.
+
+        Namespaced resources that do not specify a namespace go in default_namespace, or if it is None, in the
+        namespace that kubectl would use in-cluster (see in_cluster_namespace).
+    """
+
+    default_namespace = None
+
+    # The field manager that owns the fields set using server-side apply
+    field_manager = "kubernetes-synchronizer"
+
+    def __init__(self, api_client):
+        self.api_client = api_client
+        self.discovery = Discovery(self.request)
+        self.namespace = self.default_namespace or in_cluster_namespace()
+
+    def request(self, method, path, body=None, content_type="application/json", query_params=None):
+        """ Perform a request against the API server and return the decoded JSON response. Raises the kubernetes
+            client's ApiException on failure.
+        """
+        response = self.api_client.call_api(path, method,
+                                            query_params=query_params or [],
+                                            header_params={"Accept": "application/json",
+                                                           "Content-Type": content_type},
+                                            body=body,
+                                            auth_settings=["BearerToken"],
+                                            _return_http_data_only=True,
+                                            _preload_content=False)
+        if not response.data:
+            return {}
+        return json.loads(response.data)
+
+    def locate(self, manifest):
+        """ Return the (Resource, namespace, name) of a manifest. """
+        if (not manifest.get("apiVersion")) or (not manifest.get("kind")):
+            raise ResourceApplyError("Manifest is missing apiVersion or kind: %s" % describe(manifest))
+        metadata = manifest.get("metadata") or {}
+        name = metadata.get("name")
+        if not name:
+            raise ResourceApplyError("Manifest is missing metadata.name: %s" % describe(manifest))
+
+        resource = self.discovery.get_resource(manifest["apiVersion"], manifest["kind"])
+        namespace = None
+        if resource.namespaced:
+            namespace = metadata.get("namespace") or self.namespace
+        return (resource, namespace, name)
+
+    def error(self, operation, manifest, e):
+        """ Convert an ApiException into a ResourceApplyError, using the message from the Status in its body """
+        message = e.reason
+        try:
+            message = json.loads(e.body).get("message", message)
+        except (TypeError, ValueError, AttributeError):
+            pass
+        return ResourceApplyError("Failed to %s %s: %s %s" % (operation, describe(manifest), e.status, message),
+                                  status=e.status, reason=e.reason)
+
+    def apply_one(self, manifest):
+        """ Create or update one resource. Returns "created" or "updated". """
+        from kubernetes.client.rest import ApiException
+
+        (resource, namespace, name) = self.locate(manifest)
+        if resource.builtin:
+            content_type = "application/strategic-merge-patch+json"
+        else:
+            content_type = "application/merge-patch+json"
+        try:
+            try:
+                self.request("PATCH", resource.path(namespace, name), body=manifest, content_type=content_type)
+            except ApiException as e:
+                if (e.status != 415) or (content_type == "application/merge-patch+json"):
+                    raise
+                # An aggregated API that does not support strategic merge
+                self.request("PATCH", resource.path(namespace, name), body=manifest,
+                             content_type="application/merge-patch+json")
+            return "updated"
+        except ApiException as e:
+            if e.status != 404:
+                raise self.error("apply", manifest, e)
+
+        try:
+            self.request("POST", resource.path(namespace), body=manifest)
+            return "created"
+        except ApiException as e:
+            raise self.error("create", manifest, e)
+
+    def server_side_apply_one(self, manifest):
+        """ Create or update one resource using server-side apply. Returns "applied". """
+        from kubernetes.client.rest import ApiException
+
+        (resource, namespace, name) = self.locate(manifest)
+        try:
+            # JSON is valid YAML. The body is passed as a string so the kubernetes client sends it unchanged.
+            # force takes ownership of fields set by other managers, since XOS is the source of truth for the
+            # resource.
+            self.request("PATCH", resource.path(namespace, name), body=json.dumps(manifest),
+                         content_type="application/apply-patch+yaml",
+                         query_params=[("fieldManager", self.field_manager), ("force", "true")])
+            return "applied"
+        except ApiException as e:
+            raise self.error("apply", manifest, e)
+
+    def exists_one(self, manifest):
+        """ Return True if the resource exists. """
+        from kubernetes.client.rest import ApiException
+
+        (resource, namespace, name) = self.locate(manifest)
+        try:
+            self.request("GET", resource.path(namespace, name))
+            return True
+        except ApiException as e:
+            if e.status == 404:
+                return False
+            raise self.error("get", manifest, e)
+
+    def delete_one(self, manifest):
+        """ Delete one resource. Returns False if it did not exist. """
+        from kubernetes.client.rest import ApiException
+
+        (resource, namespace, name) = self.locate(manifest)
+        try:
+            self.request("DELETE", resource.path(namespace, name),
+                         body={"kind": "DeleteOptions", "apiVersion": "v1", "propagationPolicy": "Background"})
+            return True
+        except ApiException as e:
+            if e.status == 404:
+                return False
+            raise self.error("delete", manifest, e)
+
+    def apply(self, text, server_side=False):
+        """ Create or update every resource in a YAML string, in order. If server_side is True, use server-side
+            apply.
+        """
+        for manifest in parse_manifests(text):
+            if server_side:
+                result = self.server_side_apply_one(manifest)
+            else:
+                result = self.apply_one(manifest)
+            log.info("Applied resource", resource=describe(manifest), result=result)
+
+    def exists(self, text):
+        """ Return True if every resource in a YAML string exists. """
+        for manifest in parse_manifests(text):
+            if not self.exists_one(manifest):
+                log.info("Resource does not exist", resource=describe(manifest))
+                return False
+        return True
+
+    def delete(self, text):
+        """ Delete every resource in a YAML string, in reverse order. """
+        for manifest in reversed(parse_manifests(text)):
+            if self.delete_one(manifest):
+                log.info("Deleted resource", resource=describe(manifest))
+            else:
+                log.info("Resource does not exist; Nothing to delete.", resource=describe(manifest))
+
+
+resource_applier = None
+resource_applier_lock = threading.Lock()
+
+
+def get_resource_applier():
+    """ Return the process-wide ResourceApplier, which shares its discovery cache between steps. """
+    global resource_applier
+    with resource_applier_lock:
+        if resource_applier is None:
+            from kubernetes_clients import get_api_client
+            resource_applier = ResourceApplier(get_api_client())
+    return resource_applier
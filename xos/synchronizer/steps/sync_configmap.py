@@ -25,6 +25,11 @@ from xossynchronizer.modelaccessor import KubernetesConfigMap
 
 from xosconfig import Config
 from multistructlog import create_logger
+from informer import get_informer
+from kubernetes_clients import get_core_v1_api
+from helpers import data_merge_patch, create_ignore_conflict, delete_ignore_missing, deleted_with_namespace
+from workers import parallel_reconcile
+from metrics import timed_step, record_cache_lookup
 
 log = create_logger(Config().get('logging'))
 
@@ -40,22 +45,43 @@ class SyncKubernetesConfigMap(SyncStep):
     observes = KubernetesConfigMap
     requested_interval = 0
 
+    # Number of threads that reconcile objects of this kind concurrently. 0 reconciles them inline.
+    parallel_workers = 0
+
+    # Create objects without first reading them, falling back to an update if they already exist, and delete objects
+    # without first reading them. Saves a read per object while the informer cache is not yet available.
+    create_first = False
+
+    # When the object's TrustDomain is being deleted too, leave the resource to be removed by the deletion of the
+    # namespace rather than deleting it individually.
+    cascade_namespace_delete = False
+
+    # Cache of configmaps, populated by init_kubernetes_client()
+    config_map_informer = None
+
     def __init__(self, *args, **kwargs):
         super(SyncKubernetesConfigMap, self).__init__(*args, **kwargs)
         self.init_kubernetes_client()
 
     def init_kubernetes_client(self):
-        from kubernetes import client as kubernetes_client, config as kubernetes_config
+        from kubernetes import client as kubernetes_client
         from kubernetes.client.rest import ApiException
-        kubernetes_config.load_incluster_config()
         self.kubernetes_client = kubernetes_client
-        self.v1core = kubernetes_client.CoreV1Api()
+        self.v1core = get_core_v1_api()
         self.ApiException = ApiException
+        self.config_map_informer = get_informer("configmaps", self.v1core.list_config_map_for_all_namespaces)
+
+    def cache_synced(self):
+        return bool(self.config_map_informer) and self.config_map_informer.has_synced()
 
-    def get_config_map(self, o):
+    def get_config_map(self, o, use_cache=True):
         """ Given an XOS KubernetesConfigMap object, read the corresponding ConfigMap from Kubernetes.
             return None if no ConfigMap exists.
         """
+        if use_cache and self.cache_synced():
+            return self.config_map_informer.get(o.trust_domain.name, o.name)
+
+        record_cache_lookup("configmaps", False)
         try:
             config_map = self.v1core.read_namespaced_config_map(o.name, o.trust_domain.name)
         except self.ApiException, e:
@@ -64,31 +90,77 @@ class SyncKubernetesConfigMap(SyncStep):
             raise
         return config_map
 
-    def sync_record(self, o):
-            config_map = self.get_config_map(o)
+    def create_config_map(self, o):
+        config_map = self.kubernetes_client.V1ConfigMap()
+        config_map.data = json.loads(o.data)
+        config_map.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
+
+        return self.v1core.create_namespaced_config_map(o.trust_domain.name, config_map)
+
+    def update_config_map(self, o, config_map, fresh=True):
+        """ Patch the keys of config_map that differ from o, rather than sending the whole object. If config_map came
+            from the informer cache (fresh is False), it may be stale. The patch is conditional on its resourceVersion,
+            and if it turns out to be stale (409 Conflict), or if nothing appears to have changed, the ConfigMap is
+            read from the API server and compared again.
+        """
+        data = json.loads(o.data)
+        while True:
+            patch = data_merge_patch(config_map.data, data)
+            try:
+                if patch:
+                    body = {"metadata": {"resourceVersion": config_map.metadata.resource_version}, "data": patch}
+                    self.v1core.patch_namespaced_config_map(o.name, o.trust_domain.name, body)
+                    return
+                if fresh:
+                    log.debug("Data is unchanged; Nothing to patch.", o=o)
+                    return
+            except self.ApiException, e:
+                if (e.status != 409) or fresh:
+                    raise
+            config_map = self.get_config_map(o, use_cache=False)
             if not config_map:
-                config_map = self.kubernetes_client.V1ConfigMap()
-                config_map.data = json.loads(o.data)
-                config_map.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
+                raise Exception("ConfigMap %s was deleted while it was being updated" % o.name)
+            fresh = True
 
-                config_map = self.v1core.create_namespaced_config_map(o.trust_domain.name, config_map)
+    @timed_step("sync")
+    @parallel_reconcile(lambda o: o.trust_domain.name)
+    def sync_record(self, o):
+            if self.create_first:
+                config_map = create_ignore_conflict(self.create_config_map, o)
+                if not config_map:
+                    # It already exists. The informer may not have seen it yet, so read it from the API server.
+                    config_map = self.get_config_map(o, use_cache=False)
+                    if not config_map:
+                        raise Exception("ConfigMap %s was deleted while it was being updated" % o.name)
+                    self.update_config_map(o, config_map)
             else:
-                config_map.data = json.loads(o.data)
-                self.v1core.patch_namespaced_config_map(o.name, o.trust_domain.name, config_map)
+                config_map = self.get_config_map(o)
+                if not config_map:
+                    config_map = self.create_config_map(o)
+                else:
+                    self.update_config_map(o, config_map, fresh=not self.cache_synced())
 
             if (not o.backend_handle):
                 o.backend_handle = config_map.metadata.self_link
                 o.save(update_fields=["backend_handle"])
 
+    @timed_step("delete")
+    @parallel_reconcile(lambda o: o.trust_domain.name)
     def delete_record(self, o):
-        config_map = self.get_config_map(o)
-        if not config_map:
-            log.info("Kubernetes config map does not exist; Nothing to delete.", o=o)
+        if self.cascade_namespace_delete and deleted_with_namespace(o.trust_domain_id):
+            log.info("Trust domain is being deleted; Leaving config map to be deleted with its namespace.", o=o)
             return
+
         delete_options = self.kubernetes_client.V1DeleteOptions()
-        self.v1core.delete_namespaced_config_map(o.name, o.trust_domain.name, delete_options)
+        if self.create_first:
+            if not delete_ignore_missing(self.v1core.delete_namespaced_config_map, o.name, o.trust_domain.name,
+                                         delete_options):
+                log.info("Kubernetes config map does not exist; Nothing to delete.", o=o)
+                return
+        else:
+            config_map = self.get_config_map(o)
+            if not config_map:
+                log.info("Kubernetes config map does not exist; Nothing to delete.", o=o)
+                return
+            self.v1core.delete_namespaced_config_map(o.name, o.trust_domain.name, delete_options)
         log.info("Deleted configmap from kubernetes", handle=o.backend_handle)
-
-
-
-
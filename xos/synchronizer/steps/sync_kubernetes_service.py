@@ -18,6 +18,8 @@ from xossynchronizer.modelaccessor import KubernetesService
 
 from xosconfig import Config
 from multistructlog import create_logger
+from kubernetes_clients import get_version_api
+from metrics import timed_step
 
 log = create_logger(Config().get('logging'))
 
@@ -34,11 +36,10 @@ class SyncK8Service(SyncStep):
 
     def init_kubernetes_client(self):
         from kubernetes.client.rest import ApiException
-        from kubernetes import client as kubernetes_client, config as kubernetes_config
-        kubernetes_config.load_incluster_config()
-        self.api_instance = kubernetes_client.VersionApi(kubernetes_client.ApiClient())
+        self.api_instance = get_version_api()
         self.ApiException = ApiException
 
+    @timed_step("sync")
     def sync_record(self, o):
         log.info("[K8Service SyncStep] Sync'ing model", model=o, name=o.name)
 
@@ -53,5 +54,6 @@ class SyncK8Service(SyncStep):
             raise Exception("Kubernetes cluster of version %s is not supported by the kubernetes-services" % res.git_version+
                             "the maximum supported version is %s" % self.max_version)
 
+    @timed_step("delete")
     def delete_record(self, o):
         pass
\ No newline at end of file
@@ -18,17 +18,17 @@
 
     Synchronize KubernetesResourceInstance.
 
-    This sync_step is instantiates generic resources by executing them with `kubectl`.
+    This sync_step instantiates generic resources by applying their YAML directly against the Kubernetes API.
 """
 
-import os
-import subprocess
-import tempfile
 from xossynchronizer.steps.syncstep import SyncStep
 from xossynchronizer.modelaccessor import KubernetesResourceInstance
 
 from xosconfig import Config
 from multistructlog import create_logger
+from workers import parallel_reconcile
+from resource_apply import get_resource_applier, definition_hash
+from metrics import timed_step
 
 log = create_logger(Config().get('logging'))
 
@@ -37,44 +37,55 @@ class SyncKubernetesResourceInstance(SyncStep):
     """
         SyncKubernetesResourceInstance
 
-        Implements sync step for syncing kubernetes resource instances. These objects are basically a yaml blob that
-        is passed to `kubectl`.
+        Implements sync step for syncing kubernetes resource instances. These objects are basically a yaml blob,
+        each document of which is created or patched in Kubernetes.
     """
 
     provides = [KubernetesResourceInstance]
     observes = KubernetesResourceInstance
     requested_interval = 0
 
+    # Number of threads that reconcile objects of this kind concurrently. 0 reconciles them inline.
+    parallel_workers = 0
+
+    # Use server-side apply, so the API server computes the changes to each resource. Requires Kubernetes 1.16 or
+    # later.
+    server_side_apply = False
+
+    # When an object is synced but its resource_definition is unchanged since it was last applied, check that its
+    # resources still exist and only apply it again if one is missing. If False, unchanged definitions are never
+    # applied again.
+    check_drift = True
+
     def __init__(self, *args, **kwargs):
         super(SyncKubernetesResourceInstance, self).__init__(*args, **kwargs)
+        self.init_kubernetes_client()
 
-    def run_kubectl(self, operation, recipe):
-        (tmpfile, fn)=tempfile.mkstemp()
-        os.write(tmpfile, recipe)
-        os.close(tmpfile)
-        try:
-            p = subprocess.Popen(args=["/usr/local/bin/kubectl", operation, "-f", fn],
-                                 stdin=None,
-                                 stderr=subprocess.PIPE,
-                                 stdout=subprocess.PIPE,
-                                 close_fds=True)
-            (stdout, stderr) = p.communicate()
-            log.info("kubectl completed", stderr=stderr, stdout=stdout, recipe=recipe)
-            if p.returncode!=0:
-                raise Exception("Process failed with returncode %s" % p.returncode)
-        finally:
-            os.remove(fn)
+    def init_kubernetes_client(self):
+        self.resource_applier = get_resource_applier()
 
+    @timed_step("sync")
+    @parallel_reconcile(lambda o: o.name)
     def sync_record(self, o):
-        self.run_kubectl("apply", o.resource_definition)
+        applied_hash = definition_hash(o.resource_definition or "", server_side=self.server_side_apply)
+        if (o.applied_hash == applied_hash) and (o.kubectl_state in ["created", "updated"]):
+            if (not self.check_drift) or self.resource_applier.exists(o.resource_definition):
+                log.info("Resource definition is unchanged since it was applied; Skipping apply.", name=o.name)
+                return
+
+        self.resource_applier.apply(o.resource_definition, server_side=self.server_side_apply)
         if (o.kubectl_state == "created"):
             o.kubectl_state = "updated"
         else:
             o.kubectl_state = "created"
-        o.save(update_fields=["kubectl_state"])
+        o.applied_hash = applied_hash
+        o.save(update_fields=["kubectl_state", "applied_hash"])
 
+    @timed_step("delete")
+    @parallel_reconcile(lambda o: o.name)
     def delete_record(self, o):
         if o.kubectl_state in ["created", "updated"]:
-            self.run_kubectl("delete", o.resource_definition)
+            self.resource_applier.delete(o.resource_definition)
             o.kubectl_state="deleted"
-            o.save(update_fields=["kubectl_state"])
+            o.applied_hash = None
+            o.save(update_fields=["kubectl_state", "applied_hash"])
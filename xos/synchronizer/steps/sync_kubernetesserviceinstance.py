@@ -24,13 +24,146 @@
 """
 
 from xossynchronizer.steps.syncstep import SyncStep
-from xossynchronizer.modelaccessor import KubernetesServiceInstance
+from xossynchronizer.modelaccessor import KubernetesServiceInstance, Slice, TrustDomain, Principal, Image, \
+                                                 KubernetesConfigMap, KubernetesSecret, KubernetesConfigVolumeMount, \
+                                                 KubernetesSecretVolumeMount
 
 from xosconfig import Config
 from multistructlog import create_logger
+from informer import get_informer
+from kubernetes_clients import get_core_v1_api
+from helpers import create_ignore_conflict, delete_ignore_missing, deleted_with_namespace
+from workers import parallel_reconcile
+from metrics import timed_step, record_cache_lookup
 
 log = create_logger(Config().get('logging'))
 
+
+def index_by_id(objs):
+    return dict((obj.id, obj) for obj in objs)
+
+
+class PodSpecPrefetch(object):
+    """
+        PodSpecPrefetch
+
+        The XOS objects that generate_pod_spec() reads for a batch of pending KubernetesServiceInstances: slices,
+        trust domains, principals, images, volume mounts, and the ConfigMaps and Secrets they mount. Each model is
+        loaded with one query, rather than with one query per instance and relation.
+
+        The synchronizer creates a new sync step for every object, so the prefetched objects are kept at module
+        scope. fetch_pending() loads them, and the sync_record() calls of the same cycle use them. Anything that was
+        not prefetched, for example because it was created after the load, is read through the object as usual.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.instance_ids = set()
+        self.slices = {}
+        self.trust_domains = {}
+        self.principals = {}
+        self.images = {}
+        self.config_maps = {}
+        self.secrets = {}
+        self.config_mounts = {}  # lists of KubernetesConfigVolumeMount, keyed by service instance id
+        self.secret_mounts = {}  # lists of KubernetesSecretVolumeMount, keyed by service instance id
+
+    def load(self, instances):
+        self.clear()
+
+        instance_ids = set(o.id for o in instances)
+        if not instance_ids:
+            return
+
+        self.slices = index_by_id(Slice.objects.all())
+        self.trust_domains = index_by_id(TrustDomain.objects.all())
+        self.principals = index_by_id(Principal.objects.all())
+        self.images = index_by_id(Image.objects.filter(kind="container"))
+        self.config_maps = index_by_id(KubernetesConfigMap.objects.all())
+        self.secrets = index_by_id(KubernetesSecret.objects.all())
+
+        for mount in KubernetesConfigVolumeMount.objects.all():
+            if mount.service_instance_id in instance_ids:
+                self.config_mounts.setdefault(mount.service_instance_id, []).append(mount)
+        for mount in KubernetesSecretVolumeMount.objects.all():
+            if mount.service_instance_id in instance_ids:
+                self.secret_mounts.setdefault(mount.service_instance_id, []).append(mount)
+
+        # Set last, so that the mounts of an instance are only taken from the prefetch if loading succeeded
+        self.instance_ids = instance_ids
+
+    def get(self, o, name, index):
+        """ Return the object that the foreign key name of o refers to, from index if it was prefetched """
+        obj = index.get(getattr(o, "%s_id" % name, None))
+        record_cache_lookup("pod_spec_prefetch", obj is not None)
+        if obj is None:
+            obj = getattr(o, name)
+        return obj
+
+    def get_slice(self, o):
+        return self.get(o, "slice", self.slices)
+
+    def get_trust_domain(self, slice):
+        return self.get(slice, "trust_domain", self.trust_domains)
+
+    def get_principal(self, slice):
+        return self.get(slice, "principal", self.principals)
+
+    def get_image(self, o):
+        return self.get(o, "image", self.images)
+
+    def get_config_mounts(self, o):
+        """ Return a list of (KubernetesConfigVolumeMount, KubernetesConfigMap) for the instance o """
+        if o.id in self.instance_ids:
+            mounts = self.config_mounts.get(o.id, [])
+        else:
+            mounts = o.kubernetes_config_volume_mounts.all()
+        return [(mount, self.get(mount, "config", self.config_maps)) for mount in mounts]
+
+    def get_secret_mounts(self, o):
+        """ Return a list of (KubernetesSecretVolumeMount, KubernetesSecret) for the instance o """
+        if o.id in self.instance_ids:
+            mounts = self.secret_mounts.get(o.id, [])
+        else:
+            mounts = o.kubernetes_secret_volume_mounts.all()
+        return [(mount, self.get(mount, "secret", self.secrets)) for mount in mounts]
+
+
+pod_spec_prefetch = PodSpecPrefetch()
+
+
+def get_pod_namespace(o):
+    """ Return the namespace of the pod of a KubernetesServiceInstance, which is the name of its slice's trust
+        domain.
+    """
+    return pod_spec_prefetch.get_trust_domain(pod_spec_prefetch.get_slice(o)).name
+
+
+def trim_pod(pod):
+    """ Return a copy of a V1Pod holding only the fields that sync_record and compute_pod_patch use, for the pod
+        informer to cache in place of the full pod.
+    """
+    from kubernetes import client as kubernetes_client
+
+    containers = []
+    for container in (pod.spec.containers or []):
+        volume_mounts = [kubernetes_client.V1VolumeMount(name=m.name, mount_path=m.mount_path, sub_path=m.sub_path)
+                         for m in (container.volume_mounts or [])]
+        containers.append(kubernetes_client.V1Container(name=container.name, image=container.image,
+                                                        volume_mounts=volume_mounts))
+    volumes = [kubernetes_client.V1Volume(name=v.name) for v in (pod.spec.volumes or [])]
+
+    return kubernetes_client.V1Pod(
+        metadata=kubernetes_client.V1ObjectMeta(name=pod.metadata.name,
+                                                namespace=pod.metadata.namespace,
+                                                self_link=pod.metadata.self_link,
+                                                resource_version=pod.metadata.resource_version),
+        spec=kubernetes_client.V1PodSpec(containers=containers, volumes=volumes,
+                                         service_account=pod.spec.service_account))
+
+
 class SyncKubernetesServiceInstance(SyncStep):
 
     """
@@ -43,64 +176,110 @@ class SyncKubernetesServiceInstance(SyncStep):
     observes = KubernetesServiceInstance
     requested_interval = 0
 
+    # Number of threads that reconcile objects of this kind concurrently. 0 reconciles them inline.
+    parallel_workers = 0
+
+    # Create objects without first reading them, falling back to an update if they already exist, and delete objects
+    # without first reading them. Saves a read per object while the informer cache is not yet available.
+    create_first = False
+
+    # When the object's TrustDomain is being deleted too, leave the resource to be removed by the deletion of the
+    # namespace rather than deleting it individually.
+    cascade_namespace_delete = False
+
+    # Prefetch the objects used to generate pod specs only when more than this many xos_managed instances are pending.
+    # Below that, each instance's objects are read individually, rather than loading every object of each model.
+    prefetch_threshold = 10
+
+    # Cache of pods, populated by init_kubernetes_client(). Holds pods trimmed by trim_pod().
+    pod_informer = None
+
     def __init__(self, *args, **kwargs):
         super(SyncKubernetesServiceInstance, self).__init__(*args, **kwargs)
         self.init_kubernetes_client()
 
     def init_kubernetes_client(self):
         from kubernetes.client.rest import ApiException
-        from kubernetes import client as kubernetes_client, config as kubernetes_config
-        kubernetes_config.load_incluster_config()
+        from kubernetes import client as kubernetes_client
         self.kubernetes_client = kubernetes_client
-        self.v1core = kubernetes_client.CoreV1Api()
+        self.v1core = get_core_v1_api()
         self.ApiException = ApiException
+        self.pod_informer = get_informer("pods", self.v1core.list_pod_for_all_namespaces, trim_pod)
 
-    def get_pod(self, o):
+    def get_pod(self, o, use_cache=True):
         """ Given a KubernetesServiceInstance, read the pod from Kubernetes.
             Return None if the pod does not exist.
         """
+        if use_cache and self.pod_informer and self.pod_informer.has_synced():
+            return self.pod_informer.get(get_pod_namespace(o), o.name)
+
+        record_cache_lookup("pods", False)
         try:
-            pod = self.v1core.read_namespaced_pod(o.name, o.slice.trust_domain.name)
+            pod = self.v1core.read_namespaced_pod(o.name, get_pod_namespace(o))
         except self.ApiException, e:
             if e.status == 404:
                 return None
             raise
         return pod
 
+    def fetch_pending(self, deleted):
+        """ Prefetch the objects needed to generate the pod specs of the pending instances. """
+        objs = super(SyncKubernetesServiceInstance, self).fetch_pending(deleted)
+        if not deleted:
+            pending = [o for o in objs if o.xos_managed]
+            if len(pending) <= self.prefetch_threshold:
+                # Cheaper to read the objects of a few instances individually than to load every object
+                pod_spec_prefetch.clear()
+                return objs
+            try:
+                pod_spec_prefetch.load(pending)
+            except Exception:
+                # The sync steps will read the objects individually instead
+                log.exception("Failed to prefetch pod spec objects")
+                pod_spec_prefetch.clear()
+        return objs
+
     def generate_pod_spec(self, o):
+        prefetch = pod_spec_prefetch
+
+        slice = prefetch.get_slice(o)
+        trust_domain = prefetch.get_trust_domain(slice)
+        principal = prefetch.get_principal(slice)
+        image = prefetch.get_image(o)
+
         pod = self.kubernetes_client.V1Pod()
         pod.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
 
-        if o.slice.trust_domain:
-            pod.metadata.namespace = o.slice.trust_domain.name
+        if trust_domain:
+            pod.metadata.namespace = trust_domain.name
 
-        if o.image.tag:
-            imageName = o.image.name + ":" + o.image.tag
+        if image.tag:
+            imageName = image.name + ":" + image.tag
         else:
             # TODO(smbaker): Is this case possible?
-            imageName = o.image.name
+            imageName = image.name
 
         volumes = []
         volume_mounts = []
 
         # Attach and mount the configmaps
-        for xos_vol in o.kubernetes_config_volume_mounts.all():
-            k8s_vol = self.kubernetes_client.V1Volume(name=xos_vol.config.name)
-            k8s_vol.config_map = self.kubernetes_client.V1ConfigMapVolumeSource(name=xos_vol.config.name)
+        for (xos_vol, config) in prefetch.get_config_mounts(o):
+            k8s_vol = self.kubernetes_client.V1Volume(name=config.name)
+            k8s_vol.config_map = self.kubernetes_client.V1ConfigMapVolumeSource(name=config.name)
             volumes.append(k8s_vol)
 
-            k8s_vol_m = self.kubernetes_client.V1VolumeMount(name=xos_vol.config.name,
+            k8s_vol_m = self.kubernetes_client.V1VolumeMount(name=config.name,
                                                         mount_path=xos_vol.mount_path,
                                                         sub_path=xos_vol.sub_path)
             volume_mounts.append(k8s_vol_m)
 
         # Attach and mount the secrets
-        for xos_vol in o.kubernetes_secret_volume_mounts.all():
-            k8s_vol = self.kubernetes_client.V1Volume(name=xos_vol.secret.name)
-            k8s_vol.secret = self.kubernetes_client.V1SecretVolumeSource(secret_name=xos_vol.secret.name)
+        for (xos_vol, secret) in prefetch.get_secret_mounts(o):
+            k8s_vol = self.kubernetes_client.V1Volume(name=secret.name)
+            k8s_vol.secret = self.kubernetes_client.V1SecretVolumeSource(secret_name=secret.name)
             volumes.append(k8s_vol)
 
-            k8s_vol_m = self.kubernetes_client.V1VolumeMount(name=xos_vol.secret.name,
+            k8s_vol_m = self.kubernetes_client.V1VolumeMount(name=secret.name,
                                                         mount_path=xos_vol.mount_path,
                                                         sub_path=xos_vol.sub_path)
             volume_mounts.append(k8s_vol_m)
@@ -112,48 +291,123 @@ class SyncKubernetesServiceInstance(SyncStep):
         spec = self.kubernetes_client.V1PodSpec(containers=[container], volumes=volumes)
         pod.spec = spec
 
-        if o.slice.principal:
-            pod.spec.service_account = o.slice.principal.name
+        if principal:
+            pod.spec.service_account = principal.name
 
         return pod
 
+    @timed_step("sync")
+    @parallel_reconcile(get_pod_namespace)
     def sync_record(self, o):
         if o.xos_managed:
-            if (not o.slice) or (not o.slice.trust_domain):
+            slice = pod_spec_prefetch.get_slice(o)
+            if (not slice) or (not pod_spec_prefetch.get_trust_domain(slice)):
                 raise Exception("No trust domain for service instance", o=o)
 
             if (not o.name):
                 raise Exception("No name for service instance")
 
-            pod = self.get_pod(o)
-            if not pod:
-                pod = self.generate_pod_spec(o)
+            if self.create_first:
+                pod = create_ignore_conflict(self.create_pod, o)
+                if not pod:
+                    # It already exists. The informer may not have seen it yet, so read it from the API server.
+                    pod = self.get_pod(o, use_cache=False)
+                    if not pod:
+                        raise Exception("Pod %s was deleted while it was being updated" % o.name)
+                    pod = self.update_pod(o, pod)
+            else:
+                pod = self.get_pod(o)
+                if not pod:
+                    pod = self.create_pod(o)
+                else:
+                    pod = self.update_pod(o, pod)
 
-                log.info("Creating pod", o=o, pod=pod)
+            if (not o.backend_handle):
+                o.backend_handle = pod.metadata.self_link
+                o.save(update_fields=["backend_handle"])
 
-                pod = self.v1core.create_namespaced_pod(o.slice.trust_domain.name, pod)
-            else:
-                log.info("Replacing pod", o=o, pod=pod)
+    def create_pod(self, o):
+        pod = self.generate_pod_spec(o)
 
-                # TODO: apply changes, perhaps by calling self.generate_pod_spec() and copying in the differences,
-                # to accomodate new volumes that might have been attached, or other changes.
+        log.info("Creating pod", o=o, pod=pod)
 
-                # If we don't apply any changes to the pod, it's still the case that Kubernetes will pull in new
-                # mounts of existing configmaps during the replace operation, if the configmap contents have changed.
+        return self.v1core.create_namespaced_pod(get_pod_namespace(o), pod)
 
-                pod = self.v1core.replace_namespaced_pod(o.name, o.slice.trust_domain.name, pod)
+    def compute_pod_patch(self, pod, desired):
+        """ Compare a live pod against the pod generated by generate_pod_spec(). Returns a tuple (patch, immutable).
+            patch is a strategic merge patch of the differences that can be applied to a running pod, or None if
+            there are none. immutable lists the differences that cannot be applied without recreating the pod.
 
-            if (not o.backend_handle):
-                o.backend_handle = pod.metadata.self_link
-                o.save(update_fields=["backend_handle"])
+            Kubernetes adds volumes and mounts of its own, such as the service account token, so volumes and mounts
+            in the live pod that XOS does not know about are not differences.
+        """
+        patch_containers = []
+        immutable = []
+
+        live_containers = dict((c.name, c) for c in (pod.spec.containers or []))
+        for container in desired.spec.containers:
+            live_container = live_containers.get(container.name)
+            if live_container is None:
+                immutable.append("spec.containers[%s]" % container.name)
+                continue
+
+            if live_container.image != container.image:
+                patch_containers.append({"name": container.name, "image": container.image})
+
+            live_mounts = set((m.name, m.mount_path, m.sub_path or None) for m in (live_container.volume_mounts or []))
+            for mount in (container.volume_mounts or []):
+                if (mount.name, mount.mount_path, mount.sub_path or None) not in live_mounts:
+                    immutable.append("spec.containers[%s].volumeMounts[%s]" % (container.name, mount.name))
+
+        live_volumes = set(v.name for v in (pod.spec.volumes or []))
+        for volume in (desired.spec.volumes or []):
+            if volume.name not in live_volumes:
+                immutable.append("spec.volumes[%s]" % volume.name)
+
+        if desired.spec.service_account and (desired.spec.service_account != pod.spec.service_account):
+            immutable.append("spec.serviceAccount")
+
+        patch = None
+        if patch_containers:
+            # Containers are merged by name, so only the listed fields of the listed containers change
+            patch = {"spec": {"containers": patch_containers}}
 
+        return (patch, immutable)
+
+    def update_pod(self, o, pod):
+        (patch, immutable) = self.compute_pod_patch(pod, self.generate_pod_spec(o))
+
+        if immutable:
+            log.warning("Pod differs from XOS in fields that cannot be changed without recreating it", o=o,
+                        fields=immutable)
+
+        if not patch:
+            log.debug("Pod is unchanged; Nothing to patch.", o=o)
+            return pod
+
+        log.info("Patching pod", o=o, patch=patch)
+        return self.v1core.patch_namespaced_pod(o.name, get_pod_namespace(o), patch)
+
+    @timed_step("delete")
+    @parallel_reconcile(get_pod_namespace)
     def delete_record(self, o):
-        secret = self.get_pod(o)
-        if not secret:
-            log.info("Kubernetes pod does not exist; Nothing to delete.", o=o)
+        if self.cascade_namespace_delete and \
+                deleted_with_namespace(pod_spec_prefetch.get_slice(o).trust_domain_id):
+            log.info("Trust domain is being deleted; Leaving pod to be deleted with its namespace.", o=o)
             return
+
         delete_options = self.kubernetes_client.V1DeleteOptions()
-        self.v1core.delete_namespaced_pod(o.name, o.slice.trust_domain.name, delete_options)
+        if self.create_first:
+            if not delete_ignore_missing(self.v1core.delete_namespaced_pod, o.name, get_pod_namespace(o),
+                                         delete_options):
+                log.info("Kubernetes pod does not exist; Nothing to delete.", o=o)
+                return
+        else:
+            secret = self.get_pod(o)
+            if not secret:
+                log.info("Kubernetes pod does not exist; Nothing to delete.", o=o)
+                return
+            self.v1core.delete_namespaced_pod(o.name, get_pod_namespace(o), delete_options)
         log.info("Deleted pod from kubernetes", handle=o.backend_handle)
 
 
@@ -24,6 +24,12 @@ from xossynchronizer.modelaccessor import Principal
 
 from xosconfig import Config
 from multistructlog import create_logger
+from informer import get_informer
+from kubernetes_clients import get_core_v1_api
+from helpers import create_ignore_conflict, delete_ignore_missing, deleted_with_namespace, \
+    get_kubernetes_trust_domain_ids
+from workers import parallel_reconcile
+from metrics import timed_step, record_cache_lookup
 
 log = create_logger(Config().get('logging'))
 
@@ -39,22 +45,40 @@ class SyncPrincipal(SyncStep):
     observes = Principal
     requested_interval = 0
 
+    # Number of threads that reconcile objects of this kind concurrently. 0 reconciles them inline.
+    parallel_workers = 0
+
+    # Create objects without first reading them, falling back to an update if they already exist, and delete objects
+    # without first reading them. Saves a read per object while the informer cache is not yet available.
+    create_first = False
+
+    # When the object's TrustDomain is being deleted too, leave the resource to be removed by the deletion of the
+    # namespace rather than deleting it individually.
+    cascade_namespace_delete = False
+
+    # Cache of service accounts, populated by init_kubernetes_client()
+    service_account_informer = None
+
     def __init__(self, *args, **kwargs):
         super(SyncPrincipal, self).__init__(*args, **kwargs)
         self.init_kubernetes_client()
 
     def init_kubernetes_client(self):
         from kubernetes.client.rest import ApiException
-        from kubernetes import client as kubernetes_client, config as kubernetes_config
-        kubernetes_config.load_incluster_config()
+        from kubernetes import client as kubernetes_client
         self.kubernetes_client = kubernetes_client
-        self.v1core = kubernetes_client.CoreV1Api()
+        self.v1core = get_core_v1_api()
         self.ApiException = ApiException
+        self.service_account_informer = get_informer("serviceaccounts", self.v1core.list_service_account_for_all_namespaces)
 
-    def get_service_account(self, o):
+    def get_service_account(self, o, use_cache=True):
         """ Given an XOS Principal object, read the corresponding ServiceAccount from Kubernetes.
             return None if no ServiceAccount exists.
         """
+        if use_cache and self.service_account_informer and self.service_account_informer.has_synced():
+            return self.service_account_informer.get(o.trust_domain.name, o.name)
+
+        record_cache_lookup("serviceaccounts", False)
         try:
             service_account = self.v1core.read_namespaced_service_account(o.name, o.trust_domain.name)
         except self.ApiException, e:
@@ -69,34 +93,54 @@ class SyncPrincipal(SyncStep):
             interesting.
         """
         objs = super(SyncPrincipal, self).fetch_pending(deleted)
-        for obj in objs[:]:
-            # If the Principal isn't in a TrustDomain, then the K8s synchronizer can't do anything with it
-            if not obj.trust_domain:
-                objs.remove(obj)
-                continue
+        if not objs:
+            return objs
 
-            # If the Principal's TrustDomain isn't part of the K8s service, then it's someone else's principal
-            if "KubernetesService" not in obj.trust_domain.owner.leaf_model.class_names:
-                objs.remove(obj)
-        return objs
+        # If the Principal isn't in a TrustDomain, then the K8s synchronizer can't do anything with it. If the
+        # Principal's TrustDomain isn't part of the K8s service, then it's someone else's principal.
+        trust_domain_ids = get_kubernetes_trust_domain_ids(deleted)
+        return [obj for obj in objs if obj.trust_domain_id in trust_domain_ids]
 
-    def sync_record(self, o):
-            service_account = self.get_service_account(o)
-            if not service_account:
-                service_account = self.kubernetes_client.V1ServiceAccount()
-                service_account.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
+    def create_service_account(self, o):
+        service_account = self.kubernetes_client.V1ServiceAccount()
+        service_account.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
 
-                service_account = self.v1core.create_namespaced_service_account(o.trust_domain.name, service_account)
+        return self.v1core.create_namespaced_service_account(o.trust_domain.name, service_account)
 
-            if (not o.backend_handle):
+    @timed_step("sync")
+    @parallel_reconcile(lambda o: o.trust_domain.name)
+    def sync_record(self, o):
+            if self.create_first:
+                service_account = create_ignore_conflict(self.create_service_account, o)
+                if (not service_account) and (not o.backend_handle):
+                    # It already exists, and we need its handle
+                    service_account = self.get_service_account(o, use_cache=False)
+            else:
+                service_account = self.get_service_account(o)
+                if not service_account:
+                    service_account = self.create_service_account(o)
+
+            if (not o.backend_handle) and service_account:
                 o.backend_handle = service_account.metadata.self_link
                 o.save(update_fields=["backend_handle"])
 
+    @timed_step("delete")
+    @parallel_reconcile(lambda o: o.trust_domain.name)
     def delete_record(self, o):
-        principal = self.get_service_account(o)
-        if not principal:
-            log.info("Kubernetes service account does not exist; Nothing to delete.", o=o)
+        if self.cascade_namespace_delete and deleted_with_namespace(o.trust_domain_id):
+            log.info("Trust domain is being deleted; Leaving service account to be deleted with its namespace.", o=o)
             return
+
         delete_options = self.kubernetes_client.V1DeleteOptions()
-        self.v1core.delete_namespaced_service_account(o.name, o.trust_domain.name, delete_options)
+        if self.create_first:
+            if not delete_ignore_missing(self.v1core.delete_namespaced_service_account, o.name, o.trust_domain.name,
+                                         delete_options):
+                log.info("Kubernetes service account does not exist; Nothing to delete.", o=o)
+                return
+        else:
+            principal = self.get_service_account(o)
+            if not principal:
+                log.info("Kubernetes service account does not exist; Nothing to delete.", o=o)
+                return
+            self.v1core.delete_namespaced_service_account(o.name, o.trust_domain.name, delete_options)
         log.info("Deleted Principal from kubernetes", handle=o.backend_handle)
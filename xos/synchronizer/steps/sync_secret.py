@@ -25,6 +25,11 @@ from xossynchronizer.modelaccessor import KubernetesSecret
 
 from xosconfig import Config
 from multistructlog import create_logger
+from informer import get_informer
+from kubernetes_clients import get_core_v1_api
+from helpers import data_merge_patch, create_ignore_conflict, delete_ignore_missing, deleted_with_namespace
+from workers import parallel_reconcile
+from metrics import timed_step, record_cache_lookup
 
 log = create_logger(Config().get('logging'))
 
@@ -40,22 +45,43 @@ class SyncKubernetesSecret(SyncStep):
     observes = KubernetesSecret
     requested_interval = 0
 
+    # Number of threads that reconcile objects of this kind concurrently. 0 reconciles them inline.
+    parallel_workers = 0
+
+    # Create objects without first reading them, falling back to an update if they already exist, and delete objects
+    # without first reading them. Saves a read per object while the informer cache is not yet available.
+    create_first = False
+
+    # When the object's TrustDomain is being deleted too, leave the resource to be removed by the deletion of the
+    # namespace rather than deleting it individually.
+    cascade_namespace_delete = False
+
+    # Cache of secrets, populated by init_kubernetes_client()
+    secret_informer = None
+
     def __init__(self, *args, **kwargs):
         super(SyncKubernetesSecret, self).__init__(*args, **kwargs)
         self.init_kubernetes_client()
 
     def init_kubernetes_client(self):
         from kubernetes.client.rest import ApiException
-        from kubernetes import client as kubernetes_client, config as kubernetes_config
-        kubernetes_config.load_incluster_config()
+        from kubernetes import client as kubernetes_client
         self.kubernetes_client = kubernetes_client
-        self.v1core = kubernetes_client.CoreV1Api()
+        self.v1core = get_core_v1_api()
         self.ApiException = ApiException
+        self.secret_informer = get_informer("secrets", self.v1core.list_secret_for_all_namespaces)
 
-    def get_secret(self, o):
+    def cache_synced(self):
+        return bool(self.secret_informer) and self.secret_informer.has_synced()
+
+    def get_secret(self, o, use_cache=True):
         """ Given an XOS KubernetesSecret object, read the corresponding Secret from Kubernetes.
             return None if no Secret exists.
         """
+        if use_cache and self.cache_synced():
+            return self.secret_informer.get(o.trust_domain.name, o.name)
+
+        record_cache_lookup("secrets", False)
         try:
             secret = self.v1core.read_namespaced_secret(o.name, o.trust_domain.name)
         except self.ApiException, e:
@@ -64,27 +90,77 @@ class SyncKubernetesSecret(SyncStep):
             raise
         return secret
 
-    def sync_record(self, o):
-            secret = self.get_secret(o)
+    def create_secret(self, o):
+        secret = self.kubernetes_client.V1Secret()
+        secret.data = json.loads(o.data)
+        secret.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
+
+        return self.v1core.create_namespaced_secret(o.trust_domain.name, secret)
+
+    def update_secret(self, o, secret, fresh=True):
+        """ Patch the keys of secret that differ from o, rather than sending the whole object. If secret came from
+            the informer cache (fresh is False), it may be stale. The patch is conditional on its resourceVersion, and
+            if it turns out to be stale (409 Conflict), or if nothing appears to have changed, the Secret is read
+            from the API server and compared again.
+        """
+        data = json.loads(o.data)
+        while True:
+            patch = data_merge_patch(secret.data, data)
+            try:
+                if patch:
+                    body = {"metadata": {"resourceVersion": secret.metadata.resource_version}, "data": patch}
+                    self.v1core.patch_namespaced_secret(o.name, o.trust_domain.name, body)
+                    return
+                if fresh:
+                    log.debug("Data is unchanged; Nothing to patch.", o=o)
+                    return
+            except self.ApiException, e:
+                if (e.status != 409) or fresh:
+                    raise
+            secret = self.get_secret(o, use_cache=False)
             if not secret:
-                secret = self.kubernetes_client.V1Secret()
-                secret.data = json.loads(o.data)
-                secret.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
+                raise Exception("Secret %s was deleted while it was being updated" % o.name)
+            fresh = True
 
-                secret = self.v1core.create_namespaced_secret(o.trust_domain.name, secret)
+    @timed_step("sync")
+    @parallel_reconcile(lambda o: o.trust_domain.name)
+    def sync_record(self, o):
+            if self.create_first:
+                secret = create_ignore_conflict(self.create_secret, o)
+                if not secret:
+                    # It already exists. The informer may not have seen it yet, so read it from the API server.
+                    secret = self.get_secret(o, use_cache=False)
+                    if not secret:
+                        raise Exception("Secret %s was deleted while it was being updated" % o.name)
+                    self.update_secret(o, secret)
             else:
-                secret.data = json.loads(o.data)
-                self.v1core.patch_namespaced_secret(o.name, o.trust_domain.name, secret)
+                secret = self.get_secret(o)
+                if not secret:
+                    secret = self.create_secret(o)
+                else:
+                    self.update_secret(o, secret, fresh=not self.cache_synced())
 
             if (not o.backend_handle):
                 o.backend_handle = secret.metadata.self_link
                 o.save(update_fields=["backend_handle"])
 
+    @timed_step("delete")
+    @parallel_reconcile(lambda o: o.trust_domain.name)
     def delete_record(self, o):
-        secret = self.get_secret(o)
-        if not secret:
-            log.info("Kubernetes secret does not exist; Nothing to delete.", o=o)
+        if self.cascade_namespace_delete and deleted_with_namespace(o.trust_domain_id):
+            log.info("Trust domain is being deleted; Leaving secret to be deleted with its namespace.", o=o)
             return
+
         delete_options = self.kubernetes_client.V1DeleteOptions()
-        self.v1core.delete_namespaced_secret(o.name, o.trust_domain.name, delete_options)
+        if self.create_first:
+            if not delete_ignore_missing(self.v1core.delete_namespaced_secret, o.name, o.trust_domain.name,
+                                         delete_options):
+                log.info("Kubernetes secret does not exist; Nothing to delete.", o=o)
+                return
+        else:
+            secret = self.get_secret(o)
+            if not secret:
+                log.info("Kubernetes secret does not exist; Nothing to delete.", o=o)
+                return
+            self.v1core.delete_namespaced_secret(o.name, o.trust_domain.name, delete_options)
         log.info("Deleted secret from kubernetes", handle=o.backend_handle)
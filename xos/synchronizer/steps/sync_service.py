@@ -21,11 +21,15 @@
 """
 
 from xossynchronizer.steps.syncstep import SyncStep
-from xossynchronizer.modelaccessor import Service
+from xossynchronizer.modelaccessor import Service, ServicePort, Slice
 
 from xosconfig import Config
 from multistructlog import create_logger
-from helpers import debug_once
+from informer import get_informer
+from kubernetes_clients import get_core_v1_api
+from helpers import debug_once, create_ignore_conflict, delete_ignore_missing
+from workers import parallel_reconcile
+from metrics import timed_step, record_cache_lookup
 
 log = create_logger(Config().get('logging'))
 
@@ -42,17 +46,28 @@ class SyncService(SyncStep):
     observes = Service
     requested_interval = 0
 
+    # Number of threads that reconcile objects of this kind concurrently. 0 reconciles them inline. Services are
+    # ordered by name, since finding a Service's namespace takes a query of its slices.
+    parallel_workers = 0
+
+    # Create objects without first reading them, falling back to an update if they already exist, and delete objects
+    # without first reading them. Saves a read per object while the informer cache is not yet available.
+    create_first = False
+
+    # Cache of services, populated by init_kubernetes_client()
+    service_informer = None
+
     def __init__(self, *args, **kwargs):
         super(SyncService, self).__init__(*args, **kwargs)
         self.init_kubernetes_client()
 
     def init_kubernetes_client(self):
         from kubernetes.client.rest import ApiException
-        from kubernetes import client as kubernetes_client, config as kubernetes_config
-        kubernetes_config.load_incluster_config()
+        from kubernetes import client as kubernetes_client
         self.kubernetes_client = kubernetes_client
-        self.v1core = kubernetes_client.CoreV1Api()
+        self.v1core = get_core_v1_api()
         self.ApiException = ApiException
+        self.service_informer = get_informer("services", self.v1core.list_service_for_all_namespaces)
 
     def fetch_pending(self, deletion=False):
         """ Filter the set of pending objects.
@@ -61,18 +76,33 @@ class SyncService(SyncStep):
         """
         models = super(SyncService, self).fetch_pending(deletion)
 
-        if (not deletion):
-            for model in models[:]:
-                if not self.get_trust_domain(model):
+        if (not deletion) and models:
+            # Index the trust domains of every service's slices, and which services have ports, with one query
+            # each instead of several per service.
+            trust_domain_ids = {}
+            for slice in Slice.objects.all():
+                if slice.trust_domain_id:
+                    trust_domain_ids.setdefault(slice.service_id, set()).add(slice.trust_domain_id)
+            ported_service_ids = set([service_port.service_id for service_port in ServicePort.objects.all()])
+
+            pending = []
+            for model in models:
+                model_trust_domain_ids = trust_domain_ids.get(model.id, set())
+                if len(model_trust_domain_ids) > 1:
+                    # The same situation get_trust_domain() bails out on
+                    log.warning("Service %s is comprised of slices from multiple trust domains." % model.name)
+                    debug_once("Service %s: Unable to determine Trust Domain. Ignoring." % model.name)
+                elif not model_trust_domain_ids:
                     # If this happens, then either the Service has no Slices, or it does have slices but none of
                     # those slices are associated with a TrustDomain. Assume the developer has done this on purpose
                     # and ignore the Service.
                     debug_once("Service %s: Unable to determine Trust Domain. Ignoring." % model.name)
-                    models.remove(model)
-                elif not model.serviceports.exists():
+                elif model.id not in ported_service_ids:
                     # If there are not ServicePorts, then there's not much for us to do at this time...
                     debug_once("Service %s: Has no serviceports. Ignoring." % model.name)
-                    models.remove(model)
+                else:
+                    pending.append(model)
+            models = pending
 
         return models
 
@@ -99,10 +129,14 @@ class SyncService(SyncStep):
 
         return trust_domain
 
-    def get_service(self, o, trust_domain_name):
+    def get_service(self, o, trust_domain_name, use_cache=True):
         """ Given an XOS Service, read the associated Service from Kubernetes.
             If no Kubernetes service exists, return None
         """
+        if use_cache and self.service_informer and self.service_informer.has_synced():
+            return self.service_informer.get(trust_domain_name, o.name)
+
+        record_cache_lookup("services", False)
         try:
             k8s_service = self.v1core.read_namespaced_service(o.name, trust_domain_name)
         except self.ApiException, e:
@@ -111,32 +145,45 @@ class SyncService(SyncStep):
             raise
         return k8s_service
 
-    def sync_record(self, o):
-        trust_domain = self.get_trust_domain(o)
-        k8s_service = self.get_service(o,trust_domain.name)
+    def create_service(self, o, trust_domain):
+        k8s_service = self.kubernetes_client.V1Service()
+        k8s_service.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
+
+        ports=[]
+        for service_port in o.serviceports.all():
+            port=self.kubernetes_client.V1ServicePort(name = service_port.name,
+                                              node_port = service_port.external_port,
+                                              port = service_port.internal_port,
+                                              target_port = service_port.internal_port,
+                                              protocol = service_port.protocol)
+            ports.append(port)
 
-        if not k8s_service:
-            k8s_service = self.kubernetes_client.V1Service()
-            k8s_service.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
+        k8s_service.spec = self.kubernetes_client.V1ServiceSpec(ports=ports,
+                                                           type="NodePort")
 
-            ports=[]
-            for service_port in o.serviceports.all():
-                port=self.kubernetes_client.V1ServicePort(name = service_port.name,
-                                                  node_port = service_port.external_port,
-                                                  port = service_port.internal_port,
-                                                  target_port = service_port.internal_port,
-                                                  protocol = service_port.protocol)
-                ports.append(port)
+        return self.v1core.create_namespaced_service(trust_domain.name, k8s_service)
 
-            k8s_service.spec = self.kubernetes_client.V1ServiceSpec(ports=ports,
-                                                               type="NodePort")
+    @timed_step("sync")
+    @parallel_reconcile(lambda o: o.name)
+    def sync_record(self, o):
+        trust_domain = self.get_trust_domain(o)
 
-            k8s_service = self.v1core.create_namespaced_service(trust_domain.name, k8s_service)
+        if self.create_first:
+            k8s_service = create_ignore_conflict(self.create_service, o, trust_domain)
+            if (not k8s_service) and (not o.backend_handle):
+                # It already exists, and we need its handle
+                k8s_service = self.get_service(o, trust_domain.name, use_cache=False)
+        else:
+            k8s_service = self.get_service(o,trust_domain.name)
+            if not k8s_service:
+                k8s_service = self.create_service(o, trust_domain)
 
-        if (not o.backend_handle):
+        if (not o.backend_handle) and k8s_service:
             o.backend_handle = k8s_service.metadata.self_link
             o.save(update_fields=["backend_handle"])
 
+    @timed_step("delete")
+    @parallel_reconcile(lambda o: o.name)
     def delete_record(self, o):
         trust_domain_name = None
         trust_domain = self.get_trust_domain(o)
@@ -153,10 +200,16 @@ class SyncService(SyncStep):
         if not trust_domain_name:
             raise Exception("Can't delete service %s because there is no trust domain" % o.name)
 
-        k8s_service = self.get_service(o, trust_domain_name)
-        if not k8s_service:
-            log.info("Kubernetes service does not exist; Nothing to delete.", o=o)
-            return
         delete_options = self.kubernetes_client.V1DeleteOptions()
-        self.v1core.delete_namespaced_service(o.name, trust_domain_name, delete_options)
+        if self.create_first:
+            if not delete_ignore_missing(self.v1core.delete_namespaced_service, o.name, trust_domain_name,
+                                         delete_options):
+                log.info("Kubernetes service does not exist; Nothing to delete.", o=o)
+                return
+        else:
+            k8s_service = self.get_service(o, trust_domain_name)
+            if not k8s_service:
+                log.info("Kubernetes service does not exist; Nothing to delete.", o=o)
+                return
+            self.v1core.delete_namespaced_service(o.name, trust_domain_name, delete_options)
         log.info("Deleted service from kubernetes", handle=o.backend_handle)
@@ -24,6 +24,11 @@ from xossynchronizer.modelaccessor import TrustDomain
 
 from xosconfig import Config
 from multistructlog import create_logger
+from informer import get_informer
+from kubernetes_clients import get_core_v1_api
+from helpers import create_ignore_conflict, delete_ignore_missing, get_kubernetes_service_ids
+from workers import parallel_reconcile
+from metrics import timed_step, record_cache_lookup
 
 log = create_logger(Config().get('logging'))
 
@@ -39,17 +44,27 @@ class SyncTrustDomain(SyncStep):
     observes = TrustDomain
     requested_interval = 0
 
+    # Number of threads that reconcile objects of this kind concurrently. 0 reconciles them inline.
+    parallel_workers = 0
+
+    # Create objects without first reading them, falling back to an update if they already exist, and delete objects
+    # without first reading them. Saves a read per object while the informer cache is not yet available.
+    create_first = False
+
+    # Cache of namespaces, populated by init_kubernetes_client()
+    namespace_informer = None
+
     def __init__(self, *args, **kwargs):
         super(SyncTrustDomain, self).__init__(*args, **kwargs)
         self.init_kubernetes_client()
 
     def init_kubernetes_client(self):
         from kubernetes.client.rest import ApiException
-        from kubernetes import client as kubernetes_client, config as kubernetes_config
-        kubernetes_config.load_incluster_config()
+        from kubernetes import client as kubernetes_client
         self.kubernetes_client = kubernetes_client
-        self.v1core = kubernetes_client.CoreV1Api()
+        self.v1core = get_core_v1_api()
         self.ApiException = ApiException
+        self.namespace_informer = get_informer("namespaces", self.v1core.list_namespace)
 
     def fetch_pending(self, deleted):
         """ Figure out which TrustDomains are interesting to the K8s synchronizer. It's necessary to filter as we're
@@ -57,16 +72,21 @@ class SyncTrustDomain(SyncStep):
             Kubernetes.
         """
         objs = super(SyncTrustDomain, self).fetch_pending(deleted)
-        for obj in objs[:]:
-            # If the TrustDomain isn't part of the K8s service, then it's someone else's trust domain
-            if "KubernetesService" not in obj.owner.leaf_model.class_names:
-                objs.remove(obj)
-        return objs
+        if not objs:
+            return objs
+
+        # If the TrustDomain isn't part of the K8s service, then it's someone else's trust domain
+        service_ids = get_kubernetes_service_ids(deleted)
+        return [obj for obj in objs if obj.owner_id in service_ids]
 
-    def get_namespace(self, o):
+    def get_namespace(self, o, use_cache=True):
         """ Give an XOS TrustDomain object, return the corresponding namespace from Kubernetes.
             Return None if no namespace exists.
         """
+        if use_cache and self.namespace_informer and self.namespace_informer.has_synced():
+            return self.namespace_informer.get(None, o.name)
+
+        record_cache_lookup("namespaces", False)
         try:
             ns = self.v1core.read_namespace(o.name)
         except self.ApiException, e:
@@ -75,25 +95,43 @@ class SyncTrustDomain(SyncStep):
             raise
         return ns
 
-    def sync_record(self, o):
-            ns = self.get_namespace(o)
-            if not ns:
-                ns = self.kubernetes_client.V1Namespace()
-                ns.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
+    def create_namespace(self, o):
+        ns = self.kubernetes_client.V1Namespace()
+        ns.metadata = self.kubernetes_client.V1ObjectMeta(name=o.name)
 
-                log.info("creating namespace %s" % o.name)
-                ns=self.v1core.create_namespace(ns)
+        log.info("creating namespace %s" % o.name)
+        return self.v1core.create_namespace(ns)
 
-            if (not o.backend_handle):
+    @timed_step("sync")
+    @parallel_reconcile(lambda o: o.name)
+    def sync_record(self, o):
+            if self.create_first:
+                ns = create_ignore_conflict(self.create_namespace, o)
+                if (not ns) and (not o.backend_handle):
+                    # It already exists, and we need its handle
+                    ns = self.get_namespace(o, use_cache=False)
+            else:
+                ns = self.get_namespace(o)
+                if not ns:
+                    ns = self.create_namespace(o)
+
+            if (not o.backend_handle) and ns:
                 o.backend_handle = ns.metadata.self_link
                 o.save(update_fields=["backend_handle"])
 
+    @timed_step("delete")
+    @parallel_reconcile(lambda o: o.name)
     def delete_record(self, o):
-        namespace = self.get_namespace(o)
-        if not namespace:
-            log.info("Kubernetes trust domain does not exist; Nothing to delete.", o=o)
-            return
         delete_options = self.kubernetes_client.V1DeleteOptions()
-        self.v1core.delete_namespace(o.name, delete_options)
+        if self.create_first:
+            if not delete_ignore_missing(self.v1core.delete_namespace, o.name, delete_options):
+                log.info("Kubernetes trust domain does not exist; Nothing to delete.", o=o)
+                return
+        else:
+            namespace = self.get_namespace(o)
+            if not namespace:
+                log.info("Kubernetes trust domain does not exist; Nothing to delete.", o=o)
+                return
+            self.v1core.delete_namespace(o.name, delete_options)
         log.info("Deleted trust domain from kubernetes", handle=o.backend_handle)
 
@@ -0,0 +1,127 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+from mock import MagicMock, patch
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+class TestEventPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        from event_publisher import EventPublisher
+        self.publisher = EventPublisher()
+
+        # The producer reports delivery as soon as an event is produced
+        self.producer = MagicMock()
+        self.delivery_error = None
+        def produce(topic, value, key, callback):
+            callback(self.delivery_error, MagicMock())
+        self.producer.produce.side_effect = produce
+
+        self.publisher.get_producer = MagicMock(return_value=self.producer)
+
+    def tearDown(self):
+        sys.path = self.sys_path_save
+
+    def test_publish_delivered(self):
+        on_delivered = MagicMock()
+        self.assertTrue(self.publisher.publish("topic", "key", "value", on_delivered=on_delivered, pending_key="key"))
+        self.assertEqual(self.publisher.queue_depth(), 1)
+        self.assertIn("key", self.publisher.pending_keys)
+
+        self.publisher.drain()
+
+        self.producer.produce.assert_called_once()
+        self.assertEqual(self.producer.produce.call_args[0], ("topic", "value", "key"))
+        self.producer.flush.assert_called_once_with(self.publisher.delivery_timeout)
+        on_delivered.assert_called_once_with()
+        self.assertEqual(self.publisher.queue_depth(), 0)
+        self.assertNotIn("key", self.publisher.pending_keys)
+
+    def test_publish_failed_delivery(self):
+        self.delivery_error = "broker unavailable"
+        on_delivered = MagicMock()
+        self.publisher.publish("topic", "key", "value", on_delivered=on_delivered, pending_key="key")
+
+        self.publisher.drain()
+
+        on_delivered.assert_not_called()
+        self.assertNotIn("key", self.publisher.pending_keys)
+
+    def test_publish_pending_key(self):
+        self.assertTrue(self.publisher.publish("topic", "key", "value", pending_key="key"))
+        self.assertFalse(self.publisher.publish("topic", "key", "value", pending_key="key"))
+        self.assertTrue(self.publisher.publish("topic", "key", "value"))
+        self.assertEqual(self.publisher.queue_depth(), 2)
+
+    def test_publish_queue_full(self):
+        with patch.object(self.publisher.queue, "maxsize", 2):
+            self.assertTrue(self.publisher.publish("topic", "a", "value", pending_key="a"))
+            self.assertTrue(self.publisher.publish("topic", "b", "value", pending_key="b"))
+            self.assertFalse(self.publisher.publish("topic", "c", "value", pending_key="c"))
+        self.assertNotIn("c", self.publisher.pending_keys)
+
+    def test_drain_batches(self):
+        self.publisher.batch_size = 2
+        for i in range(5):
+            self.publisher.publish("topic", str(i), "value")
+
+        self.publisher.drain()
+
+        self.assertEqual(self.producer.produce.call_count, 5)
+        self.assertEqual(self.producer.flush.call_count, 3)
+
+    def test_late_delivery_report(self):
+        # The delivery report is still outstanding when flush() returns, and arrives on a later poll
+        callbacks = []
+        self.producer.produce.side_effect = lambda topic, value, key, callback: callbacks.append(callback)
+        self.publisher.poll_interval = 0.01
+        on_delivered = MagicMock()
+        self.publisher.publish("topic", "key", "value", on_delivered=on_delivered, pending_key="key")
+
+        self.publisher.run_once()
+        on_delivered.assert_not_called()
+        self.assertFalse(self.publisher.publish("topic", "key", "value", pending_key="key"))
+
+        def poll(timeout):
+            while callbacks:
+                callbacks.pop()(None, MagicMock())
+        self.producer.poll.side_effect = poll
+
+        # With no new events, the publisher polls for the report instead of blocking on the queue
+        self.publisher.run_once()
+        on_delivered.assert_called_once_with()
+        self.assertNotIn("key", self.publisher.pending_keys)
+
+    def test_no_producer(self):
+        self.publisher.get_producer.return_value = None
+        self.publisher.publish("topic", "key", "value", pending_key="key")
+
+        self.publisher.drain()
+
+        self.assertNotIn("key", self.publisher.pending_keys)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+from mock import MagicMock, patch
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+class ApiException(Exception):
+    def __init__(self, status, *args, **kwargs):
+        super(ApiException, self).__init__(*args, **kwargs)
+        self.status = status
+
+class TestHelpers(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        import helpers
+        self.helpers = helpers
+
+    def tearDown(self):
+        sys.path = self.sys_path_save
+
+    def test_data_merge_patch(self):
+        patch = self.helpers.data_merge_patch({"same": "1", "changed": "2", "removed": "3"},
+                                              {"same": "1", "changed": "two", "added": "4"})
+        self.assertEqual(patch, {"changed": "two", "removed": None, "added": "4"})
+
+    def test_data_merge_patch_unchanged(self):
+        self.assertEqual(self.helpers.data_merge_patch({"a": "1"}, {"a": "1"}), {})
+        self.assertEqual(self.helpers.data_merge_patch(None, {}), {})
+
+    def test_data_merge_patch_empty(self):
+        self.assertEqual(self.helpers.data_merge_patch(None, {"a": "1"}), {"a": "1"})
+        self.assertEqual(self.helpers.data_merge_patch({"a": "1"}, None), {"a": None})
+
+    def test_create_ignore_conflict(self):
+        create = MagicMock(return_value="created")
+        self.assertEqual(self.helpers.create_ignore_conflict(create, "ns", body="foo"), "created")
+        create.assert_called_with("ns", body="foo")
+
+        create.side_effect = ApiException(status=409)
+        self.assertEqual(self.helpers.create_ignore_conflict(create, "ns"), None)
+
+        create.side_effect = ApiException(status=403)
+        with self.assertRaises(ApiException):
+            self.helpers.create_ignore_conflict(create, "ns")
+
+    def test_delete_ignore_missing(self):
+        delete = MagicMock()
+        self.assertTrue(self.helpers.delete_ignore_missing(delete, "name", "ns"))
+        delete.assert_called_with("name", "ns")
+
+        delete.side_effect = ApiException(status=404)
+        self.assertFalse(self.helpers.delete_ignore_missing(delete, "name", "ns"))
+
+        delete.side_effect = ApiException(status=500)
+        with self.assertRaises(ApiException):
+            self.helpers.delete_ignore_missing(delete, "name", "ns")
+
+    def test_deleted_with_namespace(self):
+        modelaccessor = MagicMock()
+        trust_domain = MagicMock()
+        trust_domain.owner.leaf_model.class_names = "KubernetesService,Service"
+        modelaccessor.TrustDomain.deleted_objects.filter.return_value = [trust_domain]
+
+        with patch.dict("sys.modules", {"xossynchronizer.modelaccessor": modelaccessor}):
+            self.assertTrue(self.helpers.deleted_with_namespace(7))
+            modelaccessor.TrustDomain.deleted_objects.filter.assert_called_with(id=7)
+
+            # Someone else's trust domain
+            trust_domain.owner.leaf_model.class_names = "ONOSService,Service"
+            self.assertFalse(self.helpers.deleted_with_namespace(7))
+
+            # Not being deleted
+            modelaccessor.TrustDomain.deleted_objects.filter.return_value = []
+            self.assertFalse(self.helpers.deleted_with_namespace(7))
+
+            self.assertFalse(self.helpers.deleted_with_namespace(None))
+
+    def test_get_kubernetes_trust_domain_ids(self):
+        modelaccessor = MagicMock()
+        modelaccessor.KubernetesService.objects.all.return_value = [MagicMock(id=1)]
+        modelaccessor.KubernetesService.deleted_objects.all.return_value = [MagicMock(id=2)]
+        modelaccessor.TrustDomain.objects.all.return_value = [MagicMock(id=10, owner_id=1),
+                                                              MagicMock(id=11, owner_id=3)]
+        modelaccessor.TrustDomain.deleted_objects.all.return_value = [MagicMock(id=12, owner_id=1),
+                                                                      MagicMock(id=13, owner_id=2)]
+
+        with patch.dict("sys.modules", {"xossynchronizer.modelaccessor": modelaccessor}):
+            self.assertEqual(self.helpers.get_kubernetes_service_ids(), set([1]))
+            self.assertEqual(self.helpers.get_kubernetes_service_ids(deleted=True), set([1, 2]))
+            self.assertEqual(self.helpers.get_kubernetes_trust_domain_ids(), set([10]))
+            self.assertEqual(self.helpers.get_kubernetes_trust_domain_ids(deleted=True), set([10, 12, 13]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+from mock import MagicMock
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+def make_obj(namespace, name, resource_version="1"):
+    obj = MagicMock()
+    obj.metadata.namespace = namespace
+    obj.metadata.name = name
+    obj.metadata.resource_version = resource_version
+    return obj
+
+class TestInformer(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        from informer import Informer
+        self.informer_class = Informer
+
+    def tearDown(self):
+        sys.path = self.sys_path_save
+
+    def test_not_synced(self):
+        informer = self.informer_class("configmaps", MagicMock())
+        self.assertFalse(informer.has_synced())
+        self.assertEqual(informer.get("test-trust", "foo"), None)
+
+    def test_relist(self):
+        list_func = MagicMock()
+        list_func.return_value.items = [make_obj("test-trust", "foo"), make_obj("test-trust", "bar")]
+        list_func.return_value.metadata.resource_version = "100"
+
+        informer = self.informer_class("configmaps", list_func)
+        informer.relist()
+
+        list_func.assert_called_with(watch=False)
+        self.assertTrue(informer.has_synced())
+        self.assertEqual(informer.resource_version, "100")
+        self.assertNotEqual(informer.get("test-trust", "foo"), None)
+        self.assertEqual(informer.get("other-trust", "foo"), None)
+
+    def test_apply_events(self):
+        informer = self.informer_class("configmaps", MagicMock())
+
+        foo = make_obj("test-trust", "foo", "101")
+        self.assertTrue(informer.apply_event({"type": "ADDED", "object": foo, "raw_object": {}}))
+        self.assertIn(("test-trust", "foo"), informer.objects)
+        self.assertEqual(informer.resource_version, "101")
+
+        foo = make_obj("test-trust", "foo", "102")
+        self.assertTrue(informer.apply_event({"type": "DELETED", "object": foo, "raw_object": {}}))
+        self.assertNotIn(("test-trust", "foo"), informer.objects)
+        self.assertEqual(informer.resource_version, "102")
+
+    def test_transform(self):
+        list_func = MagicMock()
+        list_func.return_value.items = [make_obj("test-trust", "foo")]
+        list_func.return_value.metadata.resource_version = "100"
+
+        informer = self.informer_class("pods", list_func, transform=lambda obj: obj.metadata.name)
+        informer.relist()
+        self.assertEqual(informer.objects, {("test-trust", "foo"): "foo"})
+
+        bar = make_obj("test-trust", "bar", "101")
+        self.assertTrue(informer.apply_event({"type": "MODIFIED", "object": bar, "raw_object": {}}))
+        self.assertEqual(informer.get("test-trust", "bar"), "bar")
+        self.assertEqual(informer.resource_version, "101")
+
+    def test_lookup_metrics(self):
+        import metrics
+        informer = self.informer_class("configmaps", MagicMock())
+        informer.apply_event({"type": "ADDED", "object": make_obj("test-trust", "foo"), "raw_object": {}})
+
+        def count(result):
+            return metrics.registry.get_sample_value("xos_kubernetes_cache_lookups_total",
+                                                     {"cache": "configmaps", "result": result}) or 0
+
+        (hits, misses) = (count("hit"), count("miss"))
+        informer.get("test-trust", "foo")
+        informer.get("test-trust", "bar")
+        self.assertEqual(count("hit"), hits + 1)
+        self.assertEqual(count("miss"), misses + 1)
+
+    def test_apply_event_expired(self):
+        informer = self.informer_class("configmaps", MagicMock())
+        self.assertFalse(informer.apply_event({"type": "ERROR", "object": None, "raw_object": {"code": 410}}))
+
+    def test_apply_event_error(self):
+        informer = self.informer_class("configmaps", MagicMock())
+        with self.assertRaises(Exception):
+            informer.apply_event({"type": "ERROR", "object": None, "raw_object": {"code": 500, "message": "oops"}})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import socket
+import sys
+import unittest
+from mock import patch
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+class TestKubernetesClients(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        import kubernetes_clients
+        self.kubernetes_clients = kubernetes_clients
+        self.kubernetes_clients.api_client = None
+
+    def tearDown(self):
+        self.kubernetes_clients.api_client = None
+        sys.path = self.sys_path_save
+
+    def test_shared_api_client(self):
+        with patch("kubernetes.config.load_incluster_config") as load_incluster_config:
+            core = self.kubernetes_clients.get_core_v1_api()
+            apps = self.kubernetes_clients.get_apps_v1_api()
+            batch = self.kubernetes_clients.get_batch_v1_api()
+            version = self.kubernetes_clients.get_version_api()
+
+            self.assertEqual(load_incluster_config.call_count, 1)
+
+            api_client = self.kubernetes_clients.get_api_client()
+            for api in [core, apps, batch, version]:
+                self.assertIs(api.api_client, api_client)
+
+    def test_connection_pool(self):
+        with patch("kubernetes.config.load_incluster_config"), \
+                patch.object(self.kubernetes_clients, "connection_pool_maxsize", 7):
+            api_client = self.kubernetes_clients.get_api_client()
+
+            pool_kw = api_client.rest_client.pool_manager.connection_pool_kw
+            self.assertEqual(pool_kw["maxsize"], 7)
+            self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), pool_kw["socket_options"])
+
+if __name__ == '__main__':
+    unittest.main()
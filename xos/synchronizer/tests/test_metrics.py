@@ -0,0 +1,124 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+from mock import MagicMock
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+class ApiException(Exception):
+    def __init__(self, status, *args, **kwargs):
+        super(ApiException, self).__init__(*args, **kwargs)
+        self.status = status
+
+class FakeStep(object):
+    pass
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        import metrics
+        self.metrics = metrics
+
+    def tearDown(self):
+        sys.path = self.sys_path_save
+
+    def sample(self, name, **labels):
+        return self.metrics.registry.get_sample_value(name, labels) or 0
+
+    def test_api_resource(self):
+        api_resource = self.metrics.api_resource
+        self.assertEqual(api_resource("/api/v1/pods"), "pods")
+        self.assertEqual(api_resource("/api/v1/namespaces/{namespace}/pods/{name}"), "pods")
+        self.assertEqual(api_resource("/api/v1/namespaces/foo/pods/bar/log"), "pods/log")
+        self.assertEqual(api_resource("/api/v1/namespaces/foo"), "namespaces")
+        self.assertEqual(api_resource("/api/v1/namespaces"), "namespaces")
+        self.assertEqual(api_resource("/apis/apps/v1/namespaces/foo/deployments"), "deployments")
+        self.assertEqual(api_resource("/apis/apps/v1"), "discovery")
+        self.assertEqual(api_resource("/version/"), "version")
+
+    def test_instrument_api_client(self):
+        client = MagicMock()
+        call_api = client.call_api
+        self.metrics.instrument_api_client(client)
+
+        labels = {"verb": "GET", "resource": "configmaps"}
+        requests = self.sample("xos_kubernetes_api_requests_total", **labels)
+        observed = self.sample("xos_kubernetes_api_seconds_count", **labels)
+
+        client.call_api("/api/v1/namespaces/{namespace}/configmaps/{name}", "GET", {}, [], body=None)
+        call_api.assert_called_with("/api/v1/namespaces/{namespace}/configmaps/{name}", "GET", {}, [], body=None)
+        self.assertEqual(self.sample("xos_kubernetes_api_requests_total", **labels), requests + 1)
+        self.assertEqual(self.sample("xos_kubernetes_api_seconds_count", **labels), observed + 1)
+
+        errors = self.sample("xos_kubernetes_api_errors_total", code="404", **labels)
+        call_api.side_effect = ApiException(status=404)
+        with self.assertRaises(ApiException):
+            client.call_api("/api/v1/namespaces/{namespace}/configmaps/{name}", "GET", {}, [])
+        self.assertEqual(self.sample("xos_kubernetes_api_errors_total", code="404", **labels), errors + 1)
+
+    def test_instrument_api_client_watch(self):
+        client = MagicMock()
+        self.metrics.instrument_api_client(client)
+
+        watches = self.sample("xos_kubernetes_api_requests_total", verb="WATCH", resource="pods")
+        client.call_api("/api/v1/pods", "GET", {}, [("watch", True)])
+        self.assertEqual(self.sample("xos_kubernetes_api_requests_total", verb="WATCH", resource="pods"),
+                         watches + 1)
+
+    def test_timed_step(self):
+        @self.metrics.timed_step("sync")
+        def sync_record(self, o):
+            if o == "bad":
+                raise Exception("failed")
+            return o
+
+        labels = {"step": "FakeStep", "operation": "sync"}
+        count = self.sample("xos_kubernetes_sync_seconds_count", **labels)
+        errors = self.sample("xos_kubernetes_sync_errors_total", **labels)
+
+        self.assertEqual(sync_record(FakeStep(), "good"), "good")
+        with self.assertRaises(Exception):
+            sync_record(FakeStep(), "bad")
+
+        self.assertEqual(self.sample("xos_kubernetes_sync_seconds_count", **labels), count + 2)
+        self.assertEqual(self.sample("xos_kubernetes_sync_errors_total", **labels), errors + 1)
+
+    def test_record_cache_lookup(self):
+        hits = self.sample("xos_kubernetes_cache_lookups_total", cache="test", result="hit")
+        misses = self.sample("xos_kubernetes_cache_lookups_total", cache="test", result="miss")
+        self.metrics.record_cache_lookup("test", True)
+        self.metrics.record_cache_lookup("test", True)
+        self.metrics.record_cache_lookup("test", False)
+        self.assertEqual(self.sample("xos_kubernetes_cache_lookups_total", cache="test", result="hit"), hits + 2)
+        self.assertEqual(self.sample("xos_kubernetes_cache_lookups_total", cache="test", result="miss"), misses + 1)
+
+    def test_watch_queue_depth(self):
+        publisher = MagicMock()
+        publisher.queue_depth.return_value = 12
+        self.metrics.watch_queue_depth(publisher)
+        self.assertEqual(self.sample("xos_kubernetes_kafka_queue_depth"), 12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+import unittest
+from mock import MagicMock
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+def make_k8s_pod():
+    owner_reference = MagicMock(kind="ReplicaSet", uid="rs-uid", controller=True)
+    owner_reference.name = "my-replica-set"
+
+    container = MagicMock(image="my-image:1.0")
+
+    pod = MagicMock()
+    pod.metadata.name = "my-pod"
+    pod.metadata.namespace = "my-namespace"
+    pod.metadata.self_link = "/api/v1/namespaces/my-namespace/pods/my-pod"
+    pod.metadata.labels = {"app": "my-app"}
+    pod.metadata.owner_references = [owner_reference]
+    pod.spec.service_account = "my-principal"
+    pod.spec.containers = [container, MagicMock(image="sidecar:2.0")]
+    pod.status.pod_ip = "1.2.3.4"
+    return pod
+
+class TestPodSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+        sys.path.append(os.path.join(test_path, ".."))
+
+        from pod_snapshot import PodSnapshot
+        self.snapshot_class = PodSnapshot
+
+    def tearDown(self):
+        sys.path = self.sys_path_save
+
+    def test_from_k8s(self):
+        pod = self.snapshot_class.from_k8s(make_k8s_pod())
+
+        self.assertEqual(pod.name, "my-pod")
+        self.assertEqual(pod.namespace, "my-namespace")
+        self.assertEqual(pod.self_link, "/api/v1/namespaces/my-namespace/pods/my-pod")
+        self.assertEqual(pod.labels, {"app": "my-app"})
+        self.assertEqual(pod.service_account, "my-principal")
+        self.assertEqual(pod.image, "my-image:1.0")
+        self.assertEqual(pod.pod_ip, "1.2.3.4")
+        self.assertEqual(len(pod.owner_references), 1)
+        self.assertEqual(pod.owner_references[0].key(), ("ReplicaSet", "my-replica-set", "rs-uid", True))
+
+    def test_from_k8s_no_containers_or_owners(self):
+        k8s_pod = make_k8s_pod()
+        k8s_pod.spec.containers = []
+        k8s_pod.metadata.owner_references = None
+
+        pod = self.snapshot_class.from_k8s(k8s_pod)
+
+        self.assertEqual(pod.image, None)
+        self.assertEqual(pod.owner_references, ())
+
+    def test_no_instance_dict(self):
+        pod = self.snapshot_class("my-pod")
+        with self.assertRaises(AttributeError):
+            pod.extra = 1
+
+    def test_fingerprint(self):
+        k8s_pod = make_k8s_pod()
+        fingerprint = self.snapshot_class.from_k8s(k8s_pod).fingerprint()
+        self.assertEqual(self.snapshot_class.from_k8s(k8s_pod).fingerprint(), fingerprint)
+
+        k8s_pod.status.pod_ip = "5.6.7.8"
+        self.assertNotEqual(self.snapshot_class.from_k8s(k8s_pod).fingerprint(), fingerprint)
+
+        k8s_pod.status.pod_ip = "1.2.3.4"
+        k8s_pod.metadata.labels = {"app": "other-app"}
+        self.assertNotEqual(self.snapshot_class.from_k8s(k8s_pod).fingerprint(), fingerprint)
+
+    def make_v1_pod(self):
+        from kubernetes import client as kubernetes_client
+        return kubernetes_client.V1Pod(
+            metadata=kubernetes_client.V1ObjectMeta(
+                name="my-pod",
+                namespace="my-namespace",
+                self_link="/api/v1/namespaces/my-namespace/pods/my-pod",
+                labels={"app": "my-app"},
+                owner_references=[kubernetes_client.V1OwnerReference(api_version="apps/v1",
+                                                                     kind="ReplicaSet",
+                                                                     name="my-replica-set",
+                                                                     uid="rs-uid",
+                                                                     controller=True)]),
+            spec=kubernetes_client.V1PodSpec(
+                service_account="my-principal",
+                containers=[kubernetes_client.V1Container(name="main", image="my-image:1.0")]),
+            status=kubernetes_client.V1PodStatus(pod_ip="1.2.3.4"))
+
+    def test_from_dict_matches_from_k8s(self):
+        """ A snapshot parsed from JSON matches one extracted from the equivalent kubernetes client object """
+        from kubernetes import client as kubernetes_client
+        v1_pod = self.make_v1_pod()
+        pod_json = kubernetes_client.ApiClient().sanitize_for_serialization(v1_pod)
+
+        from_dict = self.snapshot_class.from_dict(pod_json)
+        from_k8s = self.snapshot_class.from_k8s(v1_pod)
+
+        for field in self.snapshot_class.__slots__:
+            if field != "owner_references":
+                self.assertEqual(getattr(from_dict, field), getattr(from_k8s, field))
+        self.assertEqual([r.key() for r in from_dict.owner_references],
+                         [r.key() for r in from_k8s.owner_references])
+        self.assertEqual(from_dict.fingerprint(), from_k8s.fingerprint())
+
+    def test_parse_pod_list(self):
+        from kubernetes import client as kubernetes_client
+        pod_json = kubernetes_client.ApiClient().sanitize_for_serialization(self.make_v1_pod())
+        other_json = {"metadata": {"name": "other-pod", "namespace": "my-namespace"}, "spec": {}, "status": {}}
+        data = json.dumps({"kind": "PodList",
+                           "metadata": {"resourceVersion": "100"},
+                           "items": [pod_json, other_json]})
+
+        from pod_snapshot import parse_pod_list
+        (pods, resource_version, continue_token) = parse_pod_list(data)
+
+        self.assertEqual(resource_version, "100")
+        self.assertEqual(continue_token, None)
+        self.assertEqual([pod.name for pod in pods], ["my-pod", "other-pod"])
+        self.assertEqual(pods[0].image, "my-image:1.0")
+        self.assertEqual(pods[1].image, None)
+        self.assertEqual(pods[1].pod_ip, None)
+
+if __name__ == '__main__':
+    unittest.main()
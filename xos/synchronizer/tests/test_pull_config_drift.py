@@ -0,0 +1,106 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os, sys
+import unittest
+from mock import patch, MagicMock
+from unit_test_common import setup_sync_unit_test
+
+def fake_init_kubernetes_client(self):
+    self.v1core = MagicMock()
+
+def make_list(items):
+    return MagicMock(data=json.dumps({"kind": "List", "items": items}))
+
+def make_item(namespace, name, data):
+    return {"metadata": {"namespace": namespace, "name": name}, "data": data}
+
+class TestPullConfigDrift(unittest.TestCase):
+
+    def setUp(self):
+        self.unittest_setup = setup_sync_unit_test(os.path.abspath(os.path.dirname(os.path.realpath(__file__))),
+                                                   globals(),
+                                                   [("kubernetes-service", "kubernetes.xproto")] )
+
+        sys.path.append(os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))), "../pull_steps"))
+
+        import pull_config_drift
+        pull_config_drift.last_check_time = 0
+        self.pull_config_drift = pull_config_drift
+        self.pull_step_class = pull_config_drift.KubernetesConfigDriftPullStep
+
+        self.service = KubernetesService()
+        self.trust_domain = TrustDomain(id=7, name="test-trust", owner=self.service)
+
+    def tearDown(self):
+        sys.path = self.unittest_setup["sys_path_save"]
+
+    def make_config_map(self, name, data, **kwargs):
+        fields = {"enacted": 2, "updated": 1, "backend_handle": "handle"}
+        fields.update(kwargs)
+        return KubernetesConfigMap(name=name, trust_domain_id=self.trust_domain.id, data=json.dumps(data), **fields)
+
+    def test_data_hash(self):
+        data_hash = self.pull_config_drift.data_hash
+        self.assertEqual(data_hash({"a": "1", "b": "2"}), data_hash({"b": "2", "a": "1"}))
+        self.assertEqual(data_hash(None), data_hash({}))
+        self.assertNotEqual(data_hash({"a": "1"}), data_hash({"a": "2"}))
+
+    def test_pull_records(self):
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+                patch.object(TrustDomain.objects, "get_items") as trust_domain_objects, \
+                patch.object(KubernetesConfigMap.objects, "get_items") as config_map_objects, \
+                patch.object(KubernetesSecret.objects, "get_items") as secret_objects, \
+                patch.object(KubernetesConfigMap, "save", autospec=True) as config_map_save:
+            unchanged = self.make_config_map("unchanged", {"a": "1"})
+            changed = self.make_config_map("changed", {"a": "1"})
+            missing = self.make_config_map("missing", {"a": "1"})
+            dirty = self.make_config_map("dirty", {"a": "1"}, updated=3)
+            never_synced = self.make_config_map("never-synced", {"a": "1"}, enacted=None, backend_handle=None)
+
+            trust_domain_objects.return_value = [self.trust_domain]
+            config_map_objects.return_value = [unchanged, changed, missing, dirty, never_synced]
+            secret_objects.return_value = []
+
+            pull_step = self.pull_step_class()
+            pull_step.v1core.list_config_map_for_all_namespaces.return_value = make_list([
+                make_item("test-trust", "unchanged", {"a": "1"}),
+                make_item("test-trust", "changed", {"a": "2"}),
+                make_item("test-trust", "dirty", {"a": "2"})])
+
+            pull_step.pull_records()
+
+            pull_step.v1core.list_config_map_for_all_namespaces.assert_called_once_with(watch=False,
+                                                                                         _preload_content=False)
+            # No secrets in XOS, so no need to list them
+            pull_step.v1core.list_secret_for_all_namespaces.assert_not_called()
+
+            requeued = [call[0][0].name for call in config_map_save.call_args_list]
+            self.assertEqual(requeued, ["changed", "missing"])
+            config_map_save.assert_called_with(missing, update_fields=["updated"], always_update_timestamp=True)
+
+    def test_pull_records_throttled(self):
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+                patch.object(self.pull_step_class, "check_drift") as check_drift:
+            self.pull_step_class().pull_records()
+            self.pull_step_class().pull_records()
+            self.assertEqual(check_drift.call_count, 1)
+
+            self.pull_config_drift.last_check_time -= self.pull_step_class.check_interval
+            self.pull_step_class().pull_records()
+            self.assertEqual(check_drift.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
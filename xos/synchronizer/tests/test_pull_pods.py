@@ -19,10 +19,17 @@ import unittest
 from mock import patch, PropertyMock, ANY, MagicMock
 from unit_test_common import setup_sync_unit_test
 
+class ApiException(Exception):
+    def __init__(self, status, *args, **kwargs):
+        super(ApiException, self).__init__(*args, **kwargs)
+        self.status = status
+
 def fake_init_kubernetes_client(self):
     self.v1core = MagicMock()
     self.v1apps = MagicMock()
     self.v1batch = MagicMock()
+    self.kubernetes_watch = MagicMock()
+    self.ApiException = ApiException
 
 class TestPullPods(unittest.TestCase):
 
@@ -42,8 +49,26 @@ class TestPullPods(unittest.TestCase):
 
         sys.path.append(os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))), "../pull_steps"))
 
-        from pull_pods import KubernetesServiceInstancePullStep
+        from pull_pods import KubernetesServiceInstancePullStep, pod_watch_state, controller_cache, \
+            pod_event_generations, pod_fingerprints
         self.pull_step_class = KubernetesServiceInstancePullStep
+        self.pod_watch_state = pod_watch_state
+        self.pod_watch_state.reset()
+        self.controller_cache = controller_cache
+        self.controller_cache.clear()
+        self.pod_event_generations = pod_event_generations
+        self.pod_event_generations.clear()
+        self.pod_fingerprints = pod_fingerprints
+        self.pod_fingerprints.clear()
+
+        from pod_snapshot import PodSnapshot
+        self.snapshot_class = PodSnapshot
+
+        from event_publisher import EventPublisher
+        self.publisher = EventPublisher()
+        self.publisher_patcher = patch("pull_pods.publisher", self.publisher)
+        self.publisher_patcher.start()
+        self.kafka_producer = self.mockxoskafka.xoskafkaproducer.kafka_producer
 
         self.service = KubernetesService()
         self.trust_domain = TrustDomain(name="test-trust", owner=self.service)
@@ -52,6 +77,7 @@ class TestPullPods(unittest.TestCase):
 
     def tearDown(self):
         sys.path = self.unittest_setup["sys_path_save"]
+        self.publisher_patcher.stop()
         self.module_patcher.stop()
 
     def test_read_obj_kind(self):
@@ -99,9 +125,135 @@ class TestPullPods(unittest.TestCase):
             controller = pull_step.get_controller_from_obj("mypod", leaf_obj, self.trust_domain)
             self.assertEqual(controller, dep_obj)
 
+    def test_get_controller_from_obj_cached(self):
+        """ Two pods owned by the same ReplicaSet should only cause the ReplicaSet and Deployment to be read once.
+        """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            rs_ref = MagicMock(controller=True, kind="ReplicaSet", uid="rs-uid")
+            rs_ref.name = "my_replica_set"
+            pod1 = MagicMock()
+            pod1.metadata.owner_references = [rs_ref]
+            pod2 = MagicMock()
+            pod2.metadata.owner_references = [rs_ref]
+
+            dep_ref = MagicMock(controller=True, kind="Deployment", uid="dep-uid")
+            dep_ref.name = "my_deployment"
+            rs_obj = MagicMock()
+            rs_obj.metadata.owner_references = [dep_ref]
+
+            dep_obj = MagicMock()
+            dep_obj.metadata.owner_references = []
+
+            pull_step = self.pull_step_class()
+            pull_step.v1apps.read_namespaced_replica_set.return_value = rs_obj
+            pull_step.v1apps.read_namespaced_deployment.return_value = dep_obj
+
+            self.assertEqual(pull_step.get_controller_from_obj("pod1", pod1, self.trust_domain), dep_obj)
+            self.assertEqual(pull_step.get_controller_from_obj("pod2", pod2, self.trust_domain), dep_obj)
+
+            self.assertEqual(pull_step.v1apps.read_namespaced_replica_set.call_count, 1)
+            self.assertEqual(pull_step.v1apps.read_namespaced_deployment.call_count, 1)
+
+    def test_get_controller_from_obj_uid_changed(self):
+        """ An owner that has been recreated with a new uid must not be resolved from the cache """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            old_ref = MagicMock(controller=True, kind="StatefulSet", uid="old-uid")
+            old_ref.name = "my_stateful_set"
+            new_ref = MagicMock(controller=True, kind="StatefulSet", uid="new-uid")
+            new_ref.name = "my_stateful_set"
+
+            pod1 = MagicMock()
+            pod1.metadata.owner_references = [old_ref]
+            pod2 = MagicMock()
+            pod2.metadata.owner_references = [new_ref]
+
+            ss_obj = MagicMock()
+            ss_obj.metadata.owner_references = []
+
+            pull_step = self.pull_step_class()
+            pull_step.v1apps.read_namespaced_stateful_set.return_value = ss_obj
+
+            pull_step.get_controller_from_obj("pod1", pod1, self.trust_domain)
+            pull_step.get_controller_from_obj("pod2", pod2, self.trust_domain)
+
+            self.assertEqual(pull_step.v1apps.read_namespaced_stateful_set.call_count, 2)
+
+    def test_get_controller_from_obj_negative_cache(self):
+        """ An owner of an unknown kind resolves to None, and that result is cached """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+                patch.object(self.pull_step_class, "read_obj_kind") as read_obj_kind:
+            etcd_ref = MagicMock(controller=True, kind="EtcdCluster", uid="etcd-uid")
+            etcd_ref.name = "my_etcd"
+            pod = MagicMock()
+            pod.metadata.owner_references = [etcd_ref]
+
+            read_obj_kind.return_value = None
+
+            pull_step = self.pull_step_class()
+
+            self.assertEqual(pull_step.get_controller_from_obj("pod1", pod, self.trust_domain), None)
+            self.assertEqual(pull_step.get_controller_from_obj("pod2", pod, self.trust_domain), None)
+
+            self.assertEqual(read_obj_kind.call_count, 1)
+
+    def test_get_controller_from_obj_bulk_list(self):
+        """ With bulk_list_controllers set, owners are looked up by uid in lists of controllers rather than being
+            read individually.
+        """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            rs_ref = MagicMock(controller=True, kind="ReplicaSet", uid="rs-uid")
+            rs_ref.name = "my_replica_set"
+            pod = MagicMock()
+            pod.metadata.owner_references = [rs_ref]
+
+            dep_ref = MagicMock(controller=True, kind="Deployment", uid="dep-uid")
+            dep_ref.name = "my_deployment"
+            rs_obj = MagicMock()
+            rs_obj.metadata.uid = "rs-uid"
+            rs_obj.metadata.owner_references = [dep_ref]
+
+            dep_obj = MagicMock()
+            dep_obj.metadata.uid = "dep-uid"
+            dep_obj.metadata.owner_references = []
+
+            pull_step = self.pull_step_class()
+            pull_step.bulk_list_controllers = True
+            pull_step.v1apps.list_replica_set_for_all_namespaces.return_value = MagicMock(items=[rs_obj])
+            pull_step.v1apps.list_deployment_for_all_namespaces.return_value = MagicMock(items=[dep_obj])
+            pull_step.v1apps.list_stateful_set_for_all_namespaces.return_value = MagicMock(items=[])
+            pull_step.v1apps.list_daemon_set_for_all_namespaces.return_value = MagicMock(items=[])
+            pull_step.v1batch.list_job_for_all_namespaces.return_value = MagicMock(items=[])
+
+            controller = pull_step.get_controller_from_obj("mypod", pod, self.trust_domain)
+
+            self.assertEqual(controller, dep_obj)
+            self.assertEqual(controller.kind, "Deployment")
+            self.assertEqual(pull_step.v1apps.list_replica_set_for_all_namespaces.call_count, 1)
+            self.assertEqual(pull_step.v1apps.list_deployment_for_all_namespaces.call_count, 1)
+            pull_step.v1apps.read_namespaced_replica_set.assert_not_called()
+            pull_step.v1apps.read_namespaced_deployment.assert_not_called()
+
+    def test_get_controller_index_namespace_scope(self):
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            pull_step = self.pull_step_class()
+            pull_step.controller_list_scope = "namespace"
+            for list_func in [pull_step.v1apps.list_namespaced_replica_set,
+                              pull_step.v1apps.list_namespaced_stateful_set,
+                              pull_step.v1apps.list_namespaced_daemon_set,
+                              pull_step.v1apps.list_namespaced_deployment,
+                              pull_step.v1batch.list_namespaced_job]:
+                list_func.return_value = MagicMock(items=[])
+
+            pull_step.get_controller_index(self.trust_domain)
+            pull_step.get_controller_index(self.trust_domain)
+
+            self.assertEqual(pull_step.v1apps.list_namespaced_replica_set.call_count, 1)
+            pull_step.v1apps.list_namespaced_replica_set.assert_called_with("test-trust", watch=False)
+            pull_step.v1apps.list_replica_set_for_all_namespaces.assert_not_called()
+
     def test_get_slice_from_pod_exists(self):
         with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client),\
-                patch.object(self.pull_step_class, "get_controller_from_obj") as get_controller_from_obj, \
+                patch.object(self.pull_step_class, "get_controller_from_owner_references") as get_controller, \
                 patch.object(Slice.objects, "get_items") as slice_objects:
             pull_step = self.pull_step_class()
 
@@ -109,11 +261,11 @@ class TestPullPods(unittest.TestCase):
 
             dep_obj = MagicMock()
             dep_obj.metadata.name = myslice.name
-            get_controller_from_obj.return_value = dep_obj
+            get_controller.return_value = dep_obj
 
             slice_objects.return_value = [myslice]
 
-            pod = MagicMock()
+            pod = self.snapshot_class("mypod", namespace=self.trust_domain.name)
 
             slice = pull_step.get_slice_from_pod("mypod", pod, self.trust_domain, self.principal)
             self.assertEqual(slice, myslice)
@@ -123,7 +275,7 @@ class TestPullPods(unittest.TestCase):
             after the pod's controller.
         """
         with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client),\
-                patch.object(self.pull_step_class, "get_controller_from_obj") as get_controller_from_obj, \
+                patch.object(self.pull_step_class, "get_controller_from_owner_references") as get_controller, \
                 patch.object(Site.objects, "get_items") as site_objects:
             pull_step = self.pull_step_class()
 
@@ -131,9 +283,9 @@ class TestPullPods(unittest.TestCase):
 
             dep_obj = MagicMock()
             dep_obj.metadata.name = "my_other_slice"
-            get_controller_from_obj.return_value = dep_obj
+            get_controller.return_value = dep_obj
 
-            pod = MagicMock()
+            pod = self.snapshot_class("mypod", namespace=self.trust_domain.name)
 
             slice = pull_step.get_slice_from_pod("mypod", pod, self.trust_domain, self.principal)
             self.assertEqual(slice.name, "my_other_slice")
@@ -146,8 +298,7 @@ class TestPullPods(unittest.TestCase):
              patch.object(TrustDomain.objects, "get_items") as trustdomain_objects:
             pull_step = self.pull_step_class()
 
-            pod = MagicMock()
-            pod.metadata.namespace = self.trust_domain.name
+            pod = self.snapshot_class("mypod", namespace=self.trust_domain.name)
 
             trustdomain_objects.return_value = [self.trust_domain]
 
@@ -158,8 +309,7 @@ class TestPullPods(unittest.TestCase):
         with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             pull_step = self.pull_step_class()
 
-            pod = MagicMock()
-            pod.metadata.namespace = "new-trust"
+            pod = self.snapshot_class("mypod", namespace="new-trust")
 
             trustdomain = pull_step.get_trustdomain_from_pod(pod, owner_service=self.service)
             self.assertEqual(trustdomain.name, "new-trust")
@@ -170,8 +320,7 @@ class TestPullPods(unittest.TestCase):
              patch.object(Principal.objects, "get_items") as principal_objects:
             pull_step = self.pull_step_class()
 
-            pod = MagicMock()
-            pod.spec.service_account = self.principal.name
+            pod = self.snapshot_class("mypod", service_account=self.principal.name)
 
             principal_objects.return_value = [self.principal]
 
@@ -182,8 +331,7 @@ class TestPullPods(unittest.TestCase):
         with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             pull_step = self.pull_step_class()
 
-            pod = MagicMock()
-            pod.spec.service_account = "new-principal"
+            pod = self.snapshot_class("mypod", service_account="new-principal")
 
             principal = pull_step.get_principal_from_pod(pod, trust_domain=self.trust_domain)
             self.assertEqual(principal.name, "new-principal")
@@ -194,11 +342,7 @@ class TestPullPods(unittest.TestCase):
              patch.object(Image.objects, "get_items") as image_objects:
             pull_step = self.pull_step_class()
 
-            container = MagicMock()
-            container.image = "%s:%s" % (self.image.name, self.image.tag)
-
-            pod = MagicMock()
-            pod.spec.containers = [container]
+            pod = self.snapshot_class("mypod", image="%s:%s" % (self.image.name, self.image.tag))
 
             image_objects.return_value = [self.image]
 
@@ -209,28 +353,67 @@ class TestPullPods(unittest.TestCase):
         with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             pull_step = self.pull_step_class()
 
-            container = MagicMock()
-            container.image = "new-image:2.3" \
-
-            pod = MagicMock()
-            pod.spec.containers = [container]
+            pod = self.snapshot_class("mypod", image="new-image:2.3")
 
             image = pull_step.get_image_from_pod(pod)
             self.assertEqual(image.name, "new-image")
             self.assertEqual(image.tag, "2.3")
             self.assertEqual(image.kind, "container")
 
+    def test_get_image_from_pod_query_once(self):
+        """ Images are loaded with a single query per cycle, and images created during the cycle are reused """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(Image.objects, "get_items") as image_objects, \
+             patch.object(Image, "save", autospec=True) as image_save:
+            pull_step = self.pull_step_class()
+
+            image_objects.return_value = [self.image]
+
+            pod = self.snapshot_class("mypod", image="%s:%s" % (self.image.name, self.image.tag))
+            new_pod = self.snapshot_class("newpod", image="new-image:2.3")
+
+            self.assertEqual(pull_step.get_image_from_pod(pod), self.image)
+            self.assertEqual(pull_step.get_image_from_pod(pod), self.image)
+            new_image = pull_step.get_image_from_pod(new_pod)
+            self.assertEqual(pull_step.get_image_from_pod(new_pod), new_image)
+
+            self.assertEqual(image_objects.call_count, 1)
+            self.assertEqual(image_save.call_count, 1)
+
     def make_pod(self, name, trust_domain, principal, image):
+        """ Make a V1Pod-like object, as returned by the kubernetes client """
         container = MagicMock()
         container.image = "%s:%s" % (image.name, image.tag)
 
         pod = MagicMock()
         pod.metadata.name = name
         pod.metadata.namespace = trust_domain.name
+        pod.metadata.self_link = "/api/v1/namespaces/%s/pods/%s" % (trust_domain.name, name)
+        pod.metadata.labels = {}
+        pod.metadata.owner_references = []
         pod.spec.service_account = principal.name
+        pod.spec.containers = [container]
+        pod.status.pod_ip = None
 
         return pod
 
+    def make_pod_list(self, pods, resource_version=None, continue_token=None):
+        """ Make the raw response to a pod list, as returned when _preload_content is False """
+        items = []
+        for pod in pods:
+            items.append({"metadata": {"name": pod.metadata.name,
+                                       "namespace": pod.metadata.namespace,
+                                       "selfLink": pod.metadata.self_link,
+                                       "labels": pod.metadata.labels,
+                                       "ownerReferences": []},
+                          "spec": {"serviceAccount": pod.spec.service_account,
+                                   "containers": [{"image": c.image} for c in pod.spec.containers]},
+                          "status": {"podIP": pod.status.pod_ip}})
+        return MagicMock(data=json.dumps({"kind": "PodList",
+                                          "metadata": {"resourceVersion": resource_version,
+                                                       "continue": continue_token},
+                                          "items": items}))
+
     def test_pull_records_new_pod(self):
         """ A pod is found in k8s that does not exist in XOS. A new KubernetesServiceInstance should be created
         """
@@ -256,11 +439,13 @@ class TestPullPods(unittest.TestCase):
             pod.status.pod_ip = "1.2.3.4"
 
             pull_step = self.pull_step_class()
-            pull_step.v1core.list_pod_for_all_namespaces.return_value = MagicMock(items=[pod])
+            pull_step.v1core.list_pod_for_all_namespaces.return_value = self.make_pod_list([pod])
 
             pull_step.pull_records()
 
-            self.assertEqual(ksi_save.call_count, 2)
+            # need_event is not cleared until kafka confirms delivery of the event
+            self.assertEqual(ksi_save.call_count, 1)
+            self.assertEqual(self.publisher.queue_depth(), 1)
             saved_ksi = ksi_save.call_args[0][0]
 
             self.assertEqual(saved_ksi.name, "my-pod")
@@ -270,6 +455,64 @@ class TestPullPods(unittest.TestCase):
             self.assertEqual(saved_ksi.image, self.image)
             self.assertEqual(saved_ksi.xos_managed, False)
 
+    def test_pull_records_paginated(self):
+        """ Pods are listed a page at a time. Pods on every page are processed, and only XOS pods that are on no page
+            are deleted.
+        """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "process_k8s_pods") as process_k8s_pods, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects, \
+             patch.object(KubernetesServiceInstance, "delete", autospec=True) as ksi_delete:
+            service_objects.return_value = [self.service]
+
+            pod1 = self.make_pod("pod1", self.trust_domain, self.principal, self.image)
+            pod2 = self.make_pod("pod2", self.trust_domain, self.principal, self.image)
+
+            si_objects.return_value = [KubernetesServiceInstance(name="pod1", owner=self.service, xos_managed=False),
+                                       KubernetesServiceInstance(name="pod2", owner=self.service, xos_managed=False),
+                                       KubernetesServiceInstance(name="gone", owner=self.service, xos_managed=False)]
+
+            pull_step = self.pull_step_class()
+            pull_step.pod_list_page_size = 1
+            pull_step.v1core.list_pod_for_all_namespaces.side_effect = [
+                self.make_pod_list([pod1], "100", continue_token="token1"),
+                self.make_pod_list([pod2], "100")]
+
+            pull_step.pull_records()
+
+            list_calls = pull_step.v1core.list_pod_for_all_namespaces.call_args_list
+            self.assertEqual(len(list_calls), 2)
+            self.assertEqual(list_calls[0][1]["limit"], 1)
+            self.assertNotIn("_continue", list_calls[0][1])
+            self.assertEqual(list_calls[1][1]["_continue"], "token1")
+
+            self.assertEqual(process_k8s_pods.call_count, 2)
+            self.assertEqual(list(process_k8s_pods.call_args_list[0][0][0].keys()), ["pod1"])
+            self.assertEqual(list(process_k8s_pods.call_args_list[1][0][0].keys()), ["pod2"])
+
+            self.assertEqual(ksi_delete.call_count, 1)
+            self.assertEqual(ksi_delete.call_args[0][0].name, "gone")
+
+    def test_list_pod_pages_continue_expired(self):
+        """ The continue token expires part way through the list. The list restarts from the first page. """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            pod1 = self.make_pod("pod1", self.trust_domain, self.principal, self.image)
+            pod2 = self.make_pod("pod2", self.trust_domain, self.principal, self.image)
+
+            pull_step = self.pull_step_class()
+            pull_step.v1core.list_pod_for_all_namespaces.side_effect = [
+                self.make_pod_list([pod1], "100", continue_token="token1"),
+                ApiException(410),
+                self.make_pod_list([pod1], "200", continue_token="token2"),
+                self.make_pod_list([pod2], "200")]
+
+            pages = list(pull_step.list_pod_pages())
+
+            self.assertEqual([[pod.name for pod in pods] for (pods, rv) in pages], [["pod1"], ["pod1"], ["pod2"]])
+            self.assertEqual(pages[-1][1], "200")
+            self.assertNotIn("_continue", pull_step.v1core.list_pod_for_all_namespaces.call_args_list[2][1])
+
     def test_pull_records_missing_pod(self):
         """ A pod is found in k8s that does not exist in XOS. A new KubernetesServiceInstance should be created
         """
@@ -283,7 +526,7 @@ class TestPullPods(unittest.TestCase):
             si_objects.return_value = [si]
 
             pull_step = self.pull_step_class()
-            pull_step.v1core.list_pod_for_all_namespaces.return_value = MagicMock(items=[])
+            pull_step.v1core.list_pod_for_all_namespaces.return_value = self.make_pod_list([])
 
             pull_step.pull_records()
 
@@ -317,10 +560,16 @@ class TestPullPods(unittest.TestCase):
 
             pull_step = self.pull_step_class()
 
-            pull_step.v1core.list_pod_for_all_namespaces.return_value = MagicMock(items=[pod])
+            pull_step.v1core.list_pod_for_all_namespaces.return_value = self.make_pod_list([pod])
 
             pull_step.pull_records()
 
+            self.assertEqual(ksi_save.call_count, 1)
+            self.assertEqual(ksi_save.call_args[0][0].need_event, True)
+
+            # Confirm delivery of the event
+            send_notification.call_args[1]["on_delivered"]()
+
             self.assertEqual(ksi_save.call_count, 2)
 
             # Inspect the last KubernetesServiceInstance that was saved. There's no way to inspect the first one saved
@@ -336,8 +585,10 @@ class TestPullPods(unittest.TestCase):
 
             self.assertEqual(send_notification.call_count, 1)
             self.assertEqual(send_notification.call_args[0][1], saved_ksi)
-            self.assertEqual(send_notification.call_args[0][2], pod)
+            self.assertEqual(send_notification.call_args[0][2].name, "my-pod")
+            self.assertEqual(send_notification.call_args[0][2].pod_ip, "1.2.3.4")
             self.assertEqual(send_notification.call_args[0][3], "created")
+            self.assertEqual(saved_ksi.last_event_sent, "created")
 
     def test_pull_records_existing_pod_kafka_event(self):
         """ A pod is found in k8s that does not exist in XOS. A new KubernetesServiceInstance should be created
@@ -374,12 +625,25 @@ class TestPullPods(unittest.TestCase):
                                                 last_event_sent="created")
             si_objects.return_value = [xos_pod]
 
+            # The change must be recorded before need_event is saved, so that a delivery report for an earlier event
+            # arriving in between cannot clear need_event
+            saved_generations = []
+            ksi_save.side_effect = \
+                lambda obj, **kwargs: saved_generations.append(self.pod_event_generations.get("my-pod"))
+
             pull_step = self.pull_step_class()
 
-            pull_step.v1core.list_pod_for_all_namespaces.return_value = MagicMock(items=[pod])
+            pull_step.v1core.list_pod_for_all_namespaces.return_value = self.make_pod_list([pod])
 
             pull_step.pull_records()
 
+            self.assertEqual(ksi_save.call_count, 1)
+            self.assertEqual(ksi_save.call_args[0][0].need_event, True)
+            self.assertEqual(saved_generations, [1])
+
+            # Confirm delivery of the event
+            send_notification.call_args[1]["on_delivered"]()
+
             self.assertEqual(ksi_save.call_count, 2)
 
             # Inspect the last KubernetesServiceInstance that was saved. There's no way to inspect the first one saved
@@ -395,19 +659,304 @@ class TestPullPods(unittest.TestCase):
 
             self.assertEqual(send_notification.call_count, 1)
             self.assertEqual(send_notification.call_args[0][1], saved_ksi)
-            self.assertEqual(send_notification.call_args[0][2], pod)
+            self.assertEqual(send_notification.call_args[0][2].name, "my-pod")
+            self.assertEqual(send_notification.call_args[0][2].pod_ip, "1.2.3.4")
             self.assertEqual(send_notification.call_args[0][3], "updated")
+            self.assertEqual(saved_ksi.last_event_sent, "updated")
 
-    def test_send_notification_created(self):
-        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+    def test_pull_records_kafka_event_superseded(self):
+        """ The pod changes again before the event is delivered. need_event should stay set, so that another event
+            is sent.
+        """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "send_notification", autospec=True) as send_notification, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects, \
+             patch.object(KubernetesServiceInstance, "save", autospec=True) as ksi_save:
+
+            service_objects.return_value = [self.service]
+
+            pod = self.make_pod("my-pod", self.trust_domain, self.principal, self.image)
+            pod.status.pod_ip = "1.2.3.4"
+
+            xos_pod = KubernetesServiceInstance(name="my-pod",
+                                                pod_ip="",
+                                                owner=self.service,
+                                                xos_managed=False,
+                                                need_event=False,
+                                                last_event_sent="created")
+            si_objects.return_value = [xos_pod]
+
+            pull_step = self.pull_step_class()
+            pull_step.v1core.list_pod_for_all_namespaces.return_value = self.make_pod_list([pod])
+            pull_step.pull_records()
+
+            on_delivered = send_notification.call_args[1]["on_delivered"]
+
+            self.pod_event_generations.changed("my-pod")
+            on_delivered()
+
+            self.assertEqual(ksi_save.call_count, 1)
+            self.assertEqual(xos_pod.need_event, True)
+
+    def test_event_delivered_blocks_change(self):
+        """ A change recorded by the pull step while a delivery report is being handled must wait until need_event
+            has been cleared, so that the need_event it sets afterwards is not lost.
+        """
+        import threading
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(KubernetesServiceInstance, "save", autospec=True) as ksi_save:
+            xos_pod = KubernetesServiceInstance(name="my-pod", owner=self.service, need_event=True)
+            changer = threading.Thread(target=self.pod_event_generations.changed, args=("my-pod",))
+
+            def save(obj, **kwargs):
+                changer.start()
+                changer.join(0.1)
+                self.assertTrue(changer.is_alive())
+            ksi_save.side_effect = save
+
+            pull_step = self.pull_step_class()
+            pull_step.event_delivered(xos_pod, "created", self.pod_event_generations.get("my-pod"))
+            changer.join()
+
+            self.assertEqual(xos_pod.need_event, False)
+            self.assertEqual(self.pod_event_generations.get("my-pod"), 1)
+
+    def test_pull_records_unchanged_pod_skipped(self):
+        """ A pod whose fingerprint is unchanged since the last cycle, and has no outstanding event, is skipped """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "send_notification", autospec=True) as send_notification, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects, \
+             patch.object(KubernetesServiceInstance, "save", autospec=True) as ksi_save:
+
+            service_objects.return_value = [self.service]
+
+            pod = self.make_pod("my-pod", self.trust_domain, self.principal, self.image)
+            pod.status.pod_ip = "1.2.3.4"
+
+            xos_pod = KubernetesServiceInstance(name="my-pod",
+                                                pod_ip="1.2.3.4",
+                                                owner=self.service,
+                                                xos_managed=False,
+                                                need_event=False,
+                                                last_event_sent="created")
+            si_objects.return_value = [xos_pod]
+
+            self.pod_fingerprints["my-pod"] = self.snapshot_class.from_k8s(pod).fingerprint()
+
+            # Changing the ip would normally trigger an update, but xos_pod must not even be looked at
+            xos_pod.pod_ip = "5.6.7.8"
 
             pull_step = self.pull_step_class()
+            pull_step.v1core.list_pod_for_all_namespaces.return_value = self.make_pod_list([pod])
+            pull_step.pull_records()
+
+            ksi_save.assert_not_called()
+            send_notification.assert_not_called()
+
+    def test_pull_records_watch_initial_list(self):
+        """ The first cycle in watch mode lists all pods and records the resourceVersion of the list """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "get_trustdomain_from_pod") as get_trustdomain, \
+             patch.object(self.pull_step_class, "get_principal_from_pod") as get_principal, \
+             patch.object(self.pull_step_class, "get_slice_from_pod") as get_slice, \
+             patch.object(self.pull_step_class, "get_image_from_pod") as get_image, \
+             patch.object(self.pull_step_class, "watch_pod_events") as watch_pod_events, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects, \
+             patch.object(KubernetesServiceInstance, "save", autospec=True) as ksi_save:
 
-            from xoskafka import XOSKafkaProducer
+            service_objects.return_value = [self.service]
+
+            get_trustdomain.return_value = self.trust_domain
+            get_principal.return_value = self.principal
+            get_slice.return_value = Slice(name="myslice")
+            get_image.return_value = self.image
 
             pod = self.make_pod("my-pod", self.trust_domain, self.principal, self.image)
             pod.status.pod_ip = "1.2.3.4"
-            pod.metadata.labels = {"foo": "bar"}
+
+            pull_step = self.pull_step_class()
+            pull_step.watch_pods = True
+            pull_step.v1core.list_pod_for_all_namespaces.return_value = self.make_pod_list([pod], "100")
+
+            pull_step.pull_records()
+
+            watch_pod_events.assert_not_called()
+            self.assertEqual(self.pod_watch_state.resource_version, "100")
+            self.assertEqual(list(self.pod_watch_state.pods_by_name.keys()), ["my-pod"])
+            self.assertEqual(self.pod_watch_state.pods_by_name["my-pod"].pod_ip, "1.2.3.4")
+
+            saved_ksi = ksi_save.call_args[0][0]
+            self.assertEqual(saved_ksi.name, "my-pod")
+            self.assertEqual(saved_ksi.pod_ip, "1.2.3.4")
+
+    def test_pull_records_watch_deleted_event(self):
+        """ A DELETED event is received for a pod that exists in XOS. The KubernetesServiceInstance should be
+            deleted without listing pods.
+        """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "watch_pod_events") as watch_pod_events, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects, \
+             patch.object(KubernetesServiceInstance, "delete", autospec=True) as ksi_delete:
+            service_objects.return_value = [self.service]
+
+            si = KubernetesServiceInstance(name="my-pod", owner=self.service, xos_managed=False, need_event=False)
+            si_objects.return_value = [si]
+
+            pod = self.make_pod("my-pod", self.trust_domain, self.principal, self.image)
+            pod.metadata.resource_version = "101"
+
+            self.pod_watch_state.resource_version = "100"
+            self.pod_watch_state.pods_by_name = {"my-pod": self.snapshot_class.from_k8s(pod)}
+            watch_pod_events.return_value = [{"type": "DELETED", "object": pod, "raw_object": {}}]
+
+            pull_step = self.pull_step_class()
+            pull_step.watch_pods = True
+
+            pull_step.pull_records()
+
+            pull_step.v1core.list_pod_for_all_namespaces.assert_not_called()
+            watch_pod_events.assert_called_with("100")
+            self.assertEqual(ksi_delete.call_count, 1)
+            self.assertEqual(self.pod_watch_state.resource_version, "101")
+            self.assertEqual(self.pod_watch_state.pods_by_name, {})
+
+    def test_pull_records_watch_deleted_event_queue_full(self):
+        """ A DELETED event is received, but the "deleted" Kafka event cannot be queued. The KubernetesServiceInstance
+            should be kept until the event is queued on a later cycle.
+        """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "watch_pod_events") as watch_pod_events, \
+             patch.object(self.pull_step_class, "send_notification") as send_notification, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects, \
+             patch.object(KubernetesServiceInstance, "delete", autospec=True) as ksi_delete:
+            service_objects.return_value = [self.service]
+
+            si = KubernetesServiceInstance(name="my-pod", owner=self.service, xos_managed=False, need_event=False)
+            si_objects.return_value = [si]
+
+            pod = self.make_pod("my-pod", self.trust_domain, self.principal, self.image)
+            pod.metadata.resource_version = "101"
+
+            self.pod_watch_state.resource_version = "100"
+            self.pod_watch_state.pods_by_name = {"my-pod": self.snapshot_class.from_k8s(pod)}
+            watch_pod_events.return_value = [{"type": "DELETED", "object": pod, "raw_object": {}}]
+            send_notification.return_value = False
+
+            pull_step = self.pull_step_class()
+            pull_step.watch_pods = True
+
+            pull_step.pull_records()
+
+            ksi_delete.assert_not_called()
+            self.assertEqual(self.pod_watch_state.failed_deleted_names, set(["my-pod"]))
+
+            # The next cycle has no events, but sends the event and deletes the pod
+            watch_pod_events.return_value = []
+            send_notification.return_value = True
+
+            pull_step.pull_records()
+
+            self.assertEqual(send_notification.call_count, 2)
+            self.assertEqual(send_notification.call_args[0][2], "deleted")
+            self.assertEqual(ksi_delete.call_count, 1)
+            self.assertEqual(self.pod_watch_state.failed_deleted_names, set())
+
+    def test_pull_records_watch_reads_xos_pods_once(self):
+        """ Several pods change. Their KubernetesServiceInstances should be read with one query, not one per pod. """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "watch_pod_events") as watch_pod_events, \
+             patch.object(self.pull_step_class, "process_k8s_pods") as process_k8s_pods, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects:
+            service_objects.return_value = [self.service]
+            names = ["pod1", "pod2", "pod3"]
+            si_objects.return_value = [KubernetesServiceInstance(name=name, owner=self.service, xos_managed=False,
+                                                                 need_event=False) for name in names]
+            process_k8s_pods.return_value = set()
+
+            pods = [self.make_pod(name, self.trust_domain, self.principal, self.image) for name in names]
+            self.pod_watch_state.resource_version = "100"
+            watch_pod_events.return_value = [{"type": "MODIFIED", "object": pod, "raw_object": {}} for pod in pods]
+
+            pull_step = self.pull_step_class()
+            pull_step.watch_pods = True
+
+            pull_step.pull_records()
+
+            # One query for the pods that need an event, and one for the pods that changed
+            self.assertEqual(si_objects.call_count, 2)
+            (changed_pods_by_name, xos_pods_by_name, kubernetes_service) = process_k8s_pods.call_args[0]
+            self.assertEqual(sorted(changed_pods_by_name.keys()), names)
+            self.assertEqual(sorted(xos_pods_by_name.keys()), names)
+
+    def test_pull_records_watch_retries_failed_pods(self):
+        """ A pod failed to be processed last cycle. It should be processed again even though the watch reports no
+            change to it, and remembered again if it fails again.
+        """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "watch_pod_events") as watch_pod_events, \
+             patch.object(self.pull_step_class, "process_k8s_pods") as process_k8s_pods, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects:
+            service_objects.return_value = [self.service]
+            si_objects.return_value = []
+
+            pod = self.make_pod("my-pod", self.trust_domain, self.principal, self.image)
+            other_pod = self.make_pod("other-pod", self.trust_domain, self.principal, self.image)
+            snapshot = self.snapshot_class.from_k8s(pod)
+
+            self.pod_watch_state.resource_version = "100"
+            self.pod_watch_state.pods_by_name = {"my-pod": snapshot,
+                                                 "other-pod": self.snapshot_class.from_k8s(other_pod)}
+            self.pod_watch_state.failed_names = set(["my-pod", "gone-pod"])
+            watch_pod_events.return_value = []
+            process_k8s_pods.return_value = set(["my-pod"])
+
+            pull_step = self.pull_step_class()
+            pull_step.watch_pods = True
+
+            pull_step.pull_records()
+
+            self.assertEqual(process_k8s_pods.call_args[0][0], {"my-pod": snapshot})
+            self.assertEqual(self.pod_watch_state.failed_names, set(["my-pod"]))
+
+            process_k8s_pods.return_value = set()
+            pull_step.pull_records()
+            self.assertEqual(self.pod_watch_state.failed_names, set())
+
+    def test_pull_records_watch_expired(self):
+        """ The watch reports 410 Gone. The watch state should be reset so the next cycle relists. """
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+             patch.object(self.pull_step_class, "watch_pod_events") as watch_pod_events, \
+             patch.object(KubernetesService.objects, "get_items") as service_objects, \
+             patch.object(KubernetesServiceInstance.objects, "get_items") as si_objects:
+            service_objects.return_value = [self.service]
+            si_objects.return_value = []
+
+            self.pod_watch_state.resource_version = "100"
+            watch_pod_events.return_value = [{"type": "ERROR", "object": None, "raw_object": {"code": 410}}]
+
+            pull_step = self.pull_step_class()
+            pull_step.watch_pods = True
+
+            pull_step.pull_records()
+
+            self.assertEqual(self.pod_watch_state.resource_version, None)
+
+    def test_send_notification_created(self):
+        with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+
+            pull_step = self.pull_step_class()
+
+            k8s_pod = self.make_pod("my-pod", self.trust_domain, self.principal, self.image)
+            k8s_pod.status.pod_ip = "1.2.3.4"
+            k8s_pod.metadata.labels = {"foo": "bar"}
+            pod = self.snapshot_class.from_k8s(k8s_pod)
             xos_pod = KubernetesServiceInstance(name="my-pod",
                                                 pod_ip="",
                                                 owner=self.service,
@@ -417,12 +966,17 @@ class TestPullPods(unittest.TestCase):
                                                 need_event=False,
                                                 last_event_sent="created")
 
-            pull_step.send_notification(xos_pod, pod, "created")
+            self.assertTrue(pull_step.send_notification(xos_pod, pod, "created"))
 
-            self.assertEqual(XOSKafkaProducer.produce.call_count, 1)
-            topic = XOSKafkaProducer.produce.call_args[0][0]
-            key = XOSKafkaProducer.produce.call_args[0][1]
-            event = json.loads(XOSKafkaProducer.produce.call_args[0][2])
+            # A second created event for the same pod is refused while the first is in flight
+            self.assertFalse(pull_step.send_notification(xos_pod, pod, "created"))
+
+            self.publisher.drain()
+
+            self.assertEqual(self.kafka_producer.produce.call_count, 1)
+            topic = self.kafka_producer.produce.call_args[0][0]
+            event = json.loads(self.kafka_producer.produce.call_args[0][1])
+            key = self.kafka_producer.produce.call_args[0][2]
 
             self.assertEqual(topic, "xos.kubernetes.pod-details")
             self.assertEqual(key, "my-pod")
@@ -437,8 +991,6 @@ class TestPullPods(unittest.TestCase):
         with patch.object(self.pull_step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             pull_step = self.pull_step_class()
 
-            from xoskafka import XOSKafkaProducer
-
             xos_pod = KubernetesServiceInstance(name="my-pod",
                                                 pod_ip="",
                                                 owner=self.service,
@@ -447,12 +999,14 @@ class TestPullPods(unittest.TestCase):
                                                 xos_managed=False,
                                                 need_event=False,
                                                 last_event_sent="created")
-            pull_step.send_notification(xos_pod, None, "deleted")
+            self.assertTrue(pull_step.send_notification(xos_pod, None, "deleted"))
+
+            self.publisher.drain()
 
-            self.assertEqual(XOSKafkaProducer.produce.call_count, 1)
-            topic = XOSKafkaProducer.produce.call_args[0][0]
-            key = XOSKafkaProducer.produce.call_args[0][1]
-            event = json.loads(XOSKafkaProducer.produce.call_args[0][2])
+            self.assertEqual(self.kafka_producer.produce.call_count, 1)
+            topic = self.kafka_producer.produce.call_args[0][0]
+            event = json.loads(self.kafka_producer.produce.call_args[0][1])
+            key = self.kafka_producer.produce.call_args[0][2]
 
             self.assertEqual(topic, "xos.kubernetes.pod-details")
             self.assertEqual(key, "my-pod")
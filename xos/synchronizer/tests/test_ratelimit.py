@@ -0,0 +1,153 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import email.utils
+import os
+import sys
+import unittest
+from mock import patch, MagicMock
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+class ApiException(Exception):
+    def __init__(self, status, headers=None):
+        super(ApiException, self).__init__()
+        self.status = status
+        self.headers = headers
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class TestRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        import ratelimit
+        self.ratelimit = ratelimit
+
+        self.clock = FakeClock()
+        self.patches = [patch.object(ratelimit.time, "time", new=self.clock.time),
+                        patch.object(ratelimit.time, "sleep", new=self.clock.sleep)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        sys.path = self.sys_path_save
+
+    def make_client(self, limiter, max_retries=3, **request_kwargs):
+        client = MagicMock()
+        client.request = MagicMock(**request_kwargs)
+        request = client.request
+        self.ratelimit.rate_limit_api_client(client, limiter, max_retries)
+        return (client, request)
+
+    def test_token_bucket(self):
+        limiter = self.ratelimit.AdaptiveRateLimiter(qps=10, burst=3)
+        # The burst goes out at once, then one request every 1/qps
+        self.assertEqual([limiter.reserve() for i in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.reserve(), 0.1)
+        self.assertAlmostEqual(limiter.reserve(), 0.2)
+
+        self.clock.now += 10
+        self.assertEqual(limiter.reserve(), 0)
+
+    def test_disabled(self):
+        limiter = self.ratelimit.AdaptiveRateLimiter(qps=0, burst=0)
+        self.assertEqual([limiter.reserve() for i in range(100)], [0] * 100)
+
+        limiter.throttled(5)
+        self.assertEqual(limiter.qps, 0)
+        self.assertEqual(limiter.reserve(), 5)
+
+    def test_pause(self):
+        limiter = self.ratelimit.AdaptiveRateLimiter(qps=10, burst=3)
+        limiter.pause(2)
+        self.assertAlmostEqual(limiter.reserve(), 2.1)
+        self.assertAlmostEqual(limiter.reserve(), 2.2)
+
+    def test_adaptive_rate(self):
+        limiter = self.ratelimit.AdaptiveRateLimiter(qps=10, burst=3)
+
+        limiter.throttled(0)
+        self.assertEqual(limiter.qps, 5)
+        # Rejections within decrease_interval of each other only count once
+        limiter.throttled(0)
+        self.assertEqual(limiter.qps, 5)
+
+        for i in range(10):
+            self.clock.now += limiter.decrease_interval
+            limiter.throttled(0)
+        self.assertEqual(limiter.qps, limiter.min_qps)
+
+        for i in range(1000):
+            limiter.succeeded()
+        self.assertEqual(limiter.qps, 10)
+
+    def test_parse_retry_after(self):
+        parse_retry_after = self.ratelimit.parse_retry_after
+        self.assertEqual(parse_retry_after(None), None)
+        self.assertEqual(parse_retry_after("3"), 3)
+        self.assertEqual(parse_retry_after("-3"), 0)
+        self.assertEqual(parse_retry_after("soon"), None)
+        self.assertAlmostEqual(parse_retry_after(email.utils.formatdate(self.clock.now + 30)), 30, delta=1)
+
+    def test_retry_after(self):
+        limiter = self.ratelimit.AdaptiveRateLimiter(qps=0, burst=0)
+        (client, request) = self.make_client(limiter, side_effect=[ApiException(429, {"Retry-After": "4"}),
+                                                                   ApiException(503),
+                                                                   "response"])
+
+        self.assertEqual(client.request("GET", "/api/v1/pods"), "response")
+        self.assertEqual(request.call_count, 3)
+        # Retry-After from the server, then backoff without one
+        self.assertEqual(self.clock.slept, [4, limiter.retry_delay * 2])
+
+    def test_retries_exhausted(self):
+        limiter = self.ratelimit.AdaptiveRateLimiter(qps=0, burst=0)
+        (client, request) = self.make_client(limiter, max_retries=2,
+                                             side_effect=ApiException(429, {"Retry-After": "1"}))
+
+        with self.assertRaises(ApiException):
+            client.request("GET", "/api/v1/pods")
+        self.assertEqual(request.call_count, 3)
+
+    def test_other_errors_not_retried(self):
+        limiter = self.ratelimit.AdaptiveRateLimiter(qps=10, burst=3)
+        (client, request) = self.make_client(limiter, side_effect=ApiException(404))
+
+        with self.assertRaises(ApiException):
+            client.request("GET", "/api/v1/namespaces/foo")
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(limiter.qps, 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,297 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from mock import MagicMock, patch
+
+from kubernetes.client.rest import ApiException
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+CORE_V1 = {"resources": [{"name": "configmaps", "kind": "ConfigMap", "namespaced": True},
+                         {"name": "namespaces", "kind": "Namespace", "namespaced": False},
+                         {"name": "pods/log", "kind": "Pod", "namespaced": True}]}
+
+EXAMPLE_V1 = {"resources": [{"name": "widgets", "kind": "Widget", "namespaced": True}]}
+
+APPS_V1 = {"resources": [{"name": "deployments", "kind": "Deployment", "namespaced": True},
+                         {"name": "deployments/scale", "kind": "Scale", "namespaced": True}]}
+
+MANIFESTS = """
+apiVersion: v1
+kind: Namespace
+metadata:
+  name: foo
+---
+---
+apiVersion: v1
+kind: List
+items:
+- apiVersion: v1
+  kind: ConfigMap
+  metadata:
+    name: bar
+    namespace: foo
+- apiVersion: apps/v1
+  kind: Deployment
+  metadata:
+    name: baz
+"""
+
+def make_api_exception(status, message=None):
+    e = ApiException(status=status, reason="Reason")
+    if message:
+        e.body = json.dumps({"kind": "Status", "message": message})
+    return e
+
+class TestResourceApply(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        import resource_apply
+        self.resource_apply = resource_apply
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.namespace_file = os.path.join(self.tmp_dir, "namespace")
+
+        self.api_client = MagicMock()
+        with patch.dict(os.environ, {"POD_NAMESPACE": ""}), \
+                patch.object(resource_apply, "service_account_namespace_file", self.namespace_file):
+            self.applier = resource_apply.ResourceApplier(self.api_client)
+
+        # Responses to requests, keyed by (method, path). Values that are exceptions are raised.
+        self.responses = {("GET", "/api/v1"): CORE_V1,
+                          ("GET", "/apis/apps/v1"): APPS_V1,
+                          ("GET", "/apis/example.com/v1"): EXAMPLE_V1}
+        self.requests = []
+        self.query_params = []
+        self.api_client.call_api.side_effect = self.call_api
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        sys.path = self.sys_path_save
+
+    def call_api(self, path, method, query_params=None, header_params=None, body=None, **kwargs):
+        self.requests.append((method, path, header_params["Content-Type"], body))
+        self.query_params.append(query_params)
+        response = self.responses.get((method, path), {})
+        if isinstance(response, Exception):
+            raise response
+        return MagicMock(data=json.dumps(response))
+
+    def test_parse_manifests(self):
+        manifests = self.resource_apply.parse_manifests(MANIFESTS)
+        self.assertEqual([m["metadata"]["name"] for m in manifests], ["foo", "bar", "baz"])
+
+    def test_parse_manifests_not_mapping(self):
+        with self.assertRaises(self.resource_apply.ResourceApplyError):
+            self.resource_apply.parse_manifests("- foo\n- bar\n")
+
+    def test_resource_path(self):
+        Resource = self.resource_apply.Resource
+        self.assertEqual(Resource("v1", "ConfigMap", "configmaps", True).path("foo", "bar"),
+                         "/api/v1/namespaces/foo/configmaps/bar")
+        self.assertEqual(Resource("apps/v1", "Deployment", "deployments", True).path("foo"),
+                         "/apis/apps/v1/namespaces/foo/deployments")
+        self.assertEqual(Resource("v1", "Namespace", "namespaces", False).path(None, "foo"),
+                         "/api/v1/namespaces/foo")
+
+    def test_discovery_cached(self):
+        discovery = self.applier.discovery
+        self.assertEqual(discovery.get_resource("v1", "ConfigMap").plural, "configmaps")
+        self.assertFalse(discovery.get_resource("v1", "Namespace").namespaced)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_discovery_skips_subresources(self):
+        resource = self.applier.discovery.get_resource("apps/v1", "Deployment")
+        self.assertEqual(resource.plural, "deployments")
+        with self.assertRaises(self.resource_apply.ResourceApplyError):
+            self.applier.discovery.get_resource("apps/v1", "Scale")
+
+    def test_discovery_refresh(self):
+        discovery = self.applier.discovery
+        self.responses[("GET", "/apis/example.com/v1")] = make_api_exception(404)
+
+        with patch("time.time", return_value=1000):
+            with self.assertRaises(self.resource_apply.ResourceApplyError):
+                discovery.get_resource("example.com/v1", "Widget")
+
+            # Within the refresh interval, the cached result is used
+            with self.assertRaises(self.resource_apply.ResourceApplyError):
+                discovery.get_resource("example.com/v1", "Widget")
+            self.assertEqual(len(self.requests), 1)
+
+        # The CRD was installed since
+        self.responses[("GET", "/apis/example.com/v1")] = {"resources": [{"name": "widgets", "kind": "Widget",
+                                                                          "namespaced": True}]}
+        with patch("time.time", return_value=1000 + discovery.refresh_seconds + 1):
+            self.assertEqual(discovery.get_resource("example.com/v1", "Widget").plural, "widgets")
+        self.assertEqual(len(self.requests), 2)
+
+    def test_apply_update(self):
+        self.applier.apply(MANIFESTS)
+
+        writes = [r for r in self.requests if r[0] != "GET"]
+        self.assertEqual([(r[0], r[1], r[2]) for r in writes],
+                         [("PATCH", "/api/v1/namespaces/foo", "application/strategic-merge-patch+json"),
+                          ("PATCH", "/api/v1/namespaces/foo/configmaps/bar",
+                           "application/strategic-merge-patch+json"),
+                          ("PATCH", "/apis/apps/v1/namespaces/default/deployments/baz",
+                           "application/strategic-merge-patch+json")])
+        self.assertEqual(writes[0][3]["metadata"]["name"], "foo")
+
+    def test_apply_custom_resource(self):
+        manifest = {"apiVersion": "example.com/v1", "kind": "Widget", "metadata": {"name": "w", "namespace": "foo"}}
+        self.assertEqual(self.applier.apply_one(manifest), "updated")
+        self.assertEqual(self.requests[-1], ("PATCH", "/apis/example.com/v1/namespaces/foo/widgets/w",
+                                             "application/merge-patch+json", manifest))
+
+    def test_apply_strategic_merge_unsupported(self):
+        def call_api(path, method, header_params=None, **kwargs):
+            if header_params["Content-Type"] == "application/strategic-merge-patch+json":
+                self.requests.append((method, path, header_params["Content-Type"], kwargs.get("body")))
+                raise make_api_exception(415)
+            return self.call_api(path, method, header_params=header_params, **kwargs)
+        self.api_client.call_api.side_effect = call_api
+
+        manifest = {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "bar", "namespace": "foo"}}
+        self.applier.apply_one(manifest)
+        self.assertEqual([r[2] for r in self.requests if r[0] == "PATCH"],
+                         ["application/strategic-merge-patch+json", "application/merge-patch+json"])
+
+    def test_builtin(self):
+        Resource = self.resource_apply.Resource
+        self.assertTrue(Resource("v1", "Pod", "pods", True).builtin)
+        self.assertTrue(Resource("apps/v1", "Deployment", "deployments", True).builtin)
+        self.assertTrue(Resource("networking.k8s.io/v1", "Ingress", "ingresses", True).builtin)
+        self.assertFalse(Resource("example.com/v1", "Widget", "widgets", True).builtin)
+        self.assertFalse(Resource("cluster.x-k8s.io/v1", "Cluster", "clusters", True).builtin)
+
+    def test_in_cluster_namespace(self):
+        in_cluster_namespace = self.resource_apply.in_cluster_namespace
+        with patch.object(self.resource_apply, "service_account_namespace_file", self.namespace_file):
+            with patch.dict(os.environ, {"POD_NAMESPACE": ""}):
+                self.assertEqual(in_cluster_namespace(), "default")
+
+                with open(self.namespace_file, "w") as f:
+                    f.write("xos\n")
+                self.assertEqual(in_cluster_namespace(), "xos")
+
+            with patch.dict(os.environ, {"POD_NAMESPACE": "pod-ns"}):
+                self.assertEqual(in_cluster_namespace(), "pod-ns")
+
+    def test_apply_create(self):
+        self.responses[("PATCH", "/api/v1/namespaces/foo/configmaps/bar")] = make_api_exception(404)
+
+        manifest = {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "bar", "namespace": "foo"}}
+        self.assertEqual(self.applier.apply_one(manifest), "created")
+        self.assertEqual(self.requests[-1], ("POST", "/api/v1/namespaces/foo/configmaps", "application/json",
+                                             manifest))
+
+    def test_apply_error(self):
+        self.responses[("PATCH", "/api/v1/namespaces/foo/configmaps/bar")] = \
+            make_api_exception(422, "ConfigMap \"bar\" is invalid")
+
+        manifest = {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "bar", "namespace": "foo"}}
+        with self.assertRaises(self.resource_apply.ResourceApplyError) as e:
+            self.applier.apply_one(manifest)
+        self.assertEqual(e.exception.status, 422)
+        self.assertIn("ConfigMap foo/bar", str(e.exception))
+        self.assertIn("is invalid", str(e.exception))
+
+    def test_server_side_apply(self):
+        self.applier.apply(MANIFESTS, server_side=True)
+
+        writes = [r for r in self.requests if r[0] != "GET"]
+        self.assertEqual([(r[0], r[1], r[2]) for r in writes],
+                         [("PATCH", "/api/v1/namespaces/foo", "application/apply-patch+yaml"),
+                          ("PATCH", "/api/v1/namespaces/foo/configmaps/bar", "application/apply-patch+yaml"),
+                          ("PATCH", "/apis/apps/v1/namespaces/default/deployments/baz",
+                           "application/apply-patch+yaml")])
+        self.assertEqual(json.loads(writes[1][3]),
+                         {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "bar", "namespace": "foo"}})
+        self.assertEqual(self.query_params[-1], [("fieldManager", "kubernetes-synchronizer"), ("force", "true")])
+
+    def test_server_side_apply_error(self):
+        self.responses[("PATCH", "/api/v1/namespaces/foo")] = make_api_exception(409, "conflict")
+
+        manifest = {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "foo"}}
+        with self.assertRaises(self.resource_apply.ResourceApplyError) as e:
+            self.applier.server_side_apply_one(manifest)
+        self.assertEqual(e.exception.status, 409)
+
+    def test_apply_missing_name(self):
+        with self.assertRaises(self.resource_apply.ResourceApplyError):
+            self.applier.apply_one({"apiVersion": "v1", "kind": "ConfigMap", "metadata": {}})
+        self.assertEqual(self.requests, [])
+
+    def test_definition_hash(self):
+        definition_hash = self.resource_apply.definition_hash
+        self.assertEqual(definition_hash("foo"), definition_hash(u"foo"))
+        self.assertNotEqual(definition_hash("foo"), definition_hash("foo "))
+        self.assertEqual(len(definition_hash(MANIFESTS)), 64)
+        # Changing the apply mode changes the hash
+        self.assertNotEqual(definition_hash("foo"), definition_hash("foo", server_side=True))
+        self.assertEqual(definition_hash("foo", server_side=True), definition_hash(u"foo", server_side=True))
+
+    def test_exists(self):
+        self.assertTrue(self.applier.exists(MANIFESTS))
+
+        self.responses[("GET", "/api/v1/namespaces/foo/configmaps/bar")] = make_api_exception(404)
+        self.assertFalse(self.applier.exists(MANIFESTS))
+
+        # Stops at the first missing resource
+        self.assertEqual([r[1] for r in self.requests if r[1].endswith("/baz")],
+                         ["/apis/apps/v1/namespaces/default/deployments/baz"])
+
+    def test_exists_error(self):
+        self.responses[("GET", "/api/v1/namespaces/foo")] = make_api_exception(403, "forbidden")
+        with self.assertRaises(self.resource_apply.ResourceApplyError):
+            self.applier.exists(MANIFESTS)
+
+    def test_delete(self):
+        self.responses[("DELETE", "/api/v1/namespaces/foo/configmaps/bar")] = make_api_exception(404)
+
+        self.applier.delete(MANIFESTS)
+
+        deletes = [(r[0], r[1]) for r in self.requests if r[0] != "GET"]
+        self.assertEqual(deletes, [("DELETE", "/apis/apps/v1/namespaces/default/deployments/baz"),
+                                   ("DELETE", "/api/v1/namespaces/foo/configmaps/bar"),
+                                   ("DELETE", "/api/v1/namespaces/foo")])
+
+    def test_delete_not_found(self):
+        self.responses[("DELETE", "/api/v1/namespaces/foo")] = make_api_exception(404)
+        manifest = {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "foo"}}
+        self.assertFalse(self.applier.delete_one(manifest))
+
+    def test_delete_error(self):
+        self.responses[("DELETE", "/api/v1/namespaces/foo")] = make_api_exception(403, "forbidden")
+        manifest = {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "foo"}}
+        with self.assertRaises(self.resource_apply.ResourceApplyError):
+            self.applier.delete_one(manifest)
+
+if __name__ == '__main__':
+    unittest.main()
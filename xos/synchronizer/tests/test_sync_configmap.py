@@ -100,6 +100,7 @@ class TestSyncConfigmap(unittest.TestCase):
             orig_map = MagicMock()
             orig_map.data = {"foo": "not_bar"}
             orig_map.metadata.self_link = "1234"
+            orig_map.metadata.resource_version = "5"
 
             step = self.step_class(model_accessor = self.model_accessor)
             step.v1core.read_namespaced_config_map.return_value = orig_map
@@ -116,10 +117,117 @@ class TestSyncConfigmap(unittest.TestCase):
             call_args = step.v1core.patch_namespaced_config_map.call_args[0]
             self.assertEqual(call_args[0], "test-configmap")
             self.assertEqual(call_args[1], "test-trust")
-            self.assertEqual(call_args[2].data, {"foo": "bar"})
+            self.assertEqual(call_args[2], {"metadata": {"resourceVersion": "5"}, "data": {"foo": "bar"}})
 
             self.assertEqual(configmap.backend_handle, "1234")
 
+    def test_sync_record_update_removed_key(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar", "big": "unchanged"}
+            configmap = KubernetesConfigMap(trust_domain=self.trust_domain, name="test-configmap", data=json.dumps(data))
+
+            orig_map = MagicMock()
+            orig_map.data = {"foo": "not_bar", "big": "unchanged", "old": "removed"}
+            orig_map.metadata.self_link = "1234"
+            orig_map.metadata.resource_version = "5"
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.v1core.read_namespaced_config_map.return_value = orig_map
+
+            step.sync_record(configmap)
+
+            step.v1core.patch_namespaced_config_map.assert_called_with("test-configmap", "test-trust",
+                                                                     {"metadata": {"resourceVersion": "5"},
+                                                                      "data": {"foo": "bar", "old": None}})
+
+    def test_sync_record_update_unchanged(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            configmap = KubernetesConfigMap(trust_domain=self.trust_domain, name="test-configmap", data=json.dumps(data))
+
+            orig_map = MagicMock()
+            orig_map.data = {"foo": "bar"}
+            orig_map.metadata.self_link = "1234"
+            orig_map.metadata.resource_version = "5"
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.v1core.read_namespaced_config_map.return_value = orig_map
+
+            step.sync_record(configmap)
+
+            step.v1core.patch_namespaced_config_map.assert_not_called()
+            self.assertEqual(configmap.backend_handle, "1234")
+
+    def test_sync_record_create_first(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            configmap = KubernetesConfigMap(trust_domain=self.trust_domain, name="test-configmap", data=json.dumps(data))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.create_first = True
+
+            map = MagicMock()
+            map.metadata.self_link="1234"
+            step.v1core.create_namespaced_config_map.return_value = map
+
+            step.sync_record(configmap)
+
+            step.v1core.read_namespaced_config_map.assert_not_called()
+            step.v1core.create_namespaced_config_map.assert_called()
+            self.assertEqual(configmap.backend_handle, "1234")
+
+    def test_sync_record_create_first_exists(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            configmap = KubernetesConfigMap(trust_domain=self.trust_domain, name="test-configmap", data=json.dumps(data))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.create_first = True
+            step.v1core.create_namespaced_config_map.side_effect = step.ApiException(status=409)
+
+            orig_map = MagicMock()
+            orig_map.data = {"foo": "not_bar"}
+            orig_map.metadata.self_link = "1234"
+            orig_map.metadata.resource_version = "5"
+            step.v1core.read_namespaced_config_map.return_value = orig_map
+
+            step.sync_record(configmap)
+
+            step.v1core.patch_namespaced_config_map.assert_called_with("test-configmap", "test-trust",
+                                                                       {"metadata": {"resourceVersion": "5"},
+                                                                        "data": {"foo": "bar"}})
+            self.assertEqual(configmap.backend_handle, "1234")
+
+    def test_delete_record_create_first(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            configmap = KubernetesConfigMap(trust_domain=self.trust_domain, name="test-configmap", data=json.dumps(data))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.create_first = True
+            step.v1core.delete_namespaced_config_map.side_effect = step.ApiException(status=404)
+
+            step.delete_record(configmap)
+
+            step.v1core.read_namespaced_config_map.assert_not_called()
+            step.v1core.delete_namespaced_config_map.assert_called_with("test-configmap", self.trust_domain.name, ANY)
+
+    def test_delete_record_cascade_namespace_delete(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+                patch("sync_configmap.deleted_with_namespace") as deleted_with_namespace:
+            configmap = KubernetesConfigMap(trust_domain=self.trust_domain, name="test-configmap")
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.cascade_namespace_delete = True
+
+            deleted_with_namespace.return_value = True
+            step.delete_record(configmap)
+            step.v1core.delete_namespaced_config_map.assert_not_called()
+
+            deleted_with_namespace.return_value = False
+            step.delete_record(configmap)
+            step.v1core.delete_namespaced_config_map.assert_called_with("test-configmap", self.trust_domain.name, ANY)
+
     def test_delete_record(self):
         with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             data = {"foo": "bar"}
@@ -128,6 +236,7 @@ class TestSyncConfigmap(unittest.TestCase):
             orig_map = MagicMock()
             orig_map.data = {"foo": "not_bar"}
             orig_map.metadata.self_link = "1234"
+            orig_map.metadata.resource_version = "5"
 
             step = self.step_class(model_accessor = self.model_accessor)
             step.v1core.read_namespaced_config_map.return_value = orig_map
@@ -136,7 +245,51 @@ class TestSyncConfigmap(unittest.TestCase):
 
             step.v1core.delete_namespaced_config_map.assert_called_with("test-configmap", self.trust_domain.name, ANY)
 
+    def make_stale_cache(self, step, cached):
+        step.config_map_informer = MagicMock()
+        step.config_map_informer.has_synced.return_value = True
+        step.config_map_informer.get.return_value = cached
+
+    def test_sync_record_update_stale_cache_unchanged(self):
+        """ The cached copy matches XOS, but the live object does not. It should be read and patched. """
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            configmap = KubernetesConfigMap(trust_domain=self.trust_domain, name="test-configmap", data=json.dumps(data))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            self.make_stale_cache(step, MagicMock(data={"foo": "bar"}))
+
+            live = MagicMock(data={"foo": "reverted"})
+            live.metadata.resource_version = "6"
+            step.v1core.read_namespaced_config_map.return_value = live
+
+            step.sync_record(configmap)
+
+            step.v1core.read_namespaced_config_map.assert_called_with("test-configmap", "test-trust")
+            step.v1core.patch_namespaced_config_map.assert_called_once_with("test-configmap", "test-trust",
+                {"metadata": {"resourceVersion": "6"}, "data": {"foo": "bar"}})
+
+    def test_sync_record_update_stale_cache_conflict(self):
+        """ The patch based on the cached copy fails with 409. The object should be read and patched again. """
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            configmap = KubernetesConfigMap(trust_domain=self.trust_domain, name="test-configmap", data=json.dumps(data))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            cached = MagicMock(data={"foo": "old"})
+            cached.metadata.resource_version = "5"
+            self.make_stale_cache(step, cached)
+
+            live = MagicMock(data={"foo": "old", "extra": "x"})
+            live.metadata.resource_version = "6"
+            step.v1core.read_namespaced_config_map.return_value = live
+            step.v1core.patch_namespaced_config_map.side_effect = [step.ApiException(status=409), None]
+
+            step.sync_record(configmap)
 
+            self.assertEqual(step.v1core.patch_namespaced_config_map.call_count, 2)
+            step.v1core.patch_namespaced_config_map.assert_called_with("test-configmap", "test-trust",
+                {"metadata": {"resourceVersion": "6"}, "data": {"foo": "bar", "extra": None}})
 
 
 if __name__ == '__main__':
@@ -26,9 +26,7 @@ class ApiException(Exception):
         self.status = status
 
 def fake_init_kubernetes_client(self):
-    self.kubernetes_client = MagicMock()
-    self.v1core = MagicMock()
-    self.ApiException = ApiException
+    self.resource_applier = MagicMock()
 
 class TestSyncKubernetesResourceInstance(unittest.TestCase):
 
@@ -43,6 +41,8 @@ class TestSyncKubernetesResourceInstance(unittest.TestCase):
         sys.path.append(os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))), "../steps"))
 
         from sync_kubernetesresourceinstance import SyncKubernetesResourceInstance
+        from resource_apply import definition_hash
+        self.definition_hash = definition_hash
         self.step_class = SyncKubernetesResourceInstance
 
         self.service = KubernetesService()
@@ -50,83 +50,114 @@ class TestSyncKubernetesResourceInstance(unittest.TestCase):
     def tearDown(self):
         sys.path = self.unittest_setup["sys_path_save"]
 
-    @patch('subprocess.Popen')
-    def test_run_kubectl(self, mock_popen):
-        proc = Mock()
-        proc.communicate.return_value = ('output', 'error')
-        proc.returncode = 0
-
-        mock_popen.return_value = proc
+    def test_sync_record_create(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo")
 
-        step = self.step_class(model_accessor = self.model_accessor)
-        step.run_kubectl("create", "foo")
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.sync_record(xos_ri)
 
-        mock_popen.assert_called()
+            step.resource_applier.apply.assert_called_with("foo", server_side=False)
 
-    @patch('subprocess.Popen')
-    def test_run_kubectl_fail(self, mock_popen):
-        proc = Mock()
-        proc.communicate.return_value = ('output', 'error')
-        proc.returncode = 1
+            self.assertEqual(xos_ri.kubectl_state, "created")
 
-        mock_popen.return_value = proc
+    def test_sync_record_update(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo", kubectl_state="created")
 
-        step = self.step_class(model_accessor = self.model_accessor)
-        with self.assertRaises(Exception) as e:
-          step.run_kubectl("create", "foo")
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.sync_record(xos_ri)
 
-        self.assertEqual(e.exception.message, "Process failed with returncode 1")
+            step.resource_applier.apply.assert_called_with("foo", server_side=False)
 
-    def test_sync_record_create(self):
-        with patch.object(self.step_class, "run_kubectl") as run_kubectl:
-            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo")
+            self.assertEqual(xos_ri.kubectl_state, "updated")
 
-            run_kubectl.return_value = None
+    def test_sync_record_unchanged(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo",
+                                                kubectl_state="created", applied_hash=self.definition_hash("foo"))
 
             step = self.step_class(model_accessor = self.model_accessor)
+            step.resource_applier.exists.return_value = True
             step.sync_record(xos_ri)
 
-            run_kubectl.assert_called_with("apply", "foo")
+            step.resource_applier.exists.assert_called_with("foo")
+            step.resource_applier.apply.assert_not_called()
 
             self.assertEqual(xos_ri.kubectl_state, "created")
 
-    def test_sync_record_update(self):
-        with patch.object(self.step_class, "run_kubectl") as run_kubectl:
-            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo", kubectl_state="created")
-
-            run_kubectl.return_value = None
+    def test_sync_record_unchanged_drifted(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo",
+                                                kubectl_state="created", applied_hash=self.definition_hash("foo"))
 
             step = self.step_class(model_accessor = self.model_accessor)
+            step.resource_applier.exists.return_value = False
             step.sync_record(xos_ri)
 
-            run_kubectl.assert_called_with("apply", "foo")
+            step.resource_applier.apply.assert_called_with("foo", server_side=False)
 
             self.assertEqual(xos_ri.kubectl_state, "updated")
 
+    def test_sync_record_changed(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="bar",
+                                                kubectl_state="created", applied_hash=self.definition_hash("foo"))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.sync_record(xos_ri)
+
+            step.resource_applier.exists.assert_not_called()
+            step.resource_applier.apply.assert_called_with("bar", server_side=False)
+
+            self.assertEqual(xos_ri.applied_hash, self.definition_hash("bar"))
+
+    def test_sync_record_server_side_apply(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo")
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.server_side_apply = True
+            step.sync_record(xos_ri)
+
+            step.resource_applier.apply.assert_called_with("foo", server_side=True)
+
+            self.assertEqual(xos_ri.kubectl_state, "created")
+            self.assertEqual(xos_ri.applied_hash, self.definition_hash("foo", server_side=True))
+
+    def test_sync_record_apply_mode_changed(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo",
+                                                kubectl_state="created", applied_hash=self.definition_hash("foo"))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.server_side_apply = True
+            step.sync_record(xos_ri)
+
+            step.resource_applier.exists.assert_not_called()
+            step.resource_applier.apply.assert_called_with("foo", server_side=True)
+
     def test_sync_record_delete(self):
-        with patch.object(self.step_class, "run_kubectl") as run_kubectl:
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo", kubectl_state="created")
 
-            run_kubectl.return_value = None
-
             step = self.step_class(model_accessor = self.model_accessor)
             step.delete_record(xos_ri)
 
-            run_kubectl.assert_called_with("delete", "foo")
+            step.resource_applier.delete.assert_called_with("foo")
 
             self.assertEqual(xos_ri.kubectl_state, "deleted")
+            self.assertEqual(xos_ri.applied_hash, None)
 
     def test_sync_record_delete_never_created(self):
         """ If the object was never saved, then we shouldn't try to delete it """
-        with patch.object(self.step_class, "run_kubectl") as run_kubectl:
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             xos_ri = KubernetesResourceInstance(name="test-instance", owner=self.service, resource_definition="foo")
 
-            run_kubectl.return_value = None
-
             step = self.step_class(model_accessor = self.model_accessor)
             step.delete_record(xos_ri)
 
-            run_kubectl.assert_not_called()
+            step.resource_applier.delete.assert_not_called()
 
 
 if __name__ == '__main__':
@@ -42,8 +42,10 @@ class TestSyncKubernetesServiceInstance(unittest.TestCase):
 
         sys.path.append(os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))), "../steps"))
 
-        from sync_kubernetesserviceinstance import SyncKubernetesServiceInstance
+        from sync_kubernetesserviceinstance import SyncKubernetesServiceInstance, pod_spec_prefetch
         self.step_class = SyncKubernetesServiceInstance
+        self.pod_spec_prefetch = pod_spec_prefetch
+        self.pod_spec_prefetch.clear()
 
         self.service = KubernetesService()
         self.trust_domain = TrustDomain(owner=self.service, name="test-trust")
@@ -96,6 +98,172 @@ class TestSyncKubernetesServiceInstance(unittest.TestCase):
             step.v1core.create_namespaced_pod.assert_called()
             self.assertEqual(xos_si.backend_handle, "1234")
 
+    def make_live_pod(self, step, xos_si):
+        """ Return the pod generated for xos_si, with the additions Kubernetes makes to a running pod """
+        from kubernetes import client as kubernetes_client
+        pod = step.generate_pod_spec(xos_si)
+        pod.metadata.self_link = "1234"
+        pod.spec.volumes.append(kubernetes_client.V1Volume(name="default-token-abcde"))
+        pod.spec.containers[0].volume_mounts.append(
+            kubernetes_client.V1VolumeMount(name="default-token-abcde",
+                                            mount_path="/var/run/secrets/kubernetes.io/serviceaccount"))
+        return pod
+
+    def test_sync_record_update_unchanged(self):
+        from kubernetes import client as kubernetes_client
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_si = KubernetesServiceInstance(name="test-instance", slice=self.slice, image=self.image,
+                                               xos_managed=True, backend_handle="1234")
+            xos_si.kubernetes_config_volume_mounts = self.MockObjectList([])
+            xos_si.kubernetes_secret_volume_mounts = self.MockObjectList([])
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.kubernetes_client = kubernetes_client
+            step.v1core.read_namespaced_pod.return_value = self.make_live_pod(step, xos_si)
+
+            step.sync_record(xos_si)
+
+            step.v1core.patch_namespaced_pod.assert_not_called()
+            step.v1core.replace_namespaced_pod.assert_not_called()
+
+    def test_sync_record_update_image(self):
+        from kubernetes import client as kubernetes_client
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_si = KubernetesServiceInstance(name="test-instance", slice=self.slice, image=self.image,
+                                               xos_managed=True, backend_handle="1234")
+            xos_si.kubernetes_config_volume_mounts = self.MockObjectList([])
+            xos_si.kubernetes_secret_volume_mounts = self.MockObjectList([])
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.kubernetes_client = kubernetes_client
+            live_pod = self.make_live_pod(step, xos_si)
+            live_pod.spec.containers[0].image = "test-image:1.1"
+            step.v1core.read_namespaced_pod.return_value = live_pod
+
+            step.sync_record(xos_si)
+
+            step.v1core.patch_namespaced_pod.assert_called_with(
+                "test-instance", "test-trust",
+                {"spec": {"containers": [{"name": "test-instance", "image": "test-image:1.2"}]}})
+
+    def test_compute_pod_patch_immutable(self):
+        from kubernetes import client as kubernetes_client
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_si = KubernetesServiceInstance(name="test-instance", slice=self.slice, image=self.image)
+            xos_si.kubernetes_config_volume_mounts = self.MockObjectList([])
+            xos_si.kubernetes_secret_volume_mounts = self.MockObjectList([])
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.kubernetes_client = kubernetes_client
+            live_pod = self.make_live_pod(step, xos_si)
+
+            desired = step.generate_pod_spec(xos_si)
+            desired.spec.volumes.append(kubernetes_client.V1Volume(name="new-config"))
+            desired.spec.containers[0].volume_mounts.append(kubernetes_client.V1VolumeMount(name="new-config",
+                                                                                            mount_path="/etc/new"))
+
+            (pod_patch, immutable) = step.compute_pod_patch(live_pod, desired)
+
+            self.assertEqual(pod_patch, None)
+            self.assertEqual(immutable, ["spec.containers[test-instance].volumeMounts[new-config]",
+                                         "spec.volumes[new-config]"])
+
+    def test_sync_record_update_cached_pod(self):
+        from kubernetes import client as kubernetes_client
+        from sync_kubernetesserviceinstance import trim_pod
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_si = KubernetesServiceInstance(name="test-instance", slice=self.slice, image=self.image,
+                                               xos_managed=True)
+            xos_si.kubernetes_config_volume_mounts = self.MockObjectList([])
+            xos_si.kubernetes_secret_volume_mounts = self.MockObjectList([])
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.kubernetes_client = kubernetes_client
+            live_pod = self.make_live_pod(step, xos_si)
+            live_pod.status = kubernetes_client.V1PodStatus(pod_ip="1.2.3.4")
+            cached_pod = trim_pod(live_pod)
+            self.assertEqual(cached_pod.status, None)
+
+            step.pod_informer = MagicMock()
+            step.pod_informer.get.return_value = cached_pod
+
+            step.sync_record(xos_si)
+
+            step.pod_informer.get.assert_called_with("test-trust", "test-instance")
+            step.v1core.read_namespaced_pod.assert_not_called()
+            step.v1core.patch_namespaced_pod.assert_not_called()
+            self.assertEqual(xos_si.backend_handle, "1234")
+
+    def test_generate_pod_spec_prefetched(self):
+        from kubernetes import client as kubernetes_client
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+                patch.object(Slice.objects, "get_items") as slice_objects, \
+                patch.object(TrustDomain.objects, "get_items") as trust_domain_objects, \
+                patch.object(Principal.objects, "get_items") as principal_objects, \
+                patch.object(Image.objects, "get_items") as image_objects, \
+                patch.object(KubernetesConfigMap.objects, "get_items") as config_map_objects, \
+                patch.object(KubernetesSecret.objects, "get_items") as secret_objects, \
+                patch.object(KubernetesConfigVolumeMount.objects, "get_items") as config_mount_objects, \
+                patch.object(KubernetesSecretVolumeMount.objects, "get_items") as secret_mount_objects:
+            self.trust_domain.id = 11
+            self.principal.id = 12
+            self.slice.id = 13
+            self.slice.trust_domain_id = 11
+            self.slice.principal_id = 12
+            self.image.id = 14
+            config_map = KubernetesConfigMap(id=15, name="test-config", trust_domain=self.trust_domain)
+            secret = KubernetesSecret(id=16, name="test-secret", trust_domain=self.trust_domain)
+
+            xos_si = KubernetesServiceInstance(id=20, name="test-instance", slice_id=13, image_id=14, xos_managed=True)
+            other_si = KubernetesServiceInstance(id=21, name="other-instance", slice_id=13, image_id=14,
+                                                 xos_managed=False)
+
+            slice_objects.return_value = [self.slice]
+            trust_domain_objects.return_value = [self.trust_domain]
+            principal_objects.return_value = [self.principal]
+            image_objects.return_value = [self.image]
+            config_map_objects.return_value = [config_map]
+            secret_objects.return_value = [secret]
+            config_mount_objects.return_value = [
+                KubernetesConfigVolumeMount(config_id=15, service_instance_id=20, mount_path="/etc/config"),
+                KubernetesConfigVolumeMount(config_id=15, service_instance_id=21, mount_path="/etc/other")]
+            secret_mount_objects.return_value = [
+                KubernetesSecretVolumeMount(secret_id=16, service_instance_id=20, mount_path="/etc/secret")]
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.kubernetes_client = kubernetes_client
+            step.prefetch_threshold = 0
+            with patch.object(self.model_accessor, "fetch_pending") as fetch_pending:
+                fetch_pending.return_value = [xos_si, other_si]
+                self.assertEqual(step.fetch_pending(False), [xos_si, other_si])
+
+            # Only the mounts of xos_managed instances are kept
+            self.assertEqual(self.pod_spec_prefetch.instance_ids, set([20]))
+
+            pod = step.generate_pod_spec(xos_si)
+
+            self.assertEqual(pod.metadata.namespace, "test-trust")
+            self.assertEqual(pod.spec.service_account, "test-principal")
+            self.assertEqual(pod.spec.containers[0].image, "test-image:1.2")
+            self.assertEqual([v.name for v in pod.spec.volumes], ["test-config", "test-secret"])
+            self.assertEqual([m.mount_path for m in pod.spec.containers[0].volume_mounts],
+                             ["/etc/config", "/etc/secret"])
+
+    def test_fetch_pending_below_prefetch_threshold(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+                patch.object(Slice.objects, "get_items") as slice_objects:
+            xos_si = KubernetesServiceInstance(id=20, name="test-instance", slice_id=13, image_id=14, xos_managed=True)
+            self.pod_spec_prefetch.instance_ids = set([19])
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            with patch.object(self.model_accessor, "fetch_pending") as fetch_pending:
+                fetch_pending.return_value = [xos_si]
+                self.assertEqual(step.fetch_pending(False), [xos_si])
+
+            # Nothing is loaded, and nothing from an earlier cycle is kept
+            slice_objects.assert_not_called()
+            self.assertEqual(self.pod_spec_prefetch.instance_ids, set())
+
     def test_delete_record(self):
         with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             xos_si = KubernetesServiceInstance(name="test-instance", slice=self.slice, image=self.image)
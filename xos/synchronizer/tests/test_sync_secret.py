@@ -100,6 +100,7 @@ class TestSyncSecret(unittest.TestCase):
             orig_secret = MagicMock()
             orig_secret.data = {"foo": "not_bar"}
             orig_secret.metadata.self_link = "1234"
+            orig_secret.metadata.resource_version = "5"
 
             step = self.step_class(model_accessor = self.model_accessor)
             step.v1core.read_namespaced_secret.return_value = orig_secret
@@ -116,10 +117,47 @@ class TestSyncSecret(unittest.TestCase):
             call_args = step.v1core.patch_namespaced_secret.call_args[0]
             self.assertEqual(call_args[0], "test-secret")
             self.assertEqual(call_args[1], "test-trust")
-            self.assertEqual(call_args[2].data, {"foo": "bar"})
+            self.assertEqual(call_args[2], {"metadata": {"resourceVersion": "5"}, "data": {"foo": "bar"}})
 
             self.assertEqual(xos_secret.backend_handle, "1234")
 
+    def test_sync_record_update_removed_key(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar", "big": "unchanged"}
+            xos_secret = KubernetesSecret(trust_domain=self.trust_domain, name="test-secret", data=json.dumps(data))
+
+            orig_secret = MagicMock()
+            orig_secret.data = {"foo": "not_bar", "big": "unchanged", "old": "removed"}
+            orig_secret.metadata.self_link = "1234"
+            orig_secret.metadata.resource_version = "5"
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.v1core.read_namespaced_secret.return_value = orig_secret
+
+            step.sync_record(xos_secret)
+
+            step.v1core.patch_namespaced_secret.assert_called_with("test-secret", "test-trust",
+                                                                     {"metadata": {"resourceVersion": "5"},
+                                                                      "data": {"foo": "bar", "old": None}})
+
+    def test_sync_record_update_unchanged(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            xos_secret = KubernetesSecret(trust_domain=self.trust_domain, name="test-secret", data=json.dumps(data))
+
+            orig_secret = MagicMock()
+            orig_secret.data = {"foo": "bar"}
+            orig_secret.metadata.self_link = "1234"
+            orig_secret.metadata.resource_version = "5"
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.v1core.read_namespaced_secret.return_value = orig_secret
+
+            step.sync_record(xos_secret)
+
+            step.v1core.patch_namespaced_secret.assert_not_called()
+            self.assertEqual(xos_secret.backend_handle, "1234")
+
     def test_delete_record(self):
         with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             data = {"foo": "bar"}
@@ -128,6 +166,7 @@ class TestSyncSecret(unittest.TestCase):
             orig_secret = MagicMock()
             orig_secret.data = {"foo": "not_bar"}
             orig_secret.metadata.self_link = "1234"
+            orig_secret.metadata.resource_version = "5"
 
             step = self.step_class(model_accessor = self.model_accessor)
             step.v1core.read_namespaced_secret.return_value = orig_secret
@@ -136,6 +175,52 @@ class TestSyncSecret(unittest.TestCase):
 
             step.v1core.delete_namespaced_secret.assert_called_with("test-secret", self.trust_domain.name, ANY)
 
+    def make_stale_cache(self, step, cached):
+        step.secret_informer = MagicMock()
+        step.secret_informer.has_synced.return_value = True
+        step.secret_informer.get.return_value = cached
+
+    def test_sync_record_update_stale_cache_unchanged(self):
+        """ The cached copy matches XOS, but the live object does not. It should be read and patched. """
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            xos_secret = KubernetesSecret(trust_domain=self.trust_domain, name="test-secret", data=json.dumps(data))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            self.make_stale_cache(step, MagicMock(data={"foo": "bar"}))
+
+            live = MagicMock(data={"foo": "reverted"})
+            live.metadata.resource_version = "6"
+            step.v1core.read_namespaced_secret.return_value = live
+
+            step.sync_record(xos_secret)
+
+            step.v1core.read_namespaced_secret.assert_called_with("test-secret", "test-trust")
+            step.v1core.patch_namespaced_secret.assert_called_once_with("test-secret", "test-trust",
+                {"metadata": {"resourceVersion": "6"}, "data": {"foo": "bar"}})
+
+    def test_sync_record_update_stale_cache_conflict(self):
+        """ The patch based on the cached copy fails with 409. The object should be read and patched again. """
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            data = {"foo": "bar"}
+            xos_secret = KubernetesSecret(trust_domain=self.trust_domain, name="test-secret", data=json.dumps(data))
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            cached = MagicMock(data={"foo": "old"})
+            cached.metadata.resource_version = "5"
+            self.make_stale_cache(step, cached)
+
+            live = MagicMock(data={"foo": "old", "extra": "x"})
+            live.metadata.resource_version = "6"
+            step.v1core.read_namespaced_secret.return_value = live
+            step.v1core.patch_namespaced_secret.side_effect = [step.ApiException(status=409), None]
+
+            step.sync_record(xos_secret)
+
+            self.assertEqual(step.v1core.patch_namespaced_secret.call_count, 2)
+            step.v1core.patch_namespaced_secret.assert_called_with("test-secret", "test-trust",
+                {"metadata": {"resourceVersion": "6"}, "data": {"foo": "bar", "extra": None}})
+
 
 if __name__ == '__main__':
     unittest.main()
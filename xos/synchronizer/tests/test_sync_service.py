@@ -102,6 +102,30 @@ class TestSyncService(unittest.TestCase):
             step.v1core.create_namespaced_service.assert_called()
             self.assertEqual(xos_service.backend_handle, "1234")
 
+    def test_sync_record_parallel(self):
+        import threading
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_service = Service(name="test-service")
+            xos_slice = Slice(service=xos_service, trust_domain=self.trust_domain)
+            xos_service.slices = self.MockObjectList([xos_slice])
+            xos_service.serviceports = self.MockObjectList([])
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            step.parallel_workers = 1
+            step.v1core.read_namespaced_service.side_effect = step.ApiException(status=404)
+
+            threads = []
+            def create_namespaced_service(namespace, service):
+                threads.append(threading.current_thread())
+                return MagicMock()
+            step.v1core.create_namespaced_service.side_effect = create_namespaced_service
+
+            step.sync_record(xos_service)
+
+            # The service was created on a worker thread
+            self.assertEqual(len(threads), 1)
+            self.assertNotEqual(threads[0], threading.current_thread())
+
     def test_delete_record(self):
         with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             xos_service = Service(name="test-service")
@@ -121,5 +145,32 @@ class TestSyncService(unittest.TestCase):
 
             step.v1core.delete_namespaced_service.assert_called_with("test-service", self.trust_domain.name, ANY)
 
+    def test_fetch_pending(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client), \
+                patch("xossynchronizer.steps.syncstep.SyncStep.fetch_pending") as syncstep_fetch_pending, \
+                patch.object(Slice.objects, "get_items") as slice_objects, \
+                patch.object(ServicePort.objects, "get_items") as serviceport_objects:
+            ok = Service(id=1, name="ok")
+            no_slices = Service(id=2, name="no-slices")
+            no_ports = Service(id=3, name="no-ports")
+            two_trust_domains = Service(id=4, name="two-trust-domains")
+            syncstep_fetch_pending.return_value = [ok, no_slices, no_ports, two_trust_domains]
+
+            slice_objects.return_value = [Slice(service_id=1, trust_domain_id=7),
+                                          Slice(service_id=1, trust_domain_id=7),
+                                          Slice(service_id=2, trust_domain_id=None),
+                                          Slice(service_id=3, trust_domain_id=7),
+                                          Slice(service_id=4, trust_domain_id=7),
+                                          Slice(service_id=4, trust_domain_id=8)]
+            serviceport_objects.return_value = [ServicePort(service_id=1), ServicePort(service_id=2),
+                                                ServicePort(service_id=4)]
+
+            step = self.step_class(model_accessor = self.model_accessor)
+            self.assertEqual(step.fetch_pending(), [ok])
+
+            # Deleted services are not filtered
+            syncstep_fetch_pending.return_value = [no_slices]
+            self.assertEqual(step.fetch_pending(deletion=True), [no_slices])
+
 if __name__ == '__main__':
     unittest.main()
@@ -89,6 +89,21 @@ class TestSyncTrustDomain(unittest.TestCase):
             step.v1core.create_namespace.assert_called()
             self.assertEqual(xos_trustdomain.backend_handle, "1234")
 
+    def test_sync_record_create_first_exists(self):
+        with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
+            xos_trustdomain = TrustDomain(name="test-trust", backend_handle="1234")
+
+            step = self.step_class(model_accessor=self.model_accessor)
+            step.create_first = True
+            step.v1core.create_namespace.side_effect = step.ApiException(status=409)
+
+            step.sync_record(xos_trustdomain)
+
+            # The namespace already exists and the handle is known, so there is no need to read it
+            step.v1core.create_namespace.assert_called()
+            step.v1core.read_namespace.assert_not_called()
+            self.assertEqual(xos_trustdomain.backend_handle, "1234")
+
     def test_delete_record(self):
         with patch.object(self.step_class, "init_kubernetes_client", new=fake_init_kubernetes_client):
             xos_trustdomain = TrustDomain(name="test-trust")
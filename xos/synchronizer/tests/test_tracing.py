@@ -0,0 +1,159 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from mock import MagicMock
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+class ApiException(Exception):
+    def __init__(self, status, body=None):
+        super(ApiException, self).__init__()
+        self.status = status
+        self.body = body
+
+class FakeObject(object):
+    def __init__(self, name):
+        self.name = name
+
+class FakeStep(object):
+    parallel_workers = 0
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        import metrics
+        import tracing
+        self.metrics = metrics
+        self.tracing = tracing
+
+        self.tmp_dir = tempfile.mkdtemp()
+        tracing.writer = None
+        tracing.trace_file = os.path.join(self.tmp_dir, "trace.json")
+        tracing.set_context((None, None))
+
+    def tearDown(self):
+        self.tracing.writer = None
+        self.tracing.trace_file = None
+        self.tracing.profile_dir = None
+        shutil.rmtree(self.tmp_dir)
+        sys.path = self.sys_path_save
+
+    def read_events(self):
+        self.tracing.flush()
+        with open(self.tracing.trace_file) as f:
+            text = f.read()
+        # The closing bracket is optional in the trace format, but not in JSON
+        events = json.loads(text.rstrip().rstrip(",") + "]")
+        return [e for e in events if e["ph"] == "X"]
+
+    def make_client(self, **request_kwargs):
+        client = MagicMock()
+        client.request = MagicMock(**request_kwargs)
+
+        def call_api(resource_path, method, path_params=None, query_params=None, *args, **kwargs):
+            return client.request(method, resource_path)
+
+        client.call_api = call_api
+        self.metrics.instrument_api_client(client)
+        self.tracing.trace_api_client(client)
+        return client
+
+    def test_disabled(self):
+        self.tracing.trace_file = None
+        with self.tracing.span("sync", "FakeStep", "FakeObject a"):
+            pass
+        self.assertEqual(self.tracing.writer, None)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "trace.json")))
+
+    def test_api_call_attributed_to_step(self):
+        response = MagicMock(urllib3_response=True, status=200, data='{"kind": "Pod"}')
+        client = self.make_client(return_value=response)
+
+        @self.metrics.timed_step("sync")
+        def sync_record(self, o):
+            client.call_api("/api/v1/namespaces/{namespace}/pods/{name}", "GET",
+                            {"namespace": "ns1", "name": "pod1"}, [])
+
+        sync_record(FakeStep(), FakeObject("pod1"))
+
+        (api_event, step_event) = self.read_events()
+        self.assertEqual(api_event["name"], "GET pods")
+        self.assertEqual(api_event["cat"], "api")
+        self.assertEqual(api_event["args"], {"verb": "GET", "resource": "pods", "namespace": "ns1", "name": "pod1",
+                                             "status": 200, "bytes": len(response.data), "step": "FakeStep",
+                                             "object": "FakeObject pod1"})
+        self.assertEqual(step_event["cat"], "sync")
+        self.assertEqual(step_event["args"], {"step": "FakeStep", "object": "FakeObject pod1"})
+        self.assertGreaterEqual(step_event["dur"], api_event["dur"])
+
+        # The context is restored when the step returns
+        self.assertEqual(self.tracing.get_context(), (None, None))
+
+    def test_api_call_error(self):
+        client = self.make_client(side_effect=ApiException(status=404, body="not found"))
+
+        with self.assertRaises(ApiException):
+            client.call_api("/api/v1/namespaces/{namespace}", "GET", {"name": "ns1"}, [])
+
+        (api_event,) = self.read_events()
+        self.assertEqual(api_event["args"]["status"], 404)
+        self.assertEqual(api_event["args"]["bytes"], len("not found"))
+        self.assertEqual(api_event["args"]["step"], None)
+
+    def test_streamed_response_size(self):
+        response = MagicMock(spec=["status", "getheader"], status=200)
+        response.getheader.return_value = "1234"
+        self.assertEqual(self.tracing.response_size(response), 1234)
+        response.getheader.return_value = None
+        self.assertEqual(self.tracing.response_size(response), None)
+
+    def test_context_propagated_to_workers(self):
+        import workers
+        pool = workers.KeyedWorkerPool("test-tracing", 1)
+        with self.tracing.span("sync", "FakeStep", "FakeObject a"):
+            self.assertEqual(pool.run("key", self.tracing.get_context), ("FakeStep", "FakeObject a"))
+
+    def test_profile_cycle(self):
+        self.tracing.profile_dir = self.tmp_dir
+
+        class FakePullStep(object):
+            @self.metrics.timed_pull
+            def pull_records(self):
+                return "pulled"
+
+        self.assertEqual(FakePullStep().pull_records(), "pulled")
+
+        profiles = [f for f in os.listdir(self.tmp_dir) if f.startswith("FakePullStep-")]
+        self.assertEqual(len(profiles), 1)
+
+        (pull_event,) = self.read_events()
+        self.assertEqual(pull_event["cat"], "pull")
+        self.assertEqual(pull_event["name"], "FakePullStep")
+
+if __name__ == '__main__':
+    unittest.main()
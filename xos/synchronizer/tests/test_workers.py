@@ -0,0 +1,119 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import threading
+import unittest
+from mock import MagicMock
+
+test_path = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.sys_path_save = sys.path
+
+        from xosconfig import Config
+        Config.clear()
+        Config.init(os.path.join(test_path, "test_config.yaml"), "synchronizer-config-schema.yaml")
+
+        sys.path.append(os.path.join(test_path, ".."))
+
+        import workers
+        self.workers = workers
+        self.workers.pools.clear()
+
+    def tearDown(self):
+        sys.path = self.sys_path_save
+
+    def test_run_returns_result(self):
+        pool = self.workers.KeyedWorkerPool("test", 2)
+        self.assertEqual(pool.run("ns", lambda a, b: a + b, 1, b=2), 3)
+
+    def test_run_raises_exception(self):
+        pool = self.workers.KeyedWorkerPool("test", 2)
+        def fail():
+            raise KeyError("oops")
+        with self.assertRaises(KeyError):
+            pool.run("ns", fail)
+
+    def test_same_key_same_worker(self):
+        pool = self.workers.KeyedWorkerPool("test", 4)
+        names = set()
+        for i in range(10):
+            names.add(pool.run("ns", lambda: threading.current_thread().name))
+        self.assertEqual(len(names), 1)
+
+    def test_different_keys_run_concurrently(self):
+        pool = self.workers.KeyedWorkerPool("test", 2)
+
+        # Find two keys that map to different workers
+        keys = ["ns-%d" % i for i in range(10)]
+        key1 = keys[0]
+        key2 = [k for k in keys if hash(k) % 2 != hash(key1) % 2][0]
+
+        started = threading.Event()
+        release = threading.Event()
+        def block():
+            started.set()
+            release.wait(10)
+
+        blocked = threading.Thread(target=pool.run, args=(key1, block))
+        blocked.start()
+        started.wait(10)
+
+        # key2 is not held up by the blocked work on key1
+        self.assertEqual(pool.run(key2, lambda: "done"), "done")
+
+        release.set()
+        blocked.join(10)
+
+    def test_sync_thread_mark_inherited(self):
+        pool = self.workers.KeyedWorkerPool("test", 1)
+        threading.current_thread().is_sync_thread = True
+        try:
+            self.assertTrue(pool.run("ns", lambda: threading.current_thread().is_sync_thread))
+        finally:
+            threading.current_thread().is_sync_thread = False
+        self.assertFalse(pool.run("ns", lambda: threading.current_thread().is_sync_thread))
+
+    def test_parallel_reconcile(self):
+        calls = []
+
+        class FakeStep(object):
+            parallel_workers = 0
+
+            @self.workers.parallel_reconcile(lambda o: o.namespace)
+            def sync_record(self, o):
+                calls.append((o, threading.current_thread().name))
+                return "synced"
+
+        o = MagicMock(namespace="ns")
+        step = FakeStep()
+
+        # Inline
+        self.assertEqual(step.sync_record(o), "synced")
+        self.assertEqual(calls[-1], (o, threading.current_thread().name))
+        self.assertEqual(self.workers.pools, {})
+
+        # On the pool
+        step.parallel_workers = 2
+        self.assertEqual(step.sync_record(o), "synced")
+        self.assertEqual(calls[-1][0], o)
+        self.assertTrue(calls[-1][1].startswith("FakeStep-"))
+        self.assertEqual(self.workers.pools["FakeStep"].size, 2)
+
+if __name__ == '__main__':
+    unittest.main()
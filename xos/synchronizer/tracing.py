@@ -0,0 +1,215 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    tracing.py
+
+    Opt-in tracing and profiling of the synchronizer.
+
+    When trace_file is set, every sync_record, delete_record and pull_records call, every pod reconciled by the pod
+    pull step, and every request made to the Kubernetes API server is written to it in the Chrome trace event format,
+    which can be loaded in chrome://tracing or Perfetto. API requests record their verb, resource, namespace, name,
+    status, latency and response size, and the step and object they were made for.
+
+    When profile_dir is set, each pull_records cycle runs under cProfile, and its stats are dumped to a file there.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+from xosconfig import Config
+from multistructlog import create_logger
+
+log = create_logger(Config().get('logging'))
+
+# File that the trace is written to. None disables tracing.
+trace_file = None
+
+# Directory that a cProfile dump of each pull cycle is written to. None disables profiling.
+profile_dir = None
+
+# The step and object that the current thread is working on, and the status and size of its last API response
+context = threading.local()
+
+
+class TraceWriter(object):
+    """
+        TraceWriter
+
+        Appends events to a file in the JSON Array Format of the Chrome trace event format. The closing bracket of the
+        array is optional in that format, so events are written as they complete, and the file can be loaded at any
+        time, including while the synchronizer is running.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.thread_ids = set()
+        self.file = open(path, "w")
+        self.file.write("[\n")
+
+    def write_event(self, event):
+        self.file.write(json.dumps(event))
+        self.file.write(",\n")
+
+    def write(self, name, category, start, duration, args):
+        thread = threading.current_thread()
+        with self.lock:
+            if thread.ident not in self.thread_ids:
+                # Name the thread in the trace viewer
+                self.thread_ids.add(thread.ident)
+                self.write_event({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread.ident,
+                                  "args": {"name": thread.name}})
+            self.write_event({"name": name, "cat": category, "ph": "X", "pid": self.pid, "tid": thread.ident,
+                              "ts": int(start * 1000000), "dur": int(duration * 1000000), "args": args})
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+
+writer = None
+writer_lock = threading.Lock()
+
+
+def get_writer():
+    """ Return the process-wide TraceWriter, opening trace_file if necessary, or None if tracing is disabled. """
+    global writer
+    if trace_file is None:
+        return None
+    with writer_lock:
+        if writer is None:
+            writer = TraceWriter(trace_file)
+            log.info("Writing trace", trace_file=trace_file)
+    return writer
+
+
+def flush():
+    if writer is not None:
+        writer.flush()
+
+
+def get_context():
+    """ Return the step and object that the current thread is working on, so that work handed to another thread can
+        be attributed to them with set_context().
+    """
+    return (getattr(context, "step", None), getattr(context, "object", None))
+
+
+def set_context(trace_context):
+    (context.step, context.object) = trace_context
+
+
+def object_label(o):
+    return "%s %s" % (o.__class__.__name__, getattr(o, "name", None) or getattr(o, "id", None))
+
+
+@contextlib.contextmanager
+def span(category, step, label=None):
+    """ Trace the body of the with statement as work done by step, on the object described by label. API requests
+        made by the current thread in the meantime are attributed to them.
+    """
+    trace = get_writer()
+    if trace is None:
+        yield
+        return
+
+    saved_context = get_context()
+    set_context((step, label or saved_context[1]))
+    start = time.time()
+    try:
+        yield
+    finally:
+        set_context(saved_context)
+        args = {"step": step}
+        if label:
+            args["object"] = label
+        trace.write(label or step, category, start, time.time() - start, args)
+
+
+@contextlib.contextmanager
+def api_call(verb, resource, path_params=None):
+    """ Trace one request to the Kubernetes API server, made in the body of the with statement. """
+    trace = get_writer()
+    if trace is None:
+        yield
+        return
+
+    context.status = None
+    context.response_size = None
+    start = time.time()
+    try:
+        yield
+    finally:
+        (step, label) = get_context()
+        args = {"verb": verb,
+                "resource": resource,
+                "namespace": (path_params or {}).get("namespace"),
+                "name": (path_params or {}).get("name"),
+                "status": context.status,
+                "bytes": context.response_size,
+                "step": step,
+                "object": label}
+        trace.write("%s %s" % (verb, resource), "api", start, time.time() - start, args)
+
+
+def response_size(response):
+    if hasattr(response, "urllib3_response"):
+        # A RESTResponse, whose body has already been read
+        return len(response.data or "")
+    # A streamed urllib3 response. Reading its data here would consume it, so rely on the header.
+    length = response.getheader("content-length")
+    return int(length) if length else None
+
+
+def trace_api_client(client):
+    """ Record the status and size of each response received by a kubernetes ApiClient, for api_call(). """
+    request = client.request
+
+    def traced_request(*args, **kwargs):
+        if trace_file is None:
+            return request(*args, **kwargs)
+        try:
+            response = request(*args, **kwargs)
+        except Exception as e:
+            context.status = getattr(e, "status", None)
+            context.response_size = len(getattr(e, "body", None) or "")
+            raise
+        context.status = response.status
+        context.response_size = response_size(response)
+        return response
+
+    client.request = traced_request
+    return client
+
+
+def profile_cycle(step, func, *args):
+    """ Call func, and if profile_dir is set, dump a cProfile of the call to a file there named after step. """
+    if profile_dir is None:
+        return func(*args)
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        path = os.path.join(profile_dir, "%s-%d.prof" % (step, int(time.time() * 1000)))
+        try:
+            profiler.dump_stats(path)
+        except (IOError, OSError) as e:
+            log.warning("Failed to write profile", path=path, error=str(e))
@@ -0,0 +1,131 @@
+# Copyright 2017-present Open Networking Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+    workers.py
+
+    Bounded pools of worker threads for running sync step operations against Kubernetes.
+"""
+
+import functools
+import sys
+import threading
+
+import six
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from xosconfig import Config
+from multistructlog import create_logger
+import tracing
+
+log = create_logger(Config().get('logging'))
+
+
+class KeyedWorkerPool(object):
+    """
+        KeyedWorkerPool
+
+        A fixed number of worker threads. Work submitted with the same key always runs on the same worker, in the
+        order it was submitted, so operations with the same key never overlap or reorder. Work with different keys
+        runs concurrently, on up to size workers.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.queues = []
+        for i in range(size):
+            work_queue = queue.Queue()
+            thread = threading.Thread(target=self.run_worker, args=(work_queue,), name="%s-%d" % (name, i))
+            thread.daemon = True
+            thread.start()
+            self.queues.append(work_queue)
+
+    def run_worker(self, work_queue):
+        while True:
+            work = work_queue.get()
+            work()
+
+    def run(self, key, func, *args, **kwargs):
+        """ Run func on the worker for key and wait for it to finish. Returns the result of func, or raises the
+            exception it raised.
+        """
+        done = threading.Event()
+        result = {}
+
+        # XOS marks saves made from synchronizer threads, so that they do not cause the object to be synced again.
+        # Work runs on behalf of the calling thread, so it inherits the mark.
+        is_sync_thread = getattr(threading.current_thread(), "is_sync_thread", False)
+        # Likewise, API requests made by the work are traced as made on behalf of the calling thread's step.
+        trace_context = tracing.get_context()
+
+        def work():
+            threading.current_thread().is_sync_thread = is_sync_thread
+            tracing.set_context(trace_context)
+            try:
+                result["value"] = func(*args, **kwargs)
+            except BaseException:
+                result["exc_info"] = sys.exc_info()
+            finally:
+                done.set()
+
+        self.queues[hash(key) % self.size].put(work)
+        done.wait()
+
+        if "exc_info" in result:
+            six.reraise(*result["exc_info"])
+        return result.get("value")
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(name, size):
+    """ Return the process-wide pool with the given name, creating it if necessary. """
+    with pools_lock:
+        pool = pools.get(name)
+        if not pool:
+            pool = KeyedWorkerPool(name, size)
+            pools[name] = pool
+    return pool
+
+
+def parallel_reconcile(key_func):
+    """ Decorator for the sync_record and delete_record methods of a sync step.
+
+        If the step's parallel_workers is zero, the method runs inline, one object at a time. Otherwise it runs on a
+        pool of parallel_workers threads shared by every instance of the step, and the calling thread waits for it.
+        key_func(o) returns the ordering key of an object, usually its namespace: operations on objects with the
+        same key run one at a time, in the order they were submitted.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, o):
+            if not self.parallel_workers:
+                return method(self, o)
+            try:
+                key = key_func(o)
+            except Exception:
+                # Objects whose key cannot be determined, for example because a dependency is missing, share one
+                # ordering key. The method itself reports the problem.
+                key = None
+            pool = get_pool(self.__class__.__name__, self.parallel_workers)
+            return pool.run(key, method, self, o)
+        return wrapper
+    return decorator